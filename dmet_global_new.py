@@ -41,6 +41,9 @@ class EmbSys(object):
         self.vfit_ci = []
         self.leastsq = True
         self.translational = True
+# width of the Fermi-Dirac smearing for the DM fitting.  It helps the fitting
+# when the HOMO-LUMO gap is closed.  The smearing is annealed toward 0.
+        self.fit_smearing = 0
 
         self.vfit_ci_method = gen_all_vfit_by(fit_chemical_potential)
 
@@ -256,9 +259,18 @@ class EmbSys(object):
                 v = self.unpack([v[bidx[:,None],bidx]])
             return v
 
+        smear = [self.fit_smearing]
+        def occ_coeff(e, c):
+            if smear[0] > 0:
+                mo_occ = fitdm.fermi_smearing_occ(e, nocc, smear[0])
+                return c * numpy.sqrt(mo_occ)
+            else:
+                return c[:,:nocc]
+
         def diff_dm(vfit):
             f = fock0+_decompress(vfit)
             e, c = scipy.linalg.eigh(f)
+            c = occ_coeff(e, c)
             ddm = []
             for m,emb in enumerate(self.embs):
                 bidx = numpy.array(emb.bas_on_frag)
@@ -269,7 +281,7 @@ class EmbSys(object):
                 else:
                     c1 = numpy.vstack((c[bidx], numpy.dot(emb.bath_orb.T,c)))
                     dm_ref = dm_ref_alpha[m]
-                dm0 = numpy.dot(c1[:,:nocc], c1[:,:nocc].T)
+                dm0 = numpy.dot(c1, c1.T)
                 ddm.append((dm0-dm_ref).ravel())
             return numpy.hstack(ddm)
 
@@ -277,7 +289,11 @@ class EmbSys(object):
             e, c = scipy.linalg.eigh(fock0+_decompress(vfit))
             nao, nmo = c.shape
             nvir = nmo - nocc
-            eia = 1 / (e[:nocc].reshape(nocc,1) - e[nocc:])
+            if smear[0] > 0:
+                mo_occ = fitdm.fermi_smearing_occ(e, nocc, smear[0])
+                k, df = fitdm.smearing_response(e, mo_occ, smear[0])
+            else:
+                eia = 1 / (e[:nocc].reshape(nocc,1) - e[nocc:])
             ddm = []
             xtmp = []
             for m,emb in enumerate(self.embs):
@@ -295,11 +311,22 @@ class EmbSys(object):
 
                 tmpcc = numpy.einsum('ik,jk->kij', c1, c)
                 v = tmpcc.reshape(nmo,-1)
-                _x = reduce(numpy.dot, (v[nocc:].T, eia.T, v[:nocc]))
-                _x = _x.reshape(nf,nao,nf,nao) # nf for dm, nao for v
-                x0 = _x.transpose(0,2,1,3)
-                x1 = x0.transpose(1,0,3,2)
-                xx = x0 + x1
+                if smear[0] > 0:
+                    _x = reduce(numpy.dot, (v.T, k, v))
+                    _x = _x.reshape(nf,nao,nf,nao)
+                    xx = _x.transpose(0,2,1,3)
+                    sdf = df.sum()
+                    if abs(sdf) > 1e-14:
+# the chemical potential moves to keep the number of electrons
+                        wdm = numpy.einsum('p,ip,jp->ij', df, c1, c1)
+                        wv = numpy.einsum('p,ip,jp->ij', df, c, c)
+                        xx = xx - numpy.einsum('ij,kl->ijkl', wdm, wv) / sdf
+                else:
+                    _x = reduce(numpy.dot, (v[nocc:].T, eia.T, v[:nocc]))
+                    _x = _x.reshape(nf,nao,nf,nao) # nf for dm, nao for v
+                    x0 = _x.transpose(0,2,1,3)
+                    x1 = x0.transpose(1,0,3,2)
+                    xx = x0 + x1
                 xtmp.append(xx.reshape(nf*nf,-1))
             xtmp = numpy.vstack(xtmp).reshape(-1,nao,nao)
             x = []
@@ -324,19 +351,29 @@ class EmbSys(object):
         for m,emb in enumerate(self.embs):
             nimp = len(emb.bas_on_frag)
             p0 += nimp * (nimp+1) // 2
-        vfit0 = numpy.zeros(p0)
-        if self.leastsq:
-            x = scipy.optimize.leastsq(diff_dm, vfit0, Dfun=jac_ddm,
-                                       ftol=1e-8, maxfev=40)
-            log.debug(self, 'norm(ddm) %s', numpy.linalg.norm(diff_dm(x[0])))
-            sol = _decompress(x[0])
-        else:
-            x = scipy.optimize.minimize(lambda x:numpy.linalg.norm(diff_dm(x))**2,
-                                        vfit0,
-                                        jac=lambda x:numpy.einsum('i,ij->j',diff_dm(x),jac_ddm(x)),
-                                        options={'disp':False}).x
-            log.debug(self, 'norm(ddm) %s', numpy.linalg.norm(diff_dm(x)))
-            sol = _decompress(x)
+        x = numpy.zeros(p0)
+        while True:
+            if self.leastsq:
+                x = scipy.optimize.leastsq(diff_dm, x, Dfun=jac_ddm,
+                                           ftol=1e-8, maxfev=40)[0]
+            else:
+                x = scipy.optimize.minimize(lambda x:numpy.linalg.norm(diff_dm(x))**2,
+                                            x,
+                                            jac=lambda x:numpy.einsum('i,ij->j',diff_dm(x),jac_ddm(x)),
+                                            options={'disp':False}).x
+            log.debug(self, 'smearing %g, norm(ddm) %s',
+                      smear[0], numpy.linalg.norm(diff_dm(x)))
+            if smear[0] == 0:
+                break
+# anneal the smearing; drop it once the fitted potential opens the gap
+            e = scipy.linalg.eigh(fock0+_decompress(x))[0]
+            if nocc < e.size and e[nocc] - e[nocc-1] > smear[0] * 40:
+                smear[0] = 0
+            elif smear[0] * fitdm.SMEARING_ANNEAL < fitdm.SMEARING_MIN:
+                break
+            else:
+                smear[0] *= fitdm.SMEARING_ANNEAL
+        sol = _decompress(x)
 
         sol -= numpy.eye(nao)*sol.diagonal().mean()
         vfit_mf = []
@@ -15,6 +15,7 @@ from pyscf import ao2mo
 from pyscf import lo
 from pyscf import tools
 import pyscf.scf.diis
+import fitdm
 
 
 def select_ao_on_fragment(mol, atm_lst, bas_idx=[]):
@@ -334,6 +335,20 @@ class RHF(scf.hf.RHF):
         log.debug1(self, 'density.diag = %s', dm.diagonal())
         return dm
 
+    def dm_response(self, mo_energy=None, mo_coeff=None, mo_occ=None):
+        '''X[p,q,i,j] = d dm_pq / d v_ij of make_rdm1 on the embedding basis,
+        for a potential v added to the converged fock.  The response of the
+        mean-field (veff) is not included.'''
+        if mo_energy is None:
+            mo_energy = self.mo_energy
+        if mo_coeff is None:
+            mo_coeff = self.mo_coeff_on_imp
+        if mo_occ is None:
+            mo_occ = self.mo_occ
+        nemb = mo_coeff.shape[0]
+        nocc = int((mo_occ>0).sum())
+        return fitdm.mat_v_to_mat_dm1(mo_energy, mo_coeff, nocc, nemb, nemb) * 2
+
     def eri_on_impbas(self, mol):
         if self.entire_scf._eri is not None:
             eri = ao2mo.incore.full(self.entire_scf._eri, self.impbas_coeff)
@@ -706,6 +721,21 @@ class UHF(RHF, scf.uhf.UHF):
         #log.debug(self, 'beta  density.diag = %s', dm_b.diagonal())
         return (dm_a,dm_b)
 
+    def dm_response(self, mo_energy=None, mo_coeff=None, mo_occ=None):
+        if mo_energy is None:
+            mo_energy = self.mo_energy
+        if mo_coeff is None:
+            mo_coeff = self.mo_coeff_on_imp
+        if mo_occ is None:
+            mo_occ = self.mo_occ
+        nemb = mo_coeff[0].shape[0]
+        x = []
+        for s in range(2):
+            nocc = int((mo_occ[s]>0).sum())
+            x.append(fitdm.mat_v_to_mat_dm1(mo_energy[s], mo_coeff[s], \
+                                            nocc, nemb, nemb))
+        return x
+
     def imp_scf(self):
         self.dump_flags()
         self.build_()
@@ -95,6 +95,9 @@ class EmbSys(object):
 # if > 0, scale the fitting potential, it helps convergence when
 # local_vfit_method is fit_without_local_scf
         self.fitpot_damp_fac  = .6
+# width of the Fermi-Dirac smearing in fit_without_local_scf.  It is annealed
+# toward 0 during the fitting; set it (~0.1) for gapless embedding problems
+        self.fit_smearing     = 0
 # when vfit covers imp+bath, with_hopping=true will transform the
 # imp-bath off-diagonal block to the global potential 
         self.with_hopping     = False
@@ -114,13 +117,21 @@ class EmbSys(object):
         self.uniq_frags = None
         self.entire_scf = entire_scf
         self.embs = []
-        #self.vfit_mf_method = gen_all_vfit_by(fit_with_local_scf)
-        #self.vfit_mf_method = gen_all_vfit_by(fit_pot_1shot)
-        #self.vfit_mf_method = gen_all_vfit_by(fit_fixed_mf_dm)
-        self.vfit_mf_method = gen_all_vfit_by(fit_without_local_scf)
-        #self.vfit_ci_method = gen_all_vfit_by(zero_potential)
-        self.vfit_ci_method = gen_all_vfit_by(fit_chemical_potential)
+# the local fittings of vfit_mf_method and vfit_ci_method
+# * FITTING_WITHOUT_SCF: fit_without_local_scf for the MF potential,
+#   fit_chemical_potential for the correlated solver
+# * FITTING_WITH_SCF: fit_with_local_scf (embedding SCF during the fitting,
+#   RHF embedding only) for the MF potential
+# * FITTING_FCI_POT: the MF potential is kept, the potential of the correlated
+#   solver is fitted to the embedding HF DM by fit_fixed_mf_dm
+# vfit_mf_method/vfit_ci_method can also be set to gen_all_vfit_by(...) of
+# any other local fitting, e.g. zero_potential
+        self.local_fit_approx = FITTING_WITHOUT_SCF
         self.solver = impsolver.FCI()
+# a solverpool.SolverPool (or molproitrf.MolproPool for the molpro solvers)
+# to run the fragments in parallel.  It should be created with the same
+# solver as self.solver
+        self.solver_pool = None
 
         self._init_v = init_v
         self._final_v = None
@@ -140,8 +151,27 @@ class EmbSys(object):
         log.info(self, 'env_pot_for_ci  = %g', self.env_pot_for_ci )
         log.info(self, 'hf_follow_state = %g', self.hf_follow_state)
         log.info(self, 'fitpot_damp_fac = %g', self.fitpot_damp_fac)
+        log.info(self, 'fit_smearing    = %g', self.fit_smearing   )
         log.info(self, 'with_hopping    = %g', self.with_hopping   )
         log.info(self, 'rand_init       = %g', self.rand_init      )
+        log.info(self, 'local_fit_approx = %g', self.local_fit_approx)
+
+    def vfit_mf_method(self, mol, embsys):
+        if self.local_fit_approx == FITTING_WITH_SCF:
+            return gen_all_vfit_by(fit_with_local_scf)(mol, embsys)
+        elif self.local_fit_approx == FITTING_FCI_POT:
+            return [emb.vfit_mf for emb in embsys.embs]
+        elif self.local_fit_approx == FITTING_WITHOUT_SCF:
+            return gen_all_vfit_by(fit_without_local_scf)(mol, embsys)
+        else:
+            raise ValueError('unknown local_fit_approx %s' %
+                             self.local_fit_approx)
+
+    def vfit_ci_method(self, mol, embsys):
+        if self.local_fit_approx == FITTING_FCI_POT:
+            return gen_all_vfit_by(fit_fixed_mf_dm)(mol, embsys)
+        else:
+            return gen_all_vfit_by(fit_chemical_potential)(mol, embsys)
 
 
     def init_embsys(self, mol):
@@ -260,20 +290,6 @@ class EmbSys(object):
         return embs
 
     def update_embs_vfit_ci(self, mol, embs, v_ci_group):
-        def embscf_(emb, vfit):
-            h1e = emb._pure_hcore + emb._vhf_env + vfit
-            nemb = emb.impbas_coeff.shape[1]
-            rdm1 = emb.make_rdm1()
-            emb.get_hcore = lambda *args: h1e
-            emb.get_ovlp = lambda *args: numpy.eye(nemb)
-            emb.scf_conv, emb.e_tot, emb.mo_energy, \
-                    emb.mo_coeff_on_imp, emb.mo_occ \
-                    = scf.hf.kernel(emb, emb.conv_tol,
-                                    dump_chk=False, dm0=rdm1)
-            #ABORTemb.mo_coeff = numpy.dot(emb.impbas_coeff, emb.mo_coeff_on_imp)
-            del(emb.get_hcore)
-            del(emb.get_ovlp)
-
         for m, emb in enumerate(embs):
             if v_ci_group[m] is not 0:
                 if v_ci_group[m].shape[0] < emb.impbas_coeff.shape[1]:
@@ -398,14 +414,26 @@ class EmbSys(object):
         nelec = 0
         e_corr = 0
 
+        if self.solver_pool is not None:
+            pool = self.solver_pool
+            tids = []
+            for m, emb in enumerate(self.embs):
+                pool.load(m, emb)
+                tids.append(pool.submit(m, emb.vfit_ci, with_1pdm=True,
+                                        with_e2frag=len(emb.bas_on_frag)))
+            results = pool.gather(tids)
+
         last_frag = -1
         for m, _, _ in self.all_frags:
             if m != last_frag:
                 emb = self.embs[m]
                 nimp = len(emb.bas_on_frag)
-                _, e2frag, dm1 = \
-                        self.solver.run(emb, emb._eri, emb.vfit_ci,
-                                        with_1pdm=True, with_e2frag=nimp)
+                if self.solver_pool is not None:
+                    _, e2frag, dm1 = results[m]
+                else:
+                    _, e2frag, dm1 = \
+                            self.solver.run(emb, emb._eri, emb.vfit_ci,
+                                            with_1pdm=True, with_e2frag=nimp)
                 e_frag, nelec_frag = \
                         self.extract_frag_energy(emb, dm1, e2frag)
 
@@ -430,7 +458,7 @@ class EmbSys(object):
         nelec_frag = dm1[:nimp].trace()
 
 # overwrite dm1 because the MP2 dm1 does not contribute to MP2 energy
-        if isinstance(self.solver, impsolver.MP2):
+        if isinstance(self.solver.solver_for(emb), impsolver.MP2):
             dm1 = emb.make_rdm1(emb.mo_coeff_on_imp)
 
         e1_frag = numpy.dot(dm1[:nimp,:nimp].flatten(),h1e[:nimp,:nimp].flatten())
@@ -550,6 +578,8 @@ class EmbSys(object):
         e_tot, e_corr, nelec = self.assemble_frag_energy(mol)
         log.log(self, 'macro iter = X, e_tot = %.11g, e_tot(corr) = %.12g, +nuc = %.11g, nelec = %.8g', \
                 e_tot, e_corr, e_tot+mol.energy_nuc(), nelec)
+        if getattr(self.solver, 'cache', None) is not None:
+            self.solver.cache.dump_stats(self)
         if isinstance(sav_v, str):
             if self.with_hopping:
                 v_add = self.assemble_to_fullmat(v_mf_group)
@@ -589,6 +619,24 @@ class EmbSys(object):
 ###########################################################
 # fitting methods
 ###########################################################
+# embedding SCF with the fitting potential vfit, started from the current DM
+def embscf_(emb, vfit):
+    h1e = emb._pure_hcore + emb._vhf_env + vfit
+    nemb = emb.impbas_coeff.shape[1]
+    rdm1 = emb.make_rdm1()
+    emb.get_hcore = lambda *args: h1e
+    emb.get_ovlp = lambda *args: numpy.eye(nemb)
+    emb.scf_conv, emb.e_tot, emb.mo_energy, \
+            emb.mo_coeff_on_imp, emb.mo_occ \
+            = scf.hf.kernel(emb, emb.conv_tol,
+                            dump_chk=False, dm0=rdm1)
+    #ABORTemb.mo_coeff = numpy.dot(emb.impbas_coeff, emb.mo_coeff_on_imp)
+    del(emb.get_hcore)
+    del(emb.get_ovlp)
+
+def imp_blk_walkers(nimp):
+    return [(i,j) for i in range(nimp) for j in range(i+1)]
+
 ##ABORT to minimize the DM difference, use mean-field analytic gradients
 def fit_without_local_scf(mol, emb, embsys):
     dm_ref = embsys.solver.run(emb, emb._eri, emb.vfit_ci, True, False)[2]
@@ -602,7 +650,8 @@ def fit_without_local_scf(mol, emb, embsys):
     # but it may help convergence
     dv = fitdm.fit_solver(embsys, fock0, nocc, nimp, dm_ref*.5, \
                           embsys.v_fit_domain, embsys.dm_fit_domain, \
-                          embsys.dm_fit_constraint)
+                          embsys.dm_fit_constraint, \
+                          sigma=embsys.fit_smearing)
     if embsys.fitpot_damp_fac > 0:
         dv *= embsys.fitpot_damp_fac
     if dv.size > emb.vfit_mf.size:
@@ -616,15 +665,49 @@ def fit_without_local_scf(mol, emb, embsys):
         return dv1
 
 def fit_with_local_scf(mol, emb, embsys):
-    # impurity SCF during local fitting
-    assert(0)
+    '''impurity SCF during local fitting.  The potential on the impurity block
+    is fitted to match the impurity block of the embedding SCF DM; the
+    Jacobian is the mean-field response emb.dm_response of the SCF at each
+    trial potential'''
+    if isinstance(emb, dmet_hf.UHF):
+        raise NotImplementedError('fit_with_local_scf for UHF embedding')
+    dm_ref = embsys.solver.run(emb, emb._eri, emb.vfit_ci, True, False)[2]
+    log.debug(embsys, 'dm_ref = %s', dm_ref)
+    nimp = len(emb.bas_on_frag)
+    saved = (emb.scf_conv, emb.e_tot, emb.mo_energy, emb.mo_coeff_on_imp,
+             emb.mo_occ)
+# get_dm and get_jac are called at the same potentials, run the SCF once
+    scf_at = {}
+    def mo_at(v):
+        key = v.tostring()
+        if key not in scf_at:
+            embscf_(emb, v)
+            scf_at[key] = (emb.mo_energy, emb.mo_coeff_on_imp, emb.mo_occ)
+        return scf_at[key]
+    def get_dm(v):
+        mo_energy, mo_coeff, mo_occ = mo_at(v)
+        return emb.make_rdm1(mo_coeff, mo_occ)[:nimp,:nimp]
+    def get_jac(v):
+        return emb.dm_response(*mo_at(v))[:nimp,:nimp]
+    dv = fitdm.numfitor(embsys, get_dm, imp_blk_walkers(nimp),
+                        dm_ref[:nimp,:nimp], emb.vfit_mf, 'local SCF',
+                        get_jac)
+    emb.scf_conv, emb.e_tot, emb.mo_energy, emb.mo_coeff_on_imp, \
+            emb.mo_occ = saved
     return dv + emb.vfit_mf
 
 
 def fit_fixed_mf_dm(mol, emb, embsys):
-    # use numfitor to rewrite this function
-    assert(0)
-    return dv + emb.vfit_mf
+    '''backwards fitting: the potential on the impurity block of the
+    correlated solver is fitted to match the impurity block of the embedding
+    HF DM'''
+    nimp = len(emb.bas_on_frag)
+    dm_ref = emb.make_rdm1(emb.mo_coeff_on_imp, emb.mo_occ)[:nimp,:nimp]
+    def get_dm(v):
+        return embsys.solver.run(emb, emb._eri, v, True, False)[2][:nimp,:nimp]
+    dv = fitdm.numfitor(embsys, get_dm, imp_blk_walkers(nimp), dm_ref,
+                        emb.vfit_ci, 'fixed MF DM')
+    return dv + emb.vfit_ci
 
 
 def fit_chemical_potential(mol, emb, embsys):
@@ -663,6 +746,29 @@ def fit_chemical_potential(mol, emb, embsys):
 
     return vmat
 
+def fit_chemical_potential_by_pool(mol, embsys):
+    '''fit_chemical_potential for all fragments, in parallel on
+    embsys.solver_pool'''
+    pool = embsys.solver_pool
+    tids = []
+    for m, emb in enumerate(embsys.embs):
+        nimp = len(emb.bas_on_frag)
+        pool.load(m, emb)
+        vmat = emb.vfit_ci.copy()
+        vmat[:nimp,:nimp] = 0
+        tids.append(pool.submit_chemical_potential(m, vmat, nimp,
+                                                   emb._project_nelec_frag,
+                                                   emb.vfit_ci[0,0]))
+    v_group = []
+    for m, v1 in enumerate(pool.gather(tids)):
+        emb = embsys.embs[m]
+        log.debug(embsys, 'chemical potential of fragment %d = %.11g', m, v1)
+        vmat = emb.vfit_ci.copy()
+        for i in range(len(emb.bas_on_frag)):
+            vmat[i,i] = v1
+        v_group.append(vmat)
+    return v_group
+
 
 def zero_potential(mol, emb, embsys):
     nemb = emb.impbas_coeff.shape[1]
@@ -672,6 +778,14 @@ def zero_potential(mol, emb, embsys):
 def gen_all_vfit_by(local_fit_method):
     '''fit HF DM with chemical potential'''
     def fitloop(mol, embsys):
+        if local_fit_method is fit_chemical_potential \
+           and embsys.solver_pool is not None:
+            v_group = fit_chemical_potential_by_pool(mol, embsys)
+            if embsys.verbose >= param.VERBOSE_DEBUG:
+                log.debug(embsys, 'fitting potential =')
+                embsys.dump_frag_prop_mat(mol, v_group)
+            return v_group
+
         v_group = []
         for m, emb in enumerate(embsys.embs):
             log.debug(embsys, '%s for fragment %d', local_fit_method.func_name, m)
@@ -3,6 +3,7 @@
 import sys
 import numpy
 import scipy.optimize
+import scipy.special
 import pyscf.lib.logger as log
 import scipy.linalg
 
@@ -22,6 +23,20 @@ LINE_SEARCH_PLAIN = 1
 LINE_SEARCH_SHARP = 2
 LINE_SEARCH_WOLFE = 3
 LINE_SEARCH = LINE_SEARCH_WOLFE
+# max. function evaluations of one line search
+LINE_SEARCH_MAX_EVAL = 20
+
+# options for fit_solver method
+FIT_SCIPY        = 1 # leastsq for NO_CONSTRAINT, SLSQP for the constraints
+FIT_TRUST_REGION = 2
+FIT_NEWTON_GAUSS = 3 # newton_gauss for NO_CONSTRAINT, SLSQP for the constraints
+FIT_METHOD = FIT_TRUST_REGION
+
+# Fermi-Dirac smearing for the fitting of near-degenerate systems.  After each
+# fitting, the smearing width is scaled by SMEARING_ANNEAL until it is smaller
+# than SMEARING_MIN or the HOMO-LUMO gap is opened.
+SMEARING_ANNEAL = .2
+SMEARING_MIN    = 1e-4
 
 ######################################
 class ImpBathDM(object):
@@ -32,8 +47,8 @@ class ImpBathDM(object):
         self._nd = nemb
         self._x = None
 
-    def tensor_v2dm(self, e, c, nocc, v_V):
-        self._x = v_V.forImpBathDM(e, c, nocc)
+    def tensor_v2dm(self, e, c, nocc, v_V, sigma=0):
+        self._x = v_V.forImpBathDM(e, c, nocc, sigma)
         return self._x
 
     def grad_hessian_approx(self, e, c, nocc, dm_ref_alpha, v2dm):
@@ -61,24 +76,25 @@ class ImpBathDM(object):
 
     def v2dmforImpDiagLinearConstr(self):
         idx = numpy.arange(self._nimp)
-        return self._x[idx,idx].reshape(self._nimp,-1)
+        x = self._x.reshape(self._nd,self._nd,-1)
+        return x[idx,idx].reshape(self._nimp,-1)
     def v2dmforImpTraceLinearConstr(self):
-        return self._x[:self._nimp].trace().reshape(1,-1)
+        return self.v2dmforImpDiagLinearConstr().sum(axis=0).reshape(1,-1)
 
 class ImpDM(ImpBathDM):
     def __init__(self, nemb, nimp):
         ImpBathDM.__init__(self, nemb, nimp)
         self._nd = nimp
-    def tensor_v2dm(self, e, c, nocc, v_V):
-        self._x = v_V.forImpDM(e, c, nocc)
+    def tensor_v2dm(self, e, c, nocc, v_V, sigma=0):
+        self._x = v_V.forImpDM(e, c, nocc, sigma)
         return self._x
 
 class ImpDiagDM(ImpBathDM):
     def __init__(self, nemb, nimp):
         ImpBathDM.__init__(self, nemb, nimp)
         self._nd = nimp
-    def tensor_v2dm(self, e, c, nocc, v_V):
-        self._x = v_V.forImpDiagDM(e, c, nocc)
+    def tensor_v2dm(self, e, c, nocc, v_V, sigma=0):
+        self._x = v_V.forImpDiagDM(e, c, nocc, sigma)
         return self._x
     def grad_hessian_approx(self, e, c, nocc, dm_ref_alpha, v2dm):
         n = self._nd
@@ -99,8 +115,8 @@ class ImpDiagDM(ImpBathDM):
         return sum(self._x[:self._nimp]).reshape(1,-1)
 
 class NoBathDM(ImpBathDM):
-    def tensor_v2dm(self, e, c, nocc, v_V):
-        self._x = v_V.forNoBathDM(e, c, nocc)
+    def tensor_v2dm(self, e, c, nocc, v_V, sigma=0):
+        self._x = v_V.forNoBathDM(e, c, nocc, sigma)
         return self._x
     def diff_den_mat(self, c, nocc, dm_ref_alpha):
         nd = self._nd
@@ -112,8 +128,45 @@ class NoBathDM(ImpBathDM):
         return ddm[:self._nimp].diagonal()
 
 ######################################
-def mat_v_to_mat_dm1(e, c, nocc, nd, nv):
+def fermi_smearing_occ(e, nocc, sigma):
+    '''Fermi-Dirac occupations (of one spin) which hold nocc electrons'''
+    def nelec_diff(mu):
+        return scipy.special.expit((mu-e)/sigma).sum() - nocc
+    mu = scipy.optimize.brentq(nelec_diff, e[0]-sigma*50, e[-1]+sigma*50,
+                               xtol=1e-14)
+    return scipy.special.expit((mu-e)/sigma)
+
+def smearing_response(e, mo_occ, sigma):
+    '''The response kernel K_pq = (f_p-f_q)/(e_p-e_q) of the smeared DM, and
+    the derivatives df_p/de_p of the Fermi-Dirac occupations'''
+    df = -mo_occ * (1-mo_occ) / sigma
+    de = e.reshape(-1,1) - e
+    degen = abs(de) < 1e-10
+    de[degen] = 1
+    k = (mo_occ.reshape(-1,1) - mo_occ) / de
+    k[degen] = ((df.reshape(-1,1) + df) * .5)[degen]
+    return k, df
+
+def smeared_mat_v_to_mat_dm1(e, c, nocc, nd, nv, sigma):
+    '''DM1 = X * V for the Fermi-Dirac smeared DM.  The chemical potential
+    is shifted to keep the number of electrons.'''
+    nmo = e.shape[0]
+    mo_occ = fermi_smearing_occ(e, nocc, sigma)
+    k, df = smearing_response(e, mo_occ, sigma)
+    tmpcc = numpy.einsum('ik,jk->kij', c[:nd], c[:nv])
+    v = tmpcc.reshape(nmo,nd*nv)
+    _x = reduce(numpy.dot, (v.T, k, v))
+    x = _x.reshape(nd,nv,nd,nv).transpose(0,2,1,3)
+    if abs(df.sum()) > 1e-14:
+        wd = numpy.einsum('p,ip,jp->ij', df, c[:nd], c[:nd])
+        wv = numpy.einsum('p,ip,jp->ij', df, c[:nv], c[:nv])
+        x = x - numpy.einsum('ij,kl->ijkl', wd, wv) / df.sum()
+    return x
+
+def mat_v_to_mat_dm1(e, c, nocc, nd, nv, sigma=0):
     '''in AO representation, DM1 = X * V'''
+    if sigma > 0:
+        return smeared_mat_v_to_mat_dm1(e, c, nocc, nd, nv, sigma)
     nmo = e.shape[0]
     nvir = nmo - nocc
 
@@ -126,11 +179,14 @@ def mat_v_to_mat_dm1(e, c, nocc, nd, nv):
     x1 = x0.transpose(1,0,3,2)
     return x0 + x1
 
-def mat_v_to_diag_dm1(e, c, nocc, nd, nv):
-    x = mat_v_to_mat_dm1(e, c, nocc, nd, nv)
+def mat_v_to_diag_dm1(e, c, nocc, nd, nv, sigma=0):
+    x = mat_v_to_mat_dm1(e, c, nocc, nd, nv, sigma)
     return numpy.array([x[i,i] for i in range(nd)])
 
-def diag_v_to_diag_dm1(e, c, nocc, nd, nv):
+def diag_v_to_diag_dm1(e, c, nocc, nd, nv, sigma=0):
+    if sigma > 0:
+        x = smeared_mat_v_to_mat_dm1(e, c, nocc, nd, nv, sigma)
+        return numpy.einsum('iijj->ij', x)
     nmo = e.shape[0]
     nvir = nmo - nocc
     eia = 1 / (e[:nocc].reshape(nocc,1) - e[nocc:])
@@ -189,17 +245,17 @@ class ImpBathV(object):
         nn = self._usymm.shape[0]
         return numpy.dot(x.reshape(-1,nn), self._usymm)
 
-    def forImpBathDM(self, e, c, nocc):
-        x = mat_v_to_mat_dm1(e, c, nocc, self._nemb, self._nv)
+    def forImpBathDM(self, e, c, nocc, sigma=0):
+        x = mat_v_to_mat_dm1(e, c, nocc, self._nemb, self._nv, sigma)
         return self.remove_asymm_mode(x)
-    def forImpDM(self, e, c, nocc):
-        x = mat_v_to_mat_dm1(e, c, nocc, self._nimp, self._nv)
+    def forImpDM(self, e, c, nocc, sigma=0):
+        x = mat_v_to_mat_dm1(e, c, nocc, self._nimp, self._nv, sigma)
         return self.remove_asymm_mode(x)
-    def forImpDiagDM(self, e, c, nocc):
-        x = mat_v_to_diag_dm1(e, c, nocc, self._nimp, self._nv)
+    def forImpDiagDM(self, e, c, nocc, sigma=0):
+        x = mat_v_to_diag_dm1(e, c, nocc, self._nimp, self._nv, sigma)
         return self.remove_asymm_mode(x)
-    def forNoBathDM(self, e, c, nocc):
-        x = mat_v_to_mat_dm1(e, c, nocc, self._nemb, self._nv)
+    def forNoBathDM(self, e, c, nocc, sigma=0):
+        x = mat_v_to_mat_dm1(e, c, nocc, self._nemb, self._nv, sigma)
         x[self._nimp:,self._nimp:] = 0
         return self.remove_asymm_mode(x)
 
@@ -217,13 +273,13 @@ class ImpDiagV(ImpBathV):
         self._nimp = nimp
         self._nv = nimp
         self._usymm = None
-    def forImpBathDM(self, e, c, nocc):
+    def forImpBathDM(self, e, c, nocc, sigma=0):
         return None
-    def forImpDM(self, e, c, nocc):
+    def forImpDM(self, e, c, nocc, sigma=0):
         return None
-    def forImpDiagDM(self, e, c, nocc):
-        return diag_v_to_diag_dm1(e, c, nocc, self._nimp, self._nv)
-    def forNoBathDM(self, e, c, nocc):
+    def forImpDiagDM(self, e, c, nocc, sigma=0):
+        return diag_v_to_diag_dm1(e, c, nocc, self._nimp, self._nv, sigma)
+    def forNoBathDM(self, e, c, nocc, sigma=0):
         return None
     def compress(self, vfit):
         return vfit.diagonal()[:self._nv]
@@ -270,22 +326,48 @@ class DmFitObj(object):
         self._dm_V = dm_V
         self.h = None
         self.g = None
+        # number of diagonalizations of the fock matrix
+        self.neigh = 0
+        # width of the Fermi-Dirac smearing.  0 means the aufbau occupations
+        self.sigma = 0
+        self._ec = (None, None, None)
         self.update(self.init_guess())
 
+    def eigh(self, vfit):
+        '''diagonalize fock0+v.  The last eigen-pair is cached, since the
+        residual and its Jacobian are usually requested at the same point'''
+        x, e, c = self._ec
+        if x is None or x.shape != vfit.shape or not numpy.array_equal(x, vfit):
+            e, c = scipy.linalg.eigh(self._fock0+self._v_V.decompress(vfit))
+            self._ec = (numpy.array(vfit, copy=True), e, c)
+            self.neigh += 1
+        return e, c
+
+    def occ_coeff(self, e, c):
+        '''Return (c1, nocc1) with DM = c1[:,:nocc1] * c1[:,:nocc1]^T.  For
+        the smeared DM, the orbitals are scaled by sqrt(occupancy)'''
+        if self.sigma > 0:
+            mo_occ = fermi_smearing_occ(e, self._nocc, self.sigma)
+            return c * numpy.sqrt(mo_occ), c.shape[1]
+        else:
+            return c, self._nocc
+
     # for leastsq
     def diff_dm(self, vfit):
-        e, c = scipy.linalg.eigh(self._fock0+self._v_V.decompress(vfit))
-        ddm = self._dm_V.diff_den_mat(c, self._nocc, self._dm_ref_alpha)
+        e, c = self.eigh(vfit)
+        c1, nocc1 = self.occ_coeff(e, c)
+        ddm = self._dm_V.diff_den_mat(c1, nocc1, self._dm_ref_alpha)
         return ddm.flatten()
     def jac_ddm(self, vfit):
-        e, c = scipy.linalg.eigh(self._fock0+self._v_V.decompress(vfit))
-        return self._dm_V.tensor_v2dm(e, c, self._nocc, self._v_V)
+        e, c = self.eigh(vfit)
+        return self._dm_V.tensor_v2dm(e, c, self._nocc, self._v_V, self.sigma)
 
     # for Newton-CG
     def norm_ddm(self, vfit):
-        e, c = scipy.linalg.eigh(self._fock0+self._v_V.decompress(vfit))
-        v2dm = self._dm_V.tensor_v2dm(e, c, self._nocc, self._v_V)
-        self.h, self.g = self._dm_V.grad_hessian(e, c, self._nocc, \
+        e, c = self.eigh(vfit)
+        v2dm = self._dm_V.tensor_v2dm(e, c, self._nocc, self._v_V, self.sigma)
+        c1, nocc1 = self.occ_coeff(e, c)
+        self.h, self.g = self._dm_V.grad_hessian(e, c1, nocc1, \
                                                  self._dm_ref_alpha, v2dm)
         return numpy.linalg.norm(self.diff_dm(vfit))
     def hess(self, vfit):
@@ -293,20 +375,37 @@ class DmFitObj(object):
     def grad(self, vfit):
         return self.g
     def update(self, vfit):
-        e, c = scipy.linalg.eigh(self._fock0+self._v_V.decompress(vfit))
-        v2dm = self._dm_V.tensor_v2dm(e, c, self._nocc, self._v_V)
-        self.h, self.g = self._dm_V.grad_hessian(e, c, self._nocc, \
+        e, c = self.eigh(vfit)
+        v2dm = self._dm_V.tensor_v2dm(e, c, self._nocc, self._v_V, self.sigma)
+        c1, nocc1 = self.occ_coeff(e, c)
+        self.h, self.g = self._dm_V.grad_hessian(e, c1, nocc1, \
                                                  self._dm_ref_alpha, v2dm)
     def init_guess(self):
         return self._v_V.compress(numpy.zeros_like(self._fock0))
 
+    # linear constraints on the impurity diagonal DM, for trust_region_newton
+    def diff_constr(self, vfit, constr):
+        e, c = self.eigh(vfit)
+        c1, nocc1 = self.occ_coeff(e, c)
+        ddm = self._dm_V.diff_dm_diag(c1, nocc1, self._dm_ref_alpha)
+        if constr == TRACE_IMP:
+            return ddm[:self._nimp].sum().reshape(1)
+        else:
+            return ddm[:self._nimp]
+    def jac_constr(self, constr):
+        '''call it after update, which generates the tensor v2dm'''
+        if constr == TRACE_IMP:
+            return self._dm_V.v2dmforImpTraceLinearConstr()
+        else:
+            return self._dm_V.v2dmforImpDiagLinearConstr()
+
 class DmFitImpDiagLinearConstr(DmFitObj):
 # augment the hessian with Lagrange multiplier
 # min f = f0 + gx + x^T h x + ..., with linear constraints ax = b
 # /h  a^T\ /x\ = /-g\
 # \a  0  / \v/   \ b/
     def update(self, vfit):
-        e, c = scipy.linalg.eigh(self._fock0+self._v_V.decompress(vfit))
+        e, c = self.eigh(vfit)
         v2dm = self._dm_V.tensor_v2dm(e, c, self._nocc, self._v_V)
         h, g = self._dm_V.grad_hessian(e, c, self._nocc, \
                                        self._dm_ref_alpha, v2dm)
@@ -332,7 +431,7 @@ class DmFitImpTraceLinearConstr(DmFitObj):
 # /h  a^T\ /x\ = /-g\
 # \a  0  / \v/   \ b/
     def update(self, vfit):
-        e, c = scipy.linalg.eigh(self._fock0+self._v_V.decompress(vfit))
+        e, c = self.eigh(vfit)
         v2dm = self._dm_V.tensor_v2dm(e, c, self._nocc, self._v_V)
         h, g = self._dm_V.grad_hessian(e, c, self._nocc, \
                                        self._dm_ref_alpha, v2dm)
@@ -357,13 +456,13 @@ class DmFitImpDiagWeightConstr(DmFitObj):
         DmFitObj.__init__(self, fock0, nocc, nimp, dm_ref_alpha, v_V, dm_V)
 
     def diff_dm(self, vfit):
-        e, c = scipy.linalg.eigh(self._fock0+self._v_V.decompress(vfit))
+        e, c = self.eigh(vfit)
         ddm = self._dm_V.diff_den_mat(c, self._nocc, self._dm_ref_alpha)
         for i in range(self._nimp):
             ddm[i,i] *= self._weight
         return ddm.flatten()
     def jac_ddm(self, vfit):
-        e, c = scipy.linalg.eigh(self._fock0+self._v_V.decompress(vfit))
+        e, c = self.eigh(vfit)
         x = self._jac_ddm_common(e, c)
         m = x.shape[-1]
         return x.reshape(-1, m)
@@ -385,7 +484,7 @@ class DmFitImpDiagWeightConstr(DmFitObj):
 # the weighed h,g can also calculated by
 # _dm_V.grad_hessian + weight**2*ImpDiagDM.grad_hessian
 # use the following code for efficiency
-        e, c = scipy.linalg.eigh(self._fock0+self._v_V.decompress(vfit))
+        e, c = self.eigh(vfit)
         x0 = self._jac_ddm_common(e, c)
         self.h, self.g = self._dm_V.grad_hessian(e, c, self._nocc, \
                                                  self._dm_ref_alpha, x0)
@@ -395,7 +494,7 @@ class DmFitImpTraceWeightConstr(DmFitObj):
         DmFitObj.__init__(self, *args)
 
     def diff_dm(self, vfit):
-        e, c = scipy.linalg.eigh(self._fock0+self._v_V.decompress(vfit))
+        e, c = self.eigh(vfit)
         ddm = self._dm_V.diff_den_mat(c, self._nocc, self._dm_ref_alpha)
         if isinstance(self._dm_V, ImpDiagDM):
             ddmdiag = ddm[:self._nimp].sum()
@@ -403,7 +502,7 @@ class DmFitImpTraceWeightConstr(DmFitObj):
             ddmdiag = ddm[:self._nimp].trace()
         return numpy.hstack((ddm.flatten(), self._weight*ddmdiag))
     def jac_ddm(self, vfit):
-        e, c = scipy.linalg.eigh(self._fock0+self._v_V.decompress(vfit))
+        e, c = self.eigh(vfit)
         x = self._jac_ddm_common(e, c)
         m = x.shape[-1]
         return x.reshape(-1, m)
@@ -422,7 +521,7 @@ class DmFitImpTraceWeightConstr(DmFitObj):
         return numpy.vstack((x.reshape(-1,y.size), self._weight*y))
 
     def update(self, vfit):
-        e, c = scipy.linalg.eigh(self._fock0+self._v_V.decompress(vfit))
+        e, c = self.eigh(vfit)
         x = self._jac_ddm_common(e, c)
         y = x[-1].reshape(1,-1)
         h1 = numpy.dot(y.T, y) * 2
@@ -510,13 +609,47 @@ def step_by_eigh_min(h, g, threshold=1e-6):
         x = numpy.zeros_like(g)
     return x
 
-def line_search(dev, fn, dx, lim=1, floating=1e-5, val0=None, title=''):
-    if val0 is None:
-        val0 = fn(numpy.zeros_like(dx))
-    def line_search_iter(val_old, step, lim):
+class LineFn(object):
+    '''fn(dx*alpha) memorized on the step length alpha.  The line searches
+    share it to avoid evaluating the same step twice; at most max_eval new
+    evaluations are allowed.'''
+    def __init__(self, fn, dx, val0=None, max_eval=LINE_SEARCH_MAX_EVAL):
+        self.fn = fn
+        self.dx = dx
+        self.max_eval = max_eval
+        self.nfev = 0
+        self.memo = {}
+        if val0 is not None:
+            self.memo[0.] = val0
+
+    def __call__(self, alpha):
+        alpha = round(alpha, 12)
+        if alpha not in self.memo:
+            self.memo[alpha] = self.fn(self.dx*alpha)
+            self.nfev += 1
+        return self.memo[alpha]
+
+    def available(self, alpha):
+        return self.nfev < self.max_eval or round(alpha, 12) in self.memo
+
+def _line_fn(fn, dx, val0, max_eval, memo):
+    if memo is None:
+        return LineFn(fn, dx, val0, max_eval)
+    else:
+        return memo
+
+def line_search(dev, fn, dx, lim=1, floating=1e-5, val0=None, title='', \
+                max_eval=LINE_SEARCH_MAX_EVAL, memo=None):
+    f = _line_fn(fn, dx, val0, max_eval, memo)
+    val_old = f(0)
+    step = lim * .25
+    lim = lim * 1.6
+    while True:
         alpha = 0
         for a in numpy.arange(step, lim, step):
-            val_new = fn(dx*a)
+            if not f.available(a):
+                break
+            val_new = f(a)
             log.debug(dev, 'line_search %s, factor = %.9g, val_old = %.9g, val_new = %.9g', \
                       title, a, val_old, val_new)
             if val_old*(1+floating) < val_new:
@@ -524,64 +657,82 @@ def line_search(dev, fn, dx, lim=1, floating=1e-5, val0=None, title=''):
             else:
                 alpha = a
                 val_old = val_new
-        if alpha > 0 or step < 1e-3:
-            log.debug(dev, 'line_search %s, factor = %.9g', title, alpha)
+        if alpha > 0 or step < 1e-3 or not f.available(step*.5):
+            log.debug(dev, 'line_search %s, factor = %.9g, nfev = %d', \
+                      title, alpha, f.nfev)
             return alpha * dx, val_old
+        lim = step
+        step *= .5
+
+def line_search_sharp(dev, fn, dx, lim=1, floating=1e-5, val0=None, title='', \
+                      max_eval=LINE_SEARCH_MAX_EVAL, memo=None):
+    f = _line_fn(fn, dx, val0, max_eval, memo)
+    val_old = f(0)
+    alpha = 0
+    step = lim * .5
+    lim = lim * 2.1
+    while step >= 1e-3 and alpha <= lim and f.available(alpha+step):
+        val_new = f(alpha+step)
+        log.debug(dev, 'sharp line_search %s, factor = %.9g, val_old = %.9g, val_new = %.9g', \
+                  title, alpha+step, val_old, val_new)
+        if val_old*(1+floating) < val_new:
+            lim = alpha + step
+            step *= .4
         else:
-            return line_search_iter(val_old, step*.5, step)
-    return line_search_iter(val0, lim*.25, lim*1.6)
-
-def line_search_sharp(dev, fn, dx, lim=1, floating=1e-5, val0=None, title=''):
-    if val0 is None:
-        val0 = fn(numpy.zeros_like(dx))
-    def line_search_iter(val_old, alpha, step, lim):
-        if step < 1e-3 or alpha > lim:
-            log.debug(dev, 'sharp line_search %s, factor = %.9g', title, alpha)
-            return alpha*dx, val_old
-        else:
-            val_new = fn(dx*(alpha+step))
-            log.debug(dev, 'sharp line_search %s, factor = %.9g, val_old = %.9g, val_new = %.9g', \
-                      title, alpha+step, val_old, val_new)
-            if val_old*(1+floating) < val_new:
-                return line_search_iter(val_old, alpha, step*.4, alpha+step)
-            else:
-                return line_search_iter(val_new, alpha+step, step, lim)
-    return line_search_iter(val0, 0, lim*.5, lim*2.1)
+            alpha += step
+            val_old = val_new
+    log.debug(dev, 'sharp line_search %s, factor = %.9g, nfev = %d', \
+              title, alpha, f.nfev)
+    return alpha*dx, val_old
 
 def line_search_wolfe(dev, fn, dx, c1=1e-4, val0=None, grad0=None, \
-                      minstep=2e-3, title=''):
-    if val0 is None:
-        val0 = fn(numpy.zeros_like(dx))
+                      minstep=2e-3, title='', \
+                      max_eval=LINE_SEARCH_MAX_EVAL, memo=None):
+    f = _line_fn(fn, dx, val0, max_eval, memo)
     if grad0 is None:
         slope = -1e-8
     else:
         slope = -1e-8 + numpy.dot(grad0.flatten(), dx.flatten()) * c1
-    def line_search_iter(val_old, alpha, step, lim):
-        val_new = fn(dx*(alpha+step))
+    val_old = f(0)
+    alpha = 0
+    step = .5
+    lim = 1.49
+    while f.available(alpha+step):
+        val_new = f(alpha+step)
         log.debug1(dev, 'wolfe line_search %s, factor = %.9g, val_old = %.9g, val_new = %.9g', \
                   title, alpha+step, val_old, val_new)
         if alpha > 1e2:
-            return alpha, val_old
+            break
         elif val_old+slope*(alpha+step) < val_new:
             # outside the trust region of Wolfe conditions
             if step < minstep or alpha > 1.99:
-                return alpha, val_old
+                break
             else:
-                return line_search_iter(val_old, alpha, step*.4, alpha+step*.79)
+                lim = alpha + step*.79
+                step *= .4
         elif alpha+step > lim:
-            return line_search_iter(val_new, alpha+step, step*3, alpha+step*5.99)
+            lim = alpha + step*5.99
+            alpha += step
+            step *= 3
+            val_old = val_new
         else:
-            return line_search_iter(val_new, alpha+step, step, lim)
-    alpha, xnew = line_search_iter(val0, 0, .5, 1.49)
-    log.debug(dev, 'wolfe line_search %s, factor = %.9g', title, alpha)
-    return alpha*dx, xnew
+            alpha += step
+            val_old = val_new
+    log.debug(dev, 'wolfe line_search %s, factor = %.9g, nfev = %d', \
+              title, alpha, f.nfev)
+    return alpha*dx, val_old
 
 # refer to scfopt.find_emb_potential
-def newton_gauss(dev, fun, x0, grad, hess, callback, thrd=1e-12, maxiter=10):
+def newton_gauss(dev, fun, x0, grad, hess, callback, thrd=1e-12, maxiter=10, \
+                 max_eval=LINE_SEARCH_MAX_EVAL, with_info=False):
+    '''max_eval is the budget of the line search in each iteration.  The
+    number of function evaluations of every iteration is recorded in
+    info['nfev_per_iter'].'''
     x = numpy.copy(x0)
     thrd_grad = thrd*1e2
+    nfevs = []
+    val = fun(x)
     for it in range(maxiter):
-        val = fun(x)
         if val < thrd:
             break
         g = grad(x)
@@ -590,30 +741,226 @@ def newton_gauss(dev, fun, x0, grad, hess, callback, thrd=1e-12, maxiter=10):
         h = hess(x)
         dx = step_by_eigh_min(h, -g, min(1e-6,val*.2))
 
+        x1 = x.copy()
+        f = LineFn(lambda d:fun(x1+d), dx, val, max_eval)
         if LINE_SEARCH == LINE_SEARCH_PLAIN:
-            dx,val1 = line_search(dev, lambda d:fun(x+d), \
-                                  dx, title='newton-gauss')
+            dx,val = line_search(dev, None, dx, memo=f, title='newton-gauss')
         elif LINE_SEARCH == LINE_SEARCH_SHARP:
-            dx,val1 = line_search_sharp(dev, lambda d:fun(x+d), \
-                                        dx, floating=1e-3, \
-                                        title='newton-gauss')
+            dx,val = line_search_sharp(dev, None, dx, floating=1e-3, \
+                                       memo=f, title='newton-gauss')
         elif LINE_SEARCH == LINE_SEARCH_WOLFE:
-            dx,val1 = line_search_wolfe(dev, lambda d:fun(x+d), \
-                                        dx, title='newton-gauss')
+            dx,val = line_search_wolfe(dev, None, dx, memo=f, \
+                                       title='newton-gauss')
+        nfevs.append(f.nfev)
+        log.debug(dev, 'newton-gauss iter %d, val = %.9g, nfev = %d', \
+                  it, val, f.nfev)
+        if not dx.any():
+            break
         x += dx
         callback(x)
-    return x
+    if with_info:
+        return x, {'cycles': len(nfevs), 'nfev_per_iter': nfevs, \
+                   'nfev': sum(nfevs) + 1}
+    else:
+        return x
+
+def step_by_trust_region(h, g, radius):
+    '''min g*x + 1/2 x^T h x,  |x| <= radius.
+    Return the step and the level shift of the Levenberg-Marquardt equation
+    (h + shift) * x = -g'''
+    w, u = scipy.linalg.eigh(h)
+    gu = numpy.dot(u.T, g)
+# w+shift can be 0 (up to round-off) for a singular h.  Clamp the denominators
+# so that the components of g in the null space of h+shift stay finite and the
+# components which are 0 drop out
+    def step_coeff(shift):
+        return gu / numpy.maximum(w+shift, 1e-12)
+    def step_norm(shift):
+        return numpy.linalg.norm(step_coeff(shift))
+    wmin = w[0]
+    if wmin > 1e-12 and step_norm(0) <= radius:
+        return -numpy.dot(u, gu/w), 0
+# the step norm decreases monotonically with the shift.  bisection on log(shift)
+    lo = max(0, -wmin) + 1e-12
+    hi = lo + numpy.linalg.norm(g)/radius + abs(wmin) + 1e-12
+    if step_norm(lo) <= radius:
+        hi = lo
+    else:
+        for i in range(60):
+            mid = numpy.sqrt(lo*hi)
+            if step_norm(mid) > radius:
+                lo = mid
+            else:
+                hi = mid
+            if hi-lo < 1e-10*hi:
+                break
+    return -numpy.dot(u, step_coeff(hi)), hi
+
+# Levenberg-Marquardt/trust region Newton for min |ddm(x)|^2 with the linear
+# (linearized) constraints a*dx = -c on the impurity diagonal DM.  The step is
+# split into the minimum-norm step which satisfies the constraints and a step
+# in the null space of a which is determined by the trust region subproblem.
+# The exact penalty merit function |ddm|^2 + penalty*|c| controls the trust
+# radius.  penalty is kept larger than the Lagrange multipliers.
+def trust_region_newton(dev, fitp, x0, constr=NO_CONSTRAINT, thrd=1e-8,
+                        max_eval=40, radius=.5, penalty=1.):
+    '''Return the solution and a dict of convergence diagnostics'''
+    x = numpy.array(x0, dtype=float)
+    neigh0 = fitp.neigh
+    def merit(x):
+        ddm = fitp.diff_dm(x)
+        val = numpy.dot(ddm, ddm)
+        if constr == NO_CONSTRAINT:
+            cval = numpy.zeros(0)
+        else:
+            cval = fitp.diff_constr(x, constr)
+        return val, cval
+
+    val, cval = merit(x)
+    neval = 1
+    converged = stalled = False
+    it = 0
+    while neval < max_eval:
+        if val < thrd**2 and numpy.linalg.norm(cval) < thrd:
+            converged = True
+            break
+        it += 1
+# grad_hessian gives g = J^T*ddm and h = 2*J^T*J, so the model of |ddm|^2 is
+# val + 2g*dx + 1/2 dx^T h dx
+        fitp.update(x)
+        h, g = fitp.h, fitp.g
+        if constr == NO_CONSTRAINT:
+            dx_c = numpy.zeros_like(x)
+            z = None
+            hr = h
+            gr = g * 2
+        else:
+            a = fitp.jac_constr(constr)
+            u, s, vt = numpy.linalg.svd(a)
+            rank = (s > s[0]*1e-10).sum()
+            dx_c = -numpy.dot(vt[:rank].T, numpy.dot(u[:,:rank].T, cval)/s[:rank])
+            z = vt[rank:].T
+            hr = reduce(numpy.dot, (z.T, h, z))
+            gr = numpy.dot(z.T, g*2 + numpy.dot(h, dx_c))
+            lagr = numpy.dot(u[:,:rank], numpy.dot(vt[:rank], g*2)/s[:rank])
+            penalty = max(penalty, numpy.linalg.norm(lagr)*2)
+        phi = val + penalty*numpy.linalg.norm(cval)
+        if numpy.linalg.norm(gr) < thrd and numpy.linalg.norm(cval) < thrd:
+            converged = True
+            break
+
+        accepted = False
+        while neval < max_eval:
+            norm_c = numpy.linalg.norm(dx_c)
+            if norm_c > radius:
+                dx = dx_c * (radius/norm_c)
+            elif z is not None and z.shape[1] == 0:
+                dx = dx_c
+            else:
+                y = step_by_trust_region(hr, gr, numpy.sqrt(radius**2-norm_c**2))[0]
+                if z is None:
+                    dx = y
+                else:
+                    dx = dx_c + numpy.dot(z, y)
+            pred = -2*numpy.dot(g, dx) - .5*numpy.dot(dx, numpy.dot(h, dx))
+            if constr != NO_CONSTRAINT:
+                c1 = cval + numpy.dot(a, dx)
+                pred += penalty*(numpy.linalg.norm(cval) - numpy.linalg.norm(c1))
+            val1, cval1 = merit(x+dx)
+            phi1 = val1 + penalty*numpy.linalg.norm(cval1)
+            neval += 1
+            if pred > 0:
+                ratio = (phi-phi1) / pred
+            else:
+                ratio = -1
+            norm_dx = numpy.linalg.norm(dx)
+            log.debug1(dev, 'trust region %d, radius = %.6g, |dx| = %.6g, '
+                       'merit = %.9g -> %.9g, ratio = %.4g',
+                       it, radius, norm_dx, phi, phi1, ratio)
+            if ratio < .25:
+                radius = norm_dx * .25
+            elif ratio > .75 and norm_dx > radius*.99:
+                radius *= 2
+            if ratio > 1e-4:
+                x += dx
+                accepted = True
+                break
+            elif norm_dx < thrd:
+                break
+        if not accepted:
+            stalled = neval < max_eval
+            break
+        dphi = phi - phi1
+        val, cval, phi = val1, cval1, phi1
+# no progress.  It is a solution only if the residual is small, otherwise the
+# fitting is stalled (e.g. no gap at the Fermi level) and not converged
+        if ((dphi < thrd*phi or norm_dx < thrd) and
+            numpy.linalg.norm(cval) < thrd):
+            converged = val < thrd**2
+            stalled = not converged
+            break
+
+    info = {'converged': converged,
+            'stalled': stalled,
+            'cycles': it,
+            'nfev': neval,
+            'neigh': fitp.neigh - neigh0,
+            'norm_ddm': numpy.sqrt(val),
+            'norm_constr': numpy.linalg.norm(cval)}
+    log.debug(dev, 'trust region Newton converged = %s, stalled = %s, '
+              'cycles = %d, nfev = %d, neigh = %d, norm(ddm) = %.8g, '
+              'norm(constr) = %.8g', converged, stalled, it, neval,
+              info['neigh'], info['norm_ddm'], info['norm_constr'])
+    return x, info
 
 
 ####################
 def fit_solver(dev, fock0, nocc, nimp, dm_ref_alpha, \
-               v_domain, dm_domain, constr):
+               v_domain, dm_domain, constr, method=None, max_eval=40, \
+               with_info=False, sigma=0):
+    '''Fit the potential on v_domain to match the density matrix on dm_domain.
+    When with_info is set, the convergence diagnostics (cycles, number of
+    function evaluations and eigh calls, norm(ddm)) are returned as well.
+    sigma > 0 fits the Fermi-Dirac smeared DM.  With the trust region method,
+    the smearing is annealed toward 0, and max_eval is the budget of each
+    annealing step.'''
+    if method is None:
+        method = FIT_METHOD
     nemb = fock0.shape[0]
     v_V  = select_v(v_domain, nemb, nimp)
     dm_V = select_dm(dm_domain, nemb, nimp)
-    if constr == NO_CONSTRAINT:
+    info = {}
+    if method == FIT_TRUST_REGION:
         fitp = DmFitObj(fock0, nocc, nimp, dm_ref_alpha, v_V, dm_V)
-        if 1:
+        x = fitp.init_guess()
+        cycles = nfev = 0
+        while True:
+            fitp.sigma = sigma
+            x, info = trust_region_newton(dev, fitp, x, constr, 1e-8, max_eval)
+            cycles += info['cycles']
+            nfev += info['nfev']
+            if sigma == 0:
+                break
+            e = fitp.eigh(x)[0]
+            if nocc < e.size and e[nocc]-e[nocc-1] > sigma*40:
+                sigma = 0 # the occupations are integers again
+            elif sigma*SMEARING_ANNEAL < SMEARING_MIN:
+                break
+            else:
+                sigma *= SMEARING_ANNEAL
+            log.debug(dev, 'smearing of the DM fitting is reduced to %g', sigma)
+        info['cycles'] = cycles
+        info['nfev'] = nfev
+        info['sigma'] = sigma
+    elif constr == NO_CONSTRAINT:
+        fitp = DmFitObj(fock0, nocc, nimp, dm_ref_alpha, v_V, dm_V)
+        fitp.sigma = sigma
+        if method == FIT_NEWTON_GAUSS:
+            x, ng_info = newton_gauss(dev, fitp.norm_ddm, fitp.init_guess(), \
+                                      fitp.grad, fitp.hess, fitp.update, \
+                                      1e-8, 6, with_info=True)
+            info.update(ng_info)
+        else:
             #x = scipy.optimize.minimize(fitp.norm_ddm, fitp.init_guess(), \
             #                            method='Newton-CG', \
             #                            jac=fitp.grad, hess=fitp.hess, \
@@ -623,11 +970,10 @@ def fit_solver(dev, fock0, nocc, nimp, dm_ref_alpha, \
             #                            jac=fitp.grad,
             #                            callback=fitp.update,
             #                            options={'disp':False}).x
-            x = scipy.optimize.leastsq(fitp.diff_dm, fitp.init_guess(), \
-                                       Dfun=fitp.jac_ddm, ftol=1e-8)[0]
-        else:
-            x = newton_gauss(dev, fitp.norm_ddm, fitp.init_guess(), \
-                             fitp.grad, fitp.hess, fitp.update, 1e-8, 6)
+            x, _, infodict = scipy.optimize.leastsq(fitp.diff_dm, fitp.init_guess(), \
+                                                    Dfun=fitp.jac_ddm, ftol=1e-8, \
+                                                    full_output=True)[:3]
+            info['nfev'] = infodict['nfev']
     elif constr == TRACE_IMP:
         #fitp = DmFitImpTraceLinearConstr(fock0, nocc, nimp, dm_ref_alpha, \
         #                                 v_V, dm_V)
@@ -641,17 +987,19 @@ def fit_solver(dev, fock0, nocc, nimp, dm_ref_alpha, \
             #                 fitp.grad, fitp.hess, fitp.update, 1e-8, 6)
         else:
             fitp = DmFitObj(fock0, nocc, nimp, dm_ref_alpha, v_V, dm_V)
+            fitp.sigma = sigma
             def ddm_diag(vfit):
-                e, c = scipy.linalg.eigh(fock0+v_V.decompress(vfit))
-                return dm_V.diff_dm_diag(c, nocc, dm_ref_alpha)[:nimp].sum()
+                e, c = fitp.eigh(vfit)
+                c1, nocc1 = fitp.occ_coeff(e, c)
+                return dm_V.diff_dm_diag(c1, nocc1, dm_ref_alpha)[:nimp].sum()
             def grad(vfit):
                 fitp.update(vfit)
                 return fitp.grad(vfit)
             #cons = {'type': 'eq', 'fun': ddm_diag}
             dmdiag_V = ImpDiagDM(fock0.shape[0], nimp)
             def jac(vfit):
-                e, c = scipy.linalg.eigh(fock0+v_V.decompress(vfit))
-                v2dm = dmdiag_V.tensor_v2dm(e, c, nocc, v_V)
+                e, c = fitp.eigh(vfit)
+                v2dm = dmdiag_V.tensor_v2dm(e, c, nocc, v_V, sigma)
                 return sum(v2dm.reshape(nimp,-1))
             cons = {'type': 'eq', 'fun': ddm_diag, 'jac': jac}
             x = scipy.optimize.minimize(fitp.norm_ddm, fitp.init_guess(), \
@@ -674,17 +1022,19 @@ def fit_solver(dev, fock0, nocc, nimp, dm_ref_alpha, \
             #                 fitp.grad, fitp.hess, fitp.update, 1e-8, 6)
         else:
             fitp = DmFitObj(fock0, nocc, nimp, dm_ref_alpha, v_V, dm_V)
+            fitp.sigma = sigma
             def ddm_diag(vfit):
-                e, c = scipy.linalg.eigh(fock0+v_V.decompress(vfit))
-                return dm_V.diff_dm_diag(c, nocc, dm_ref_alpha)[:nimp]
+                e, c = fitp.eigh(vfit)
+                c1, nocc1 = fitp.occ_coeff(e, c)
+                return dm_V.diff_dm_diag(c1, nocc1, dm_ref_alpha)[:nimp]
             def grad(vfit):
                 fitp.update(vfit)
                 return fitp.grad(vfit)
             #cons = {'type': 'eq', 'fun': ddm_diag}
             dmdiag_V = ImpDiagDM(fock0.shape[0], nimp)
             def jac(vfit):
-                e, c = scipy.linalg.eigh(fock0+v_V.decompress(vfit))
-                v2dm = dmdiag_V.tensor_v2dm(e, c, nocc, v_V)
+                e, c = fitp.eigh(vfit)
+                v2dm = dmdiag_V.tensor_v2dm(e, c, nocc, v_V, sigma)
                 return v2dm.reshape(nimp,-1)
             cons = {'type': 'eq', 'fun': ddm_diag, 'jac': jac}
             x = scipy.optimize.minimize(fitp.norm_ddm, fitp.init_guess(), \
@@ -693,8 +1043,9 @@ def fit_solver(dev, fock0, nocc, nimp, dm_ref_alpha, \
                                         options={'maxiter':12,'disp':0}).x
     vfit = v_V.decompress(x)
 
-    e, c = scipy.linalg.eigh(fock0+vfit)
-    ddm = dm_V.diff_den_mat(c, nocc, dm_ref_alpha)
+    e, c = fitp.eigh(x)
+    c1, nocc1 = fitp.occ_coeff(e, c)
+    ddm = dm_V.diff_den_mat(c1, nocc1, dm_ref_alpha)
     if ddm.ndim == 2:
         ddiag = ddm[:nimp].diagonal()
     else:
@@ -703,31 +1054,68 @@ def fit_solver(dev, fock0, nocc, nimp, dm_ref_alpha, \
     log.debug(dev, 'norm(ddm) = %.8g, norm(dv) = %.8g, trace_imp(ddm) = %.8g', \
               numpy.linalg.norm(ddm), numpy.linalg.norm(vfit), \
               ddiag.sum())
-    return vfit
+    if with_info:
+        info['neigh'] = fitp.neigh
+        info['norm_ddm'] = numpy.linalg.norm(ddm)
+        if constr == TRACE_IMP:
+            info['norm_constr'] = abs(ddiag.sum())
+        elif constr == IMP_DIAG:
+            info['norm_constr'] = numpy.linalg.norm(ddiag)
+        else:
+            info['norm_constr'] = 0
+        return vfit, info
+    else:
+        return vfit
 
 
 def numfitor(dev, get_dm, walkers, dm_ref, \
-             v_inc_base, title=''):
+             v_inc_base, title='', get_jac=None):
+    '''Fit the potential on walkers (the index pairs) to match dm_ref.
+    get_dm(v_inc) returns the DM of the potential v_inc.  If get_jac is
+    given, get_jac(v_inc) returns the response X[...,i,j] = d dm/d v_inc[i,j]
+    (see mat_v_to_mat_dm1 or dmet_hf.RHF.dm_response), and the Jacobian is
+    built from it instead of by finite differences of get_dm.'''
     def mspan(dv):
         v_inc = numpy.zeros_like(v_inc_base)
         for k,(i,j) in enumerate(walkers):
             v_inc[i,j] = v_inc[j,i] = dv[k]
         return v_inc
+# get_dm may be an impurity SCF.  Cache it, leastsq evaluates the residual and
+# the Jacobian at the same point and the final report repeats the last point
+    memo = {}
+    def dm_at(dv):
+        key = numpy.asarray(dv, dtype=float).tostring()
+        if key not in memo:
+            memo[key] = numpy.asarray(get_dm(v_inc_base+mspan(dv)))
+        return memo[key]
     def ddm_method(dv):
-        return dm_ref - get_dm(v_inc_base+mspan(dv))
+        return (dm_ref - dm_at(dv)).ravel()
+    def jac_ddm(dv):
+        nv = v_inc_base.shape[0]
+        x = numpy.asarray(get_jac(v_inc_base+mspan(dv))).reshape(-1,nv,nv)
+        jac = numpy.empty((x.shape[0],len(walkers)))
+        for k,(i,j) in enumerate(walkers):
+            if i == j:
+                jac[:,k] = -x[:,i,i]
+            else:
+                jac[:,k] = -x[:,i,j] - x[:,j,i]
+        return jac
     x0 = numpy.zeros(len(walkers))
-    x = scipy.optimize.leastsq(ddm_method, x0, ftol=1e-8)[0]
+    if get_jac is None:
+        x = scipy.optimize.leastsq(ddm_method, x0, ftol=1e-8)[0]
+    else:
+        x = scipy.optimize.leastsq(ddm_method, x0, Dfun=jac_ddm, ftol=1e-8)[0]
     ddm = ddm_method(x)
     log.debug(dev, 'ddm %s = %s', title, ddm)
-    log.debug(dev, 'norm(ddm) = %.8g, norm(dv) = %.8,g', \
-              numpy.linalg.norm(ddm), numpy.linalg.norm(x))
+    log.debug(dev, 'norm(ddm) = %.8g, norm(dv) = %.8g, get_dm called %d times', \
+              numpy.linalg.norm(ddm), numpy.linalg.norm(x), len(memo))
     return mspan(x)
 
 ###############################
 def fit_solver_quiet(fock0, nocc, nimp, dm_ref_alpha, \
-                     v_domain, dm_domain, constr):
+                     v_domain, dm_domain, constr, **kwargs):
     dev = lambda: None
     dev.stdout = sys.stdout
     dev.verbose = 0
     return fit_solver(dev, fock0, nocc, nimp, dm_ref_alpha, \
-                      v_domain, dm_domain, constr)
+                      v_domain, dm_domain, constr, **kwargs)
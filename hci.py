@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+
+'''
+heat-bath selected CI
+ref:
+    J. Chem. Theory Comput., 12, 3674
+
+Determinants are stored as a pair of alpha and beta occupation bit strings
+(norb < 64).  The variational space is grown from the HF determinant by
+adding the determinants which couple to the current wavefunction
+|H_ai c_i| > select_cutoff, until the energy is converged or the space
+reaches max_det.
+'''
+
+import sys
+import itertools
+import numpy
+import scipy.linalg
+import scipy.sparse
+import scipy.sparse.linalg
+from pyscf import ao2mo
+import pyscf.lib.logger as logger
+
+ONE = numpy.uint64(1)
+
+def popcount(x):
+    x = numpy.asarray(x, dtype=numpy.uint64)
+    x = x - ((x >> ONE) & numpy.uint64(0x5555555555555555))
+    x = (x & numpy.uint64(0x3333333333333333)) \
+            + ((x >> numpy.uint64(2)) & numpy.uint64(0x3333333333333333))
+    x = (x + (x >> numpy.uint64(4))) & numpy.uint64(0x0f0f0f0f0f0f0f0f)
+    return ((x * numpy.uint64(0x0101010101010101)) >> numpy.uint64(56)).astype(int)
+
+def _bit_index(x):
+    # x has one bit set
+    return numpy.rint(numpy.log2(x.astype(numpy.float64))).astype(int)
+
+def _low_bit(x):
+    return x & (~x + ONE)
+
+def _sign_between(s, p, q):
+    '''(-1)^{number of the occupied orbitals in s between p and q}'''
+    lo = numpy.minimum(p, q).astype(numpy.uint64)
+    hi = numpy.maximum(p, q).astype(numpy.uint64)
+    mask = ((ONE << hi) - ONE) ^ ((ONE << (lo+ONE)) - ONE)
+    return 1 - (popcount(s & mask) & 1) * 2
+
+def occ_matrix(strs, norb):
+    strs = numpy.asarray(strs, dtype=numpy.uint64)
+    return ((strs.reshape(-1,1) >> numpy.arange(norb, dtype=numpy.uint64))
+            & ONE).astype(numpy.float64)
+
+
+def _string_adjacency(strs, blksize=4000000):
+    '''CSR (indptr, indices) of the strings which differ by one and by two
+    excitations'''
+    n = strs.size
+    blk = max(1, min(n, blksize//max(n,1)))
+    pairs = [([],[]), ([],[])]
+    for i0 in range(0, n, blk):
+        i1 = min(n, i0+blk)
+        nd = popcount(strs[i0:i1,None] ^ strs)
+        for k in range(2):
+            i, j = numpy.nonzero(nd == (k+1)*2)
+            pairs[k][0].append(i+i0)
+            pairs[k][1].append(j)
+    adj = []
+    for i, j in pairs:
+        i = numpy.hstack(i)
+        j = numpy.hstack(j)
+        indptr = numpy.append(0, numpy.cumsum(numpy.bincount(i, minlength=n)))
+        adj.append((indptr, j))  # i is sorted by nonzero
+    return adj
+
+def _expand(indptr, indices, rows):
+    '''for each rows[k], all indices of the CSR row.  Return (k, index)'''
+    counts = indptr[rows+1] - indptr[rows]
+    k = numpy.repeat(numpy.arange(rows.size), counts)
+    offset = numpy.arange(k.size) - numpy.repeat(numpy.cumsum(counts)-counts, counts)
+    return k, indices[numpy.repeat(indptr[rows], counts) + offset]
+
+def connections(stra, strb, blksize=4000000):
+    '''Pairs (i<j) of determinants which are connected by H.  Return
+    (alpha-single, beta-single, alpha-alpha, beta-beta, alpha-beta) lists
+    of (i, j) index arrays.  The pairs are found through the unique alpha and
+    beta strings, the cost scales with the number of connected pairs rather
+    than ndet**2'''
+    ndet = stra.size
+    ua, ia = numpy.unique(stra, return_inverse=True)
+    ub, ib = numpy.unique(strb, return_inverse=True)
+    na = ua.size
+    nb = ub.size
+    adja = _string_adjacency(ua, blksize)
+    adjb = _string_adjacency(ub, blksize)
+    keys = ia.astype(numpy.int64) * nb + ib
+    order = numpy.argsort(keys)
+    skeys = keys[order]
+    def lookup(a, b):
+        k = a.astype(numpy.int64) * nb + b
+        pos = numpy.minimum(numpy.searchsorted(skeys, k), ndet-1)
+        found = skeys[pos] == k
+        return numpy.where(found, order[pos], -1)
+
+    conns = []
+    for adj, s_idx, o_idx, is_a in ((adja, ia, ib, True), (adjb, ib, ia, False)):
+        for indptr, indices in adj:
+            i, nbr = _expand(indptr, indices, s_idx)
+            if is_a:
+                j = lookup(nbr, o_idx[i])
+            else:
+                j = lookup(o_idx[i], nbr)
+            mask = j > i
+            conns.append((i[mask], j[mask]))
+    # order: a-single, a-double, b-single, b-double
+    conns = [conns[0], conns[2], conns[1], conns[3]]
+
+# alpha single x beta single.  dets grouped by the alpha string
+    order_a = numpy.argsort(ia, kind='mergesort')
+    ptr_a = numpy.append(0, numpy.cumsum(numpy.bincount(ia, minlength=na)))
+    indptr, indices = adja[0]
+    counts = indptr[ia+1] - indptr[ia]
+    cost = numpy.cumsum(counts * 1.)
+    iab, jab = [], []
+    start = 0
+    while start < ndet:
+        stop = max(start+1, numpy.searchsorted(cost, cost[start]+blksize*.1))
+        stop = min(stop, ndet)
+        idx = numpy.arange(start, stop)
+        k, nbr = _expand(indptr, indices, ia[idx])
+        i = idx[k]
+        k2, j = _expand(ptr_a, order_a, nbr)
+        i = i[k2]
+        mask = (j > i) & (popcount(strb[i] ^ strb[j]) == 2)
+        iab.append(i[mask])
+        jab.append(j[mask])
+        start = stop
+    conns.append((numpy.hstack(iab), numpy.hstack(jab)))
+    return conns
+
+
+class _Integrals(object):
+    def __init__(self, h1e, eri, norb):
+        self.norb = norb
+        self.h1e = numpy.asarray(h1e)
+        eri = ao2mo.restore(1, eri, norb)
+        self.eri = eri
+        # jd[p,q,k] = (pq|kk), kd[p,q,k] = (pk|kq)
+        self.jd = numpy.einsum('pqkk->pqk', eri).copy()
+        self.kd = numpy.einsum('pkkq->pqk', eri).copy()
+
+    def diag(self, stra, strb):
+        na = occ_matrix(stra, self.norb)
+        nb = occ_matrix(strb, self.norb)
+        j = numpy.einsum('kkll->kl', self.eri)
+        k = numpy.einsum('kllk->kl', self.eri)
+        hd = self.h1e.diagonal()
+        n = na + nb
+        e = numpy.dot(n, hd) + numpy.einsum('ik,kl,il->i', n, j, n) * .5
+        e -= numpy.einsum('ik,kl,il->i', na, k, na) * .5
+        e -= numpy.einsum('ik,kl,il->i', nb, k, nb) * .5
+        return e
+
+    def single(self, si, sj, s_other, blksize=20000):
+        '''<j|H|i>, i->j by one excitation in si'''
+        rem = si & ~sj
+        add = sj & ~si
+        p = _bit_index(rem)
+        q = _bit_index(add)
+        val = numpy.empty(si.size)
+        for i0 in range(0, si.size, blksize):
+            i1 = min(si.size, i0+blksize)
+            pp, qq = p[i0:i1], q[i0:i1]
+            n_same = occ_matrix(si[i0:i1], self.norb)
+            n_other = occ_matrix(s_other[i0:i1], self.norb)
+            jd = self.jd[qq,pp]
+            val[i0:i1] = self.h1e[qq,pp] \
+                    + numpy.einsum('ik,ik->i', n_same, jd-self.kd[qq,pp]) \
+                    + numpy.einsum('ik,ik->i', n_other, jd)
+        return val * _sign_between(si, p, q), p, q
+
+    def double_same(self, si, sj):
+        rem = si & ~sj
+        add = sj & ~si
+        lo = _low_bit(rem)
+        p = _bit_index(lo)
+        q = _bit_index(rem ^ lo)
+        lo = _low_bit(add)
+        r = _bit_index(lo)
+        s = _bit_index(add ^ lo)
+        sign = _sign_between(si, p, r)
+        si1 = si ^ (ONE << p.astype(numpy.uint64)) ^ (ONE << r.astype(numpy.uint64))
+        sign *= _sign_between(si1, q, s)
+        return sign * (self.eri[r,p,s,q] - self.eri[r,q,s,p])
+
+    def double_opposite(self, ai, aj, bi, bj):
+        p = _bit_index(ai & ~aj)
+        r = _bit_index(aj & ~ai)
+        q = _bit_index(bi & ~bj)
+        s = _bit_index(bj & ~bi)
+        sign = _sign_between(ai, p, r) * _sign_between(bi, q, s)
+        return sign * self.eri[r,p,s,q]
+
+
+def hamiltonian(h1e, eri, norb, stra, strb, conns=None):
+    ints = _Integrals(h1e, eri, norb)
+    if conns is None:
+        conns = connections(stra, strb)
+    ndet = stra.size
+    rows = [numpy.arange(ndet)]
+    cols = [numpy.arange(ndet)]
+    vals = [ints.diag(stra, strb)]
+    (ia, ja), (ib, jb), (iaa, jaa), (ibb, jbb), (iab, jab) = conns
+    rows.extend((ia, ib, iaa, ibb, iab))
+    cols.extend((ja, jb, jaa, jbb, jab))
+    vals.append(ints.single(stra[ia], stra[ja], strb[ia])[0])
+    vals.append(ints.single(strb[ib], strb[jb], stra[ib])[0])
+    vals.append(ints.double_same(stra[iaa], stra[jaa]))
+    vals.append(ints.double_same(strb[ibb], strb[jbb]))
+    vals.append(ints.double_opposite(stra[iab], stra[jab], strb[iab], strb[jab]))
+    rows = numpy.hstack(rows)
+    cols = numpy.hstack(cols)
+    vals = numpy.hstack(vals)
+    offd = rows != cols
+    rows, cols, vals = (numpy.hstack((rows, cols[offd])),
+                        numpy.hstack((cols, rows[offd])),
+                        numpy.hstack((vals, vals[offd])))
+    return scipy.sparse.csr_matrix((vals, (rows, cols)), shape=(ndet,ndet))
+
+def energy(h1e, eri, civec, norb, stra, strb, conns=None):
+    h = hamiltonian(h1e, eri, norb, stra, strb, conns)
+    return numpy.dot(civec, h.dot(civec))
+
+def make_rdm1(civec, norb, stra, strb, conns=None):
+    '''spin-traced 1-particle density matrix'''
+    if conns is None:
+        conns = connections(stra, strb)
+    c2 = civec**2
+    dm1 = numpy.diag(numpy.dot(c2, occ_matrix(stra, norb)+occ_matrix(strb, norb)))
+    for (i, j), s, s_other in ((conns[0], stra, strb), (conns[1], strb, stra)):
+        si, sj = s[i], s[j]
+        p = _bit_index(si & ~sj)
+        q = _bit_index(sj & ~si)
+        v = civec[i] * civec[j] * _sign_between(si, p, q)
+        numpy.add.at(dm1, (q, p), v)
+        numpy.add.at(dm1, (p, q), v)
+    return dm1
+
+
+class _HeatBath(object):
+    '''the double excitations sorted by |<rs||pq>| for each occupied pair'''
+    def __init__(self, eri, norb):
+        v_os = eri.transpose(1,3,0,2)  # v_os[p,q,r,s] = (rp|sq)
+        v_ss = v_os - eri.transpose(3,1,0,2)
+        rs = numpy.array([(r,s) for r in range(norb) for s in range(norb)])
+        upper = rs[:,0] < rs[:,1]
+        self.ss = {}
+        self.os = {}
+        self.max_ss = numpy.zeros((norb,norb))
+        self.max_os = numpy.zeros((norb,norb))
+        for p in range(norb):
+            for q in range(norb):
+                v = abs(v_os[p,q].ravel())
+                idx = numpy.argsort(-v)
+                self.os[p,q] = (-v[idx], rs[idx,0].astype(numpy.uint64),
+                                rs[idx,1].astype(numpy.uint64))
+                self.max_os[p,q] = v[idx[0]]
+                if p < q:
+                    v = abs(v_ss[p,q].ravel()[upper])
+                    idx = numpy.argsort(-v)
+                    self.ss[p,q] = (-v[idx], rs[upper][idx,0].astype(numpy.uint64),
+                                    rs[upper][idx,1].astype(numpy.uint64))
+                    self.max_ss[p,q] = v[idx[0]]
+
+    def doubles(self, table, p, q, thresh):
+        negv, r, s = table[p,q]
+        n = numpy.searchsorted(negv, -thresh)
+        return -negv[:n], r[:n], s[:n]
+
+def _occ_list(s, norb):
+    return [k for k in range(norb) if (s >> k) & 1]
+
+def select(ints, hb, stra, strb, civec, cutoff, done=None):
+    '''new determinants (a, b) and their importance max |H_ai c_i|.  done
+    records the largest |c_i| of each determinant searched so far.  The
+    determinants whose |c_i| did not grow cannot generate new ones and are
+    skipped'''
+    if done is None:
+        done = {}
+    norb = ints.norb
+    found = {}
+    def add(a, b, v):
+        for key, val in zip(zip(a.tolist(), b.tolist()), v.tolist()):
+            if found.get(key, 0) < val:
+                found[key] = val
+    hmax = max(hb.max_ss.max(), hb.max_os.max(),
+               abs(ints.h1e).max() + abs(ints.jd).sum(axis=2).max())
+    for a, b, ci in zip(stra.tolist(), strb.tolist(), abs(civec).tolist()):
+        if ci * hmax < cutoff or done.get((a,b), 0) >= ci:
+            continue
+        done[a,b] = ci
+        thresh = cutoff / ci
+        a64 = numpy.uint64(a)
+        b64 = numpy.uint64(b)
+        na = occ_matrix([a], norb)[0]
+        nb = occ_matrix([b], norb)[0]
+        occa = _occ_list(a, norb)
+        occb = _occ_list(b, norb)
+# singles
+        for s, s64, n_same, n_other, occ, is_a in \
+                ((a, a64, na, nb, occa, True), (b, b64, nb, na, occb, False)):
+            vir = [k for k in range(norb) if not (s >> k) & 1]
+            idx = numpy.ix_(vir, occ)
+            f = ints.h1e[idx] + numpy.dot(ints.jd[idx]-ints.kd[idx], n_same) \
+                    + numpy.dot(ints.jd[idx], n_other)
+            iv, io = numpy.nonzero(abs(f) > thresh)
+            if iv.size > 0:
+                snew = s64 ^ (ONE << numpy.array(vir, dtype=numpy.uint64)[iv]) \
+                           ^ (ONE << numpy.array(occ, dtype=numpy.uint64)[io])
+                other = numpy.empty_like(snew)
+                if is_a:
+                    other[:] = b64
+                    add(snew, other, abs(f[iv,io])*ci)
+                else:
+                    other[:] = a64
+                    add(other, snew, abs(f[iv,io])*ci)
+# same spin doubles
+        for s64, occ, other64, is_a in ((a64, occa, b64, True),
+                                        (b64, occb, a64, False)):
+            for p, q in itertools.combinations(occ, 2):
+                if hb.max_ss[p,q] < thresh:
+                    continue
+                v, r, t = hb.doubles(hb.ss, p, q, thresh)
+                mask = (((s64 >> r) & ONE) == 0) & (((s64 >> t) & ONE) == 0)
+                if mask.any():
+                    snew = s64 ^ (ONE << numpy.uint64(p)) ^ (ONE << numpy.uint64(q)) \
+                            ^ (ONE << r[mask]) ^ (ONE << t[mask])
+                    other = numpy.empty_like(snew)
+                    other[:] = other64
+                    if is_a:
+                        add(snew, other, v[mask]*ci)
+                    else:
+                        add(other, snew, v[mask]*ci)
+# opposite spin doubles
+        for p in occa:
+            for q in occb:
+                if hb.max_os[p,q] < thresh:
+                    continue
+                v, r, t = hb.doubles(hb.os, p, q, thresh)
+                mask = (((a64 >> r) & ONE) == 0) & (((b64 >> t) & ONE) == 0)
+                if mask.any():
+                    anew = a64 ^ (ONE << numpy.uint64(p)) ^ (ONE << r[mask])
+                    bnew = b64 ^ (ONE << numpy.uint64(q)) ^ (ONE << t[mask])
+                    add(anew, bnew, v[mask]*ci)
+    return found
+
+def _lowest_eig(h, v0):
+    if h.shape[0] <= 400:
+        e, c = scipy.linalg.eigh(h.toarray())
+        return e[0], c[:,0]
+    else:
+# a little noise to the guess, Lanczos may otherwise converge to an excited
+# state when the new determinants introduce a lower state
+        v0 = v0 + numpy.random.RandomState(1).random_sample(v0.size) * 1e-3
+        e, c = scipy.sparse.linalg.eigsh(h, k=1, which='SA', v0=v0, tol=1e-10)
+        return e[0], c[:,0]
+
+def kernel(h1e, eri, norb, nelec, select_cutoff=1e-3, max_det=20000,
+           conv_tol=1e-7, max_cycle=30, verbose=logger.QUIET):
+    '''Return the energy, the CI vector and the determinants (stra, strb).
+    verbose is a pyscf.lib.logger level or a Logger'''
+    if isinstance(verbose, logger.Logger):
+        log = verbose
+    else:
+        log = logger.Logger(sys.stdout, verbose)
+    assert(norb < 64 and nelec % 2 == 0)
+    ints = _Integrals(h1e, eri, norb)
+    hb = _HeatBath(ints.eri, norb)
+    neleca = nelec // 2
+    hf = (1 << neleca) - 1
+    dets = [(hf, hf)]
+    stra = numpy.array([hf], dtype=numpy.uint64)
+    strb = numpy.array([hf], dtype=numpy.uint64)
+    civec = numpy.ones(1)
+    e_last = ints.diag(stra, strb)[0]
+    e = e_last
+    done = {}
+    for cycle in range(max_cycle):
+        known = set(dets)
+        found = select(ints, hb, stra, strb, civec, select_cutoff, done)
+        new = {}
+        for (a, b), v in found.items():
+            if (a, b) not in known:
+                new[a,b] = v
+# keep the space spin complete
+                if (b, a) not in known and new.get((b, a), 0) < v:
+                    new[b,a] = v
+        if not new:
+            break
+        if len(dets) + len(new) > max_det:
+            keys = sorted(new.keys(), key=lambda k: -new[k])
+            keys = keys[:max_det-len(dets)]
+        else:
+            keys = new.keys()
+        if not keys:
+            break
+        dets.extend(keys)
+        stra = numpy.array([k[0] for k in dets], dtype=numpy.uint64)
+        strb = numpy.array([k[1] for k in dets], dtype=numpy.uint64)
+        h = hamiltonian(h1e, ints.eri, norb, stra, strb)
+        v0 = numpy.hstack((civec, numpy.zeros(len(keys))))
+        e, civec = _lowest_eig(h, v0)
+        log.debug('HCI cycle %d  ndet = %d  E = %.12g', cycle, len(dets), e)
+        if abs(e - e_last) < conv_tol or len(dets) >= max_det:
+            break
+        e_last = e
+    return e, civec, stra, strb
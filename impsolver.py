@@ -3,6 +3,7 @@
 import os
 import tempfile
 import commands
+import collections
 import numpy
 
 from pyscf import gto
@@ -12,7 +13,23 @@ from pyscf import ao2mo
 from pyscf import tools
 from pyscf import mcscf
 from pyscf import mp
+import pyscf.lib.logger as log
 import pyscf.fci
+from pyscf.fci import cistring
+import pyscf.cc.ccsd
+import pyscf.cc.ccsd_rdm
+import hci
+
+# flop rate used to turn the cost estimates of AutoSolver into seconds,
+# roughly what pyscf.fci reaches on one core
+COST_FLOPS = 6e9
+# convergence of the CCSD and lambda amplitudes.  The fragment energies only
+# add up to E_CCSD as far as lambda is converged
+CCSD_CONV_TOL = 1e-10
+CCSD_CONV_TOL_NORMT = 1e-8
+# CCSD keeps the amplitudes of the last CCSD_AMPS_CACHE_SIZE embeddings (eri
+# arrays) for the initial guess; the least recently used ones are dropped
+CCSD_AMPS_CACHE_SIZE = 8
 
 class ImpSolver(object):
     def __init__(self, solver):
@@ -22,6 +39,10 @@ class ImpSolver(object):
         self.etot = None
         self.e2frag = None
         self.dm1 = None
+        # the CI vector, of the solvers which have one (FCI)
+        self.ci = None
+        # solvercache.ResultCache to reuse the results of earlier runs
+        self.cache = None
 
     # when with_e2frag = nimp, self.e2frag is the partially traced energy
     def run(self, emb, eri, vfit=0, with_1pdm=False, with_e2frag=None):
@@ -31,11 +52,26 @@ class ImpSolver(object):
             h1e[:nv,:nv] += vfit
         nelec = emb.nelectron
         mo = emb.mo_coeff_on_imp
+        if self.cache is not None:
+            key = self.cache.key(self.solver_for(emb), h1e, eri, nelec,
+                                 with_1pdm, with_e2frag)
+            res = self.cache.load(key, with_1pdm)
+            if res is not None:
+                self.escf, self.etot, self.e2frag, self.dm1, self.ci = res
+                return self.etot, self.e2frag, self.dm1
+        self.ci = None
         self.escf, self.etot, self.e2frag, self.dm1 = \
                 self.solver(emb.mol, h1e, eri, mo, nelec, \
                             with_1pdm, with_e2frag)
+        if self.cache is not None:
+            self.cache.store(key, self.escf, self.etot, self.e2frag, self.dm1,
+                             self.ci)
         return self.etot, self.e2frag, self.dm1
 
+    def solver_for(self, emb):
+        '''The ImpSolver which actually runs on emb'''
+        return self
+
 class Psi4CCSD(ImpSolver):
     def __init__(self):
         ImpSolver.__init__(self, psi4ccsd)
@@ -45,8 +81,21 @@ class Psi4CCSD_T(ImpSolver):
         ImpSolver.__init__(self, psi4ccsd_t)
 
 class FCI(ImpSolver):
-    def __init__(self):
-        ImpSolver.__init__(self, fci)
+    '''With singlet, the closed-shell embeddings are solved in the singlet
+    (alpha/beta symmetric) CI space.  The FCI engines of the embedding
+    sizes seen so far are kept for the next calls.  self.ci is the CI vector
+    of the last call, on the HF orbitals of the embedding'''
+    def __init__(self, singlet=True):
+        ImpSolver.__init__(self, None)
+        self.singlet = singlet
+        self._engines = {}
+        def f(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag):
+            res = fci(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag,
+                      self._engines, self.singlet)
+            self.ci = get_fci_engine(self._engines, mo.shape[1], nelec,
+                                     self.singlet).ci
+            return res
+        self.solver = f
 
 class CASSCF(ImpSolver):
     def __init__(self, ncas, nelecas, caslist=None):
@@ -56,6 +105,31 @@ class CASSCF(ImpSolver):
                           ncas, nelecas, caslist)
         self.solver = f
 
+class HeatBathCI(ImpSolver):
+    '''heat-bath selected CI, for the embeddings too large for FCI.
+    max_det is the budget of the determinants, it bounds the runtime'''
+    def __init__(self, select_cutoff=1e-3, max_det=20000, conv_tol=1e-7):
+        ImpSolver.__init__(self, None)
+        self.select_cutoff = select_cutoff
+        self.max_det = max_det
+        self.conv_tol = conv_tol
+        def f(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag):
+            return hbci(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag,
+                        self.select_cutoff, self.max_det, self.conv_tol)
+        self.solver = f
+
+class CCSD(ImpSolver):
+    '''PySCF CCSD, 1-RDM from the lambda amplitudes.  The amplitudes of the
+    last call on an embedding (the same eri) are rotated to the new HF
+    orbitals and used as the initial guess of the next call'''
+    def __init__(self):
+        ImpSolver.__init__(self, None)
+        self._amps = collections.OrderedDict()
+        def f(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag):
+            return ccsd(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag,
+                        self._amps)
+        self.solver = f
+
 
 def simple_hf(h1e, eri, mo, nelec):
     mol = gto.Mole()
@@ -94,11 +168,12 @@ def _psi4cc(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag, ccname='CCSD'):
             rdm1 *= 2 # Psi4 gives rdm1 of alpha spin
 
 # note the rdm1,rdm2 from psi4 solver EXCLUDES HF contributions
-            for i in range(nelec/2):
-                rdm1[i,i] += 2
-                for j in range(nelec/2):
-                    rdm2[i,j,i,j] += 4
-                    rdm2[i,j,j,i] +=-2
+            nocc = nelec // 2
+            idx = numpy.arange(nocc)
+            rdm1[idx,idx] += 2
+            i, j = numpy.meshgrid(idx, idx, indexing='ij')
+            rdm2[i,j,i,j] += 4
+            rdm2[i,j,j,i] +=-2
             rdm1 = reduce(numpy.dot, (mo, rdm1, mo.T))
 
     e2frag = 0
@@ -119,7 +194,67 @@ def psi4ccsd_t(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag):
     return _psi4cc(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag, 'CCSD(T)')
 
 
-def fci(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag):
+class FCIEngine(object):
+    '''pyscf FCI solver and the string link tables of one (norb, nelec).
+    With singlet and neleca == nelecb, direct_spin0 is used: the CI vector
+    is kept symmetric in the alpha and beta strings and about half of the
+    sigma vector work is skipped'''
+    def __init__(self, norb, nelec, singlet=True):
+        self.norb = norb
+        self.nelec = nelec
+        neleca = nelec - nelec // 2
+        nelecb = nelec // 2
+        self.singlet = singlet and neleca == nelecb
+        if self.singlet:
+            self.cis = pyscf.fci.direct_spin0.FCISolver()
+            self.link_index = \
+                    cistring.gen_linkstr_index_trilidx(range(norb), neleca)
+            self.link_index_rdm = \
+                    cistring.gen_linkstr_index(range(norb), neleca)
+        else:
+            self.cis = pyscf.fci.direct_spin1.FCISolver()
+            self.link_index = \
+                    (cistring.gen_linkstr_index_trilidx(range(norb), neleca),
+                     cistring.gen_linkstr_index_trilidx(range(norb), nelecb))
+            self.link_index_rdm = \
+                    (cistring.gen_linkstr_index(range(norb), neleca),
+                     cistring.gen_linkstr_index(range(norb), nelecb))
+            self.nelec = (neleca, nelecb)
+        self.cis.verbose = 0
+        # the CI vector of the last kernel call
+        self.ci = None
+
+    def kernel(self, h1e, eri, ci0=None):
+        if self.singlet:
+            e, self.ci = \
+                    pyscf.fci.direct_spin0.kernel_ms0(self.cis, h1e, eri,
+                                                      self.norb, self.nelec,
+                                                      ci0, self.link_index)
+        else:
+            e, self.ci = \
+                    pyscf.fci.direct_spin1.kernel_ms1(self.cis, h1e, eri,
+                                                      self.norb, self.nelec,
+                                                      ci0, self.link_index)
+        return e, self.ci
+
+    def make_rdm1(self, c):
+        return self.cis.make_rdm1(c, self.norb, self.nelec,
+                                  self.link_index_rdm)
+
+    def energy(self, h1e, eri, c):
+        return self.cis.energy(h1e, eri, c, self.norb, self.nelec,
+                               self.link_index)
+
+def get_fci_engine(engines, norb, nelec, singlet=True):
+    key = (norb, nelec, singlet)
+    if engines is None:
+        return FCIEngine(norb, nelec, singlet)
+    if key not in engines:
+        engines[key] = FCIEngine(norb, nelec, singlet)
+    return engines[key]
+
+def fci(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag,
+        engines=None, singlet=True):
 
 # use HF as intial guess for FCI solver
     eri1 = ao2mo.restore(8, eri, mo.shape[1])
@@ -128,31 +263,202 @@ def fci(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag):
     eri1 = ao2mo.incore.full(eri1, mo)
 
     norb = h1e.shape[1]
-    cis = pyscf.fci.solver(mol)
-    #cis.davidson_only=True
-    #cis.verbose = 5
-    eci, c = cis.kernel(h1e, eri1, norb, nelec)
+    cis = get_fci_engine(engines, norb, nelec, singlet)
+    eci, c = cis.kernel(h1e, eri1)
     if with_1pdm:
-        dm1 = cis.make_rdm1(c, norb, nelec)
+        dm1 = cis.make_rdm1(c)
         dm1 = reduce(numpy.dot, (mo, dm1, mo.T))
     else:
         dm1 = None
     if with_e2frag:
         eri1 = part_eri_hermi(eri, norb, with_e2frag)
         eri1 = ao2mo.incore.full(eri1, mo)
-        e2frag = cis.energy(numpy.zeros_like(h1e), eri1, c, norb, nelec)
+        e2frag = cis.energy(numpy.zeros_like(h1e), eri1, c)
     else:
         e2frag = None
     return 0, eci, e2frag, dm1
 
+def hbci(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag,
+         select_cutoff=1e-3, max_det=20000, conv_tol=1e-7):
+    eri1 = ao2mo.restore(8, eri, mo.shape[1])
+    hf_energy, mo_energy, mo, mo_occ = simple_hf(h1e, eri1, mo, nelec)
+    h1e = reduce(numpy.dot, (mo.T, h1e, mo))
+    eri1 = ao2mo.incore.full(eri1, mo)
+
+    norb = h1e.shape[1]
+    eci, c, stra, strb = hci.kernel(h1e, eri1, norb, nelec, select_cutoff,
+                                    max_det, conv_tol,
+                                    verbose=log.Logger(mol.stdout, mol.verbose))
+    conns = hci.connections(stra, strb)
+    if with_1pdm:
+        dm1 = hci.make_rdm1(c, norb, stra, strb, conns)
+        dm1 = reduce(numpy.dot, (mo, dm1, mo.T))
+    else:
+        dm1 = None
+    if with_e2frag:
+        eri1 = part_eri_hermi(eri, norb, with_e2frag)
+        eri1 = ao2mo.incore.full(eri1, mo)
+        e2frag = hci.energy(numpy.zeros_like(h1e), eri1, c, norb,
+                            stra, strb, conns)
+    else:
+        e2frag = None
+    return hf_energy, eci, e2frag, dm1
+
+def ccsd(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag, amps_cache=None):
+    eri1 = ao2mo.restore(8, eri, mo.shape[1])
+    hf_energy, mo_energy, mo, mo_occ = simple_hf(h1e, eri1, mo, nelec)
+    nmo = mo.shape[1]
+    nocc = nelec // 2
+
+    mol1 = gto.Mole()
+    mol1.verbose = 0
+    mol1.output = None
+    mol1.build(False, False)
+    mol1.nelectron = nelec
+    mol1.incore_anyway = True
+    mf = scf.RHF(mol1)
+    mf.get_hcore = lambda *args: h1e
+    mf.get_ovlp = lambda *args: numpy.eye(nmo)
+    mf._eri = eri1
+    mf.mo_coeff = mo
+    mf.mo_energy = mo_energy
+    mf.mo_occ = mo_occ
+    mf.e_tot = hf_energy
+    mycc = pyscf.cc.ccsd.CCSD(mf)
+    mycc.conv_tol = CCSD_CONV_TOL
+    mycc.conv_tol_normt = CCSD_CONV_TOL_NORMT
+
+    t1 = t2 = l1 = l2 = None
+    key = id(eri)
+    if amps_cache is not None and key in amps_cache \
+       and amps_cache[key][0] is eri:
+# rotate the amplitudes of the last call to the current HF orbitals
+        mo0, t1, t2, l1, l2 = amps_cache.pop(key)[1:]
+        u = numpy.dot(mo0.T, mo)
+        uo = u[:nocc,:nocc]
+        uv = u[nocc:,nocc:]
+        def rotate(x1, x2):
+            if x1 is None:
+                return None, None
+            x1 = reduce(numpy.dot, (uo.T, x1, uv))
+            x2 = numpy.einsum('ijab,ik->kjab', x2, uo)
+            x2 = numpy.einsum('kjab,jl->klab', x2, uo)
+            x2 = numpy.einsum('klab,ac->klcb', x2, uv)
+            x2 = numpy.einsum('klcb,bd->klcd', x2, uv)
+            return x1, x2
+        t1, t2 = rotate(t1, t2)
+        l1, l2 = rotate(l1, l2)
+    eris = mycc.ao2mo()
+    ecc, t1, t2 = mycc.kernel(t1, t2, eris)
+
+    if with_1pdm or with_e2frag:
+        mycc.solve_lambda(t1, t2, l1, l2, eris)
+        l1, l2 = mycc.l1, mycc.l2
+        dm1_mo = mycc.make_rdm1(t1, t2, l1, l2)
+    if with_1pdm:
+        dm1 = reduce(numpy.dot, (mo, dm1_mo, mo.T))
+    else:
+        dm1 = None
+    if amps_cache is not None:
+        # without lambda, l1 and l2 are the rotated lambda of the last call
+        amps_cache[key] = (eri, mo, t1, t2, l1, l2)
+        while len(amps_cache) > CCSD_AMPS_CACHE_SIZE:
+            amps_cache.popitem(last=False)
+
+    if with_e2frag:
+        eri1 = part_eri_hermi(eri, nmo, with_e2frag)
+        e2frag = ccsd_e2frag(mycc, eri1, mo, dm1_mo, t1, t2, l1, l2)
+    else:
+        e2frag = None
+    return hf_energy, ecc+hf_energy, e2frag, dm1
+
+# <V'> = 1/2 sum_pqrs G_pqrs (pq|rs)' of the CCSD lambda 2-RDM G with the
+# impurity-projected eri, as for FCI, so that h1e.dm1 + e2frag of the
+# fragments sums to E_CCSD.  G is not built.  make_rdm2 assembles it from
+#   * the reference, G_iijj += 4, G_ijji -= 2
+#   * the one-body part, with D = dm1 - 2 on the occupied diagonal,
+#     G_iipq += 2D_pq, G_pqii += 2D_pq, G_piiq -= D_pq, G_ipqi -= D_qp
+#   * the 2-body blocks of ccsd_rdm._gamma2_outcore (oooo, ooov, ovov, oovv,
+#     ovvo, ovvv, vvvv), each appearing 4 times by the symmetry of G
+# With the 8-fold symmetry of (pq|rs)' this gives
+#   <V'> = 2(ii|jj)' - (ij|ji)' + D.(2J' - K') + 2 sum_blk d_blk.(blk)'
+# The 2-body blocks are kept in an HDF5 scratch file and the vvvv part is
+# contracted in slices.
+def ccsd_e2frag(mycc, eri1, mo, dm1, t1, t2, l1, l2):
+    nocc, nvir = t1.shape
+    nmo = nocc + nvir
+    o = mo[:,:nocc]
+    v = mo[:,nocc:]
+    def block(*cs):
+        return ao2mo.incore.general(eri1, cs, compact=False).reshape(
+                [c.shape[1] for c in cs])
+
+    ooxx = block(o, o, mo, mo)
+    oxxo = block(o, mo, mo, o)
+    vj = numpy.einsum('iipq->pq', ooxx)
+    vk = numpy.einsum('ipqi->pq', oxxo)
+    e = numpy.einsum('ii', vj[:nocc,:nocc]) * 2 - numpy.einsum('ii', vk[:nocc,:nocc])
+    d = dm1.copy()
+    d[numpy.diag_indices(nocc)] -= 2
+    e += numpy.dot(d.ravel(), (vj*2-vk).ravel())
+    ooxx = oxxo = None
+
+    f = lib.H5TmpFile()
+    d2 = pyscf.cc.ccsd_rdm._gamma2_outcore(mycc, t1, t2, l1, l2, f)
+    dovov, dvvvv, doooo, doovv, dovvo, dvvov, dovvv, dooov = d2
+    e2 = numpy.dot(numpy.asarray(doooo).ravel(), block(o,o,o,o).ravel())
+    e2 += numpy.dot(numpy.asarray(dooov).ravel(), block(o,o,o,v).ravel())
+    e2 += numpy.dot(numpy.asarray(dovov).ravel(), block(o,v,o,v).ravel())
+    e2 += numpy.dot(numpy.asarray(doovv).ravel(), block(o,o,v,v).ravel())
+    e2 += numpy.dot(numpy.asarray(dovvo).ravel(), block(o,v,v,o).ravel())
+    e2 += numpy.dot(numpy.asarray(dovvv).ravel(), block(o,v,v,v).ravel())
+    max_memory = max(2000, mycc.max_memory - lib.current_memory()[0])
+    blksize = min(nvir, max(1, int(max_memory*1e6/8/(nvir**3*3))))
+    for p0, p1 in lib.prange(0, nvir, blksize):
+        e2 += numpy.dot(dvvvv[p0:p1].ravel(),
+                        block(v[:,p0:p1], v, v, v).ravel())
+    f.close()
+    return e + e2 * 2
+
+# <V'> of the MP2 wave function with the impurity-projected eri, without the
+# 2-RDM.  The democratic projection of part_eri_hermi is
+#   (pq|rs)' = 1/4 [(Pp q|rs) + (p Pq|rs) + (pq|Pr s) + (pq|r Ps)]
+# where P zeros the bath rows of the orbital.  2t_ijab-t_ijba is symmetric in
+# (ia)<->(jb), so only the projection of the first pair is needed
+#   E2' = sum 2(Pi i|jj) - (Pi j|ji) + 1/2 [(Pi a|jb)+(i Pa|jb)] (2t_ijab-t_ijba)
+# The largest intermediate is the (ia|jb) block
+def mp2_e2frag(eri, mo, nocc, nimp, t2):
+    nmo = mo.shape[1]
+    nvir = nmo - nocc
+    o = mo[:,:nocc]
+    v = mo[:,nocc:]
+    po = o.copy()
+    po[nimp:] = 0
+    pv = v.copy()
+    pv[nimp:] = 0
+    oooo = ao2mo.incore.general(eri, (po,o,o,o), compact=False)
+    oooo = oooo.reshape(nocc,nocc,nocc,nocc)
+    e2frag = numpy.einsum('iijj', oooo) * 2 - numpy.einsum('ijji', oooo)
+    oooo = None
+
+    t2 = t2 * 2 - t2.transpose(0,1,3,2)
+    ovov = ao2mo.incore.general(eri, (po,v,o,v), compact=False)
+    ovov += ao2mo.incore.general(eri, (o,pv,o,v), compact=False)
+    ovov = ovov.reshape(nocc,nvir,nocc,nvir)
+    e2frag += numpy.einsum('iajb,ijab', ovov, t2) * .5
+    return e2frag
+
+# The democratic impurity projection of eri.  The loop version
+#     unpack each pair row, zero the bath rows, add the transpose, then
+#     transpose_sum the pair indices
+# gives (ij|kl) * (d_i + d_j + d_k + d_l) / 4, d_p = 1 for impurity orbitals.
+# With w_ij = d_i + d_j on the packed pairs, the 8-fold packed element
+# (IJ, KL) is scaled by (w_IJ + w_KL) / 4
 def part_eri_hermi(eri, norb, nimp):
-    eri1 = ao2mo.restore(4, eri, norb)
-    for i in range(eri1.shape[0]):
-        tmp = lib.unpack_tril(eri1[i])
-        tmp[nimp:] = 0
-        eri1[i] = lib.pack_tril(tmp+tmp.T)
-    eri1 = lib.transpose_sum(eri1, inplace=True)
-    return ao2mo.restore(8, eri1, norb) * .25
+    eri1 = ao2mo.restore(8, eri, norb)
+    i, j = numpy.tril_indices(norb)
+    w = ((i < nimp).astype(float) + (j < nimp)) * .25
+    return eri1 * lib.pack_tril(w[:,None] + w)
 
 def casscf(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag,
            ncas, nelecas, caslist=None):
@@ -225,8 +531,11 @@ def mp2(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag):
     eri1 = ao2mo.restore(8, eri, mo.shape[1])
     hf_energy, mo_energy, mo_coeff, mo_occ = simple_hf(h1e, eri1, mo, nelec)
     mf = scf.RHF(mol)
-    mf.get_hcore = lambda mol: h1e
+    mf.get_hcore = lambda *args: h1e
     mf._eri = eri
+    mf.mo_coeff = mo_coeff
+    mf.mo_energy = mo_energy
+    mf.mo_occ = mo_occ
     mymp2 = mp.MP2(mf)
     mymp2.nocc = nelec // 2
     mymp2.nmo = len(mo_energy)
@@ -241,21 +550,101 @@ def mp2(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag):
         rdm1 = None
 
     if with_e2frag:
-        norb = mo_coeff.shape[0]
-        eri1 = part_eri_hermi(eri, norb, with_e2frag)
-        eri1 = ao2mo.incore.full(eri1, mo_coeff)
-        eri1 = ao2mo.restore(1, eri1, norb)
-        rdm2 = mymp2.make_rdm2(t2)
-        for i in range(nelec//2):
-            for j in range(nelec//2):
-                rdm2[i,i,j,j] += 4
-                rdm2[i,j,i,j] +=-2
-        e2frag = .5*numpy.dot(rdm2.reshape(-1), eri1.reshape(-1))
+        e2frag = mp2_e2frag(eri, mo_coeff, nelec//2, with_e2frag, t2)
     else:
         e2frag = None
     return hf_energy, emp2+hf_energy, e2frag, rdm1
 
 
+# The cost estimates (seconds, MB) of the solvers for an embedding of norb
+# orbitals and nelec electrons.  Only the leading terms are counted
+def _nocc_nvir(norb, nelec):
+    nocc = nelec // 2
+    return nocc, norb - nocc
+
+def fci_cost(norb, nelec):
+    '''ndet * npair^2 per sigma vector, ~30 Davidson iterations'''
+    neleca = nelec - nelec // 2
+    ndet = float(pyscf.fci.cistring.num_strings(norb, neleca)) \
+         * pyscf.fci.cistring.num_strings(norb, nelec//2)
+    npair = norb * (norb+1) / 2.
+    t = ndet * npair**2 * 30 / COST_FLOPS
+    mem = ndet * (npair + 24) * 8e-6
+    return t, mem
+
+def ccsd_cost(norb, nelec):
+    '''o^2 v^4 per iteration, ~20 iterations (x2 for lambda)'''
+    o, v = _nocc_nvir(norb, nelec)
+    t = float(o)**2 * v**4 * 40 / COST_FLOPS
+    mem = (float(v)**4 / 4 + 10. * o**2 * v**2 + norb**4 / 8.) * 8e-6
+    return t, mem
+
+def mp2_cost(norb, nelec):
+    '''o^2 v^3 for the amplitudes, o n^4 for the integral transformation'''
+    o, v = _nocc_nvir(norb, nelec)
+    t = (float(o)**2 * v**3 + float(o) * norb**4) / COST_FLOPS
+    mem = (2. * o**2 * v**2 + norb**4 / 8.) * 8e-6
+    return t, mem
+
+class _AutoDispatch(object):
+# The solver function of AutoSolver: it calls the candidate chosen for the
+# size of h1e.  A SolverPool runs it in the workers
+    def __init__(self, auto):
+        self.auto = auto
+
+    def __call__(self, mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag):
+        s = self.auto.choose(h1e.shape[0], nelec)[0]
+        return s.solver(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag)
+
+class AutoSolver(ImpSolver):
+    '''Pick the solver of each embedding by the estimated cost.  candidates
+    is a list of (ImpSolver, cost_fn) ordered from the most accurate one.
+    The first one whose estimate is within max_time (seconds) and
+    max_memory (MB) is used; if none fits, the cheapest one.  The choice of
+    each embedding is logged once and kept in self.history.  The cache of
+    the results is keyed on the chosen solver'''
+    def __init__(self, candidates=None, max_time=None, max_memory=None):
+        ImpSolver.__init__(self, None)
+        if candidates is None:
+            candidates = [(FCI(), fci_cost), (CCSD(), ccsd_cost),
+                          (MP2(), mp2_cost)]
+        self.candidates = candidates
+        self.max_time = max_time
+        self.max_memory = max_memory
+        # (norb, nelec, solver name, time, memory), one per embedding
+        self.history = []
+        self._seen = set()
+        self.solver = _AutoDispatch(self)
+
+    def choose(self, norb, nelec):
+        '''Return (solver, time, memory)'''
+        ests = [(s,) + cost(norb, nelec) for s, cost in self.candidates]
+        for s, t, mem in ests:
+            if (self.max_time is None or t <= self.max_time) and \
+               (self.max_memory is None or mem <= self.max_memory):
+                return s, t, mem
+        return min(ests, key=lambda x: x[1])
+
+    def solver_for(self, emb):
+        return self.choose(emb.get_hcore().shape[0], emb.nelectron)[0]
+
+    def run(self, emb, eri, vfit=0, with_1pdm=False, with_e2frag=None):
+        norb = emb.get_hcore().shape[0]
+        nelec = emb.nelectron
+        key = (id(emb), norb, nelec)
+        if key not in self._seen:
+            self._seen.add(key)
+            s, t, mem = self.choose(norb, nelec)
+            name = s.__class__.__name__
+            log.debug(emb, 'AutoSolver: norb = %d, nelec = %d, use %s, '
+                      'estimated %.3g s, %.3g MB', norb, nelec, name, t, mem)
+            if (self.max_time is not None and t > self.max_time) or \
+               (self.max_memory is not None and mem > self.max_memory):
+                log.warn(emb, 'AutoSolver: no solver within the budget, '
+                         '%s is the cheapest one', name)
+            self.history.append((norb, nelec, name, t, mem))
+        return ImpSolver.run(self, emb, eri, vfit, with_1pdm, with_e2frag)
+
 if __name__ == '__main__':
     from pyscf import gto, scf, ao2mo, mp
     mol = gto.M(atom='H 0 0 0; F 0 0 1', basis='6-31g')
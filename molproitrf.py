@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 
 import os, sys
+import time
 import shutil
+import signal
 import tempfile
-import commands
+import subprocess
 import re
 import numpy
 
@@ -11,13 +13,19 @@ from pyscf import gto
 from pyscf import scf
 from pyscf import lib
 from pyscf import ao2mo
-from pyscf.tools import fcidump
 import impsolver
 from impsolver import ImpSolver
 
 
 #MOLPROEXE = os.environ['HOME'] + '/workspace/molpro-dev/bin/molpro'
 MOLPROEXE = 'molpro'
+# seconds between the checks of the running jobs
+POLL_INTERVAL = .05
+# integrals smaller than FCIDUMP_TOL are not written to fcidump
+FCIDUMP_TOL = 1e-15
+FCIDUMP_FORMAT = ' %.16g'
+# number of the packed eri elements formatted in one go
+FCIDUMP_BLOCK = 1<<20
 
 
 Tsimple = '''!leave this line blank
@@ -103,30 +111,82 @@ def mr_inp(method, nmo, nelec, ncas, nelecas, with_1pdm=False,
 
 
 def write_matrop(fname, mat):
-    mat = mat.reshape(-1)
+    '''Return the number of bytes written'''
+    mat = numpy.asarray(mat, dtype=float).reshape(-1)
     with open(fname, 'w') as fin:
         fin.write('BEGIN_DATA,\n')
-        for x in mat:
-            fin.write('%25.15f\n' % x)
+        fin.write(('%25.15f\n' * mat.size) % tuple(mat.tolist()))
         fin.write('END_DATA,\n')
+    return os.path.getsize(fname)
 
-def call_molpro(h1e, eri, mo, nelec, inputstr, log=None):
-    tdir = tempfile.mkdtemp(prefix='tmolpro')
+def read_matrop(fname, nhead=1):
+    '''The numbers between the nhead header lines and END_DATA'''
+    with open(fname) as fin:
+        for i in range(nhead):
+            fin.readline()
+        dat = fin.read()
+    dat = dat[:dat.find('END_DATA')].replace(',', ' ')
+    return numpy.fromstring(dat, sep=' ')
+
+def _format_lines(fmt, cols):
+# one string % over all lines, no Python loop per line
+    n = len(cols[0])
+    if n == 0:
+        return ''
+    flat = [None] * (n*len(cols))
+    for i, c in enumerate(cols):
+        flat[i::len(cols)] = c.tolist()
+    return (fmt * n) % tuple(flat)
+
+def _unpack_pair(idx):
+# packed lower-triangle index -> (row, col), row >= col
+    row = ((numpy.sqrt(8*idx.astype(float)+1) - 1) * .5).astype(numpy.int64)
+    row[row*(row+1)//2 > idx] -= 1
+    row[(row+1)*(row+2)//2 <= idx] += 1
+    return row, idx - row*(row+1)//2
+
+def write_fcidump(fname, h1e, eri, nmo, nelec, nuc=0, ms=0, tol=FCIDUMP_TOL):
+    '''Molpro FCIDUMP, same content and order as pyscf.tools.fcidump.
+    The integrals are screened by tol and formatted blockwise with numpy.
+    Return the number of bytes written'''
+    eri = ao2mo.restore(8, eri, nmo)
+    fmt = FCIDUMP_FORMAT + ' %4d %4d %4d %4d\n'
+    with open(fname, 'w') as fout:
+        fout.write(' &FCI NORB=%4d,NELEC=%2d,MS2=%d,\n' % (nmo, nelec, ms))
+        fout.write('  ORBSYM=%s\n' % ('1,' * nmo))
+        fout.write('  ISYM=1,\n')
+        fout.write(' &END\n')
+        for p0 in range(0, eri.size, FCIDUMP_BLOCK):
+            blk = eri[p0:p0+FCIDUMP_BLOCK]
+            idx = numpy.nonzero(abs(blk) > tol)[0]
+            ij, kl = _unpack_pair(idx + p0)
+            i, j = _unpack_pair(ij)
+            k, l = _unpack_pair(kl)
+            fout.write(_format_lines(fmt, (blk[idx], i+1, j+1, k+1, l+1)))
+        h1e = numpy.asarray(h1e).reshape(nmo,nmo)
+        i, j = numpy.tril_indices(nmo)
+        v = h1e[i,j]
+        mask = abs(v) > tol
+        fmt = FCIDUMP_FORMAT + ' %4d %4d  0  0\n'
+        fout.write(_format_lines(fmt, (v[mask], i[mask]+1, j[mask]+1)))
+        fout.write((FCIDUMP_FORMAT + '  0  0  0  0\n') % nuc)
+    return os.path.getsize(fname)
+
+def write_inputs(tdir, h1e, eri, mo, nelec, inputstr, log=None):
+    t0 = time.time()
     inpfile = os.path.join(tdir, 'inputs')
-
     open(inpfile, 'w').write(inputstr)
-    write_matrop(os.path.join(tdir,'orb.matrop'), mo)
+    nbytes = write_matrop(os.path.join(tdir,'orb.matrop'), mo)
     nmo = mo.shape[1]
-    fcidump.from_integrals(os.path.join(tdir, 'fcidump'),
-                           h1e, eri, nmo, nelec, 0)
-
-# note fcidump and orb.matrop should be put in the runtime dir
-    cmd = ' '.join(('cd', tdir, '&& TMPDIR=`pwd`', MOLPROEXE, inpfile))
-    rec = commands.getoutput(cmd)
-    if 'fehler' in rec:
-        sys.stderr.write('molpro tempfiles in %s\n'%tdir)
-        raise RuntimeError('molpro fail as:\n' + rec)
-
+    nbytes += write_fcidump(os.path.join(tdir, 'fcidump'),
+                            h1e, eri, nmo, nelec)
+    if log is not None:
+        log.debug('molpro inputs: %d bytes written in %.3f s',
+                  nbytes, time.time()-t0)
+    return inpfile
+
+def read_outputs(tdir, nmo, log=None):
+    inpfile = os.path.join(tdir, 'inputs')
     with open(inpfile+'.out') as fin:
         dat = fin.read()
         dat1 = dat.split('\n')
@@ -137,18 +197,196 @@ def call_molpro(h1e, eri, mo, nelec, inputstr, log=None):
     eci, escf = map(float, es.split())[:2]
 
     if os.path.isfile(os.path.join(tdir,'rdm1')):
-        with open(os.path.join(tdir,'rdm1')) as fin:
-            fin.readline()
-            fin.readline()
-            dat = fin.read().replace(',', ' ').split()
-        rdm1 = numpy.array(map(float, dat[:-1])).reshape(nmo,nmo)
+        t0 = time.time()
+        rdm1 = read_matrop(os.path.join(tdir,'rdm1'), 2).reshape(nmo,nmo)
+        if log is not None:
+            log.debug('molpro rdm1: %d bytes read in %.3f s',
+                      os.path.getsize(os.path.join(tdir,'rdm1')),
+                      time.time()-t0)
 # molpro will transform rdm1 back to AO representation (consistent to fcidump)
     else:
         rdm1 = None
-    shutil.rmtree(tdir)
     return escf, eci, rdm1
 
 
+class MolproError(RuntimeError):
+    '''reason is 'fehler', 'exit', 'timeout' or 'output'.  The files of the
+    failed job are kept in tdir'''
+    def __init__(self, jid, reason, returncode, output, tdir):
+        self.jid = jid
+        self.reason = reason
+        self.returncode = returncode
+        self.output = output
+        self.tdir = tdir
+        RuntimeError.__init__(self, 'molpro job %d failed (%s, returncode %s),'
+                              ' files in %s:\n%s' %
+                              (jid, reason, returncode, tdir, output))
+
+class _Job(object):
+    def __init__(self, jid, slot, nmo, log):
+        self.jid = jid
+        self.slot = slot
+        self.nmo = nmo
+        self.log = log
+        self.proc = None
+        self.t0 = None
+        self.result = None
+        self.error = None
+
+class MolproRunner(object):
+    '''Run at most max_jobs molpro jobs at the same time.  Each slot has a
+    scratch directory which is cleaned and reused by the next job.  submit
+    returns at once (unless all slots are busy), wait/gather collect the
+    (escf, eci, rdm1) of the jobs.  A job running longer than timeout
+    seconds is killed.
+
+    runner = MolproRunner(4)
+    jids = [runner.submit(h1e, eri, mo, nelec, inp) for ...]
+    results = runner.gather(jids)
+    runner.close()
+    '''
+    def __init__(self, max_jobs=1, timeout=None, exe=None, tmpdir=None):
+        if exe is None:
+            exe = MOLPROEXE
+        self.exe = exe
+        self.timeout = timeout
+        self.basedir = tempfile.mkdtemp(prefix='tmolpro', dir=tmpdir)
+        self._slots = [os.path.join(self.basedir, 'slot%d' % i)
+                       for i in range(max_jobs)]
+        for d in self._slots:
+            os.mkdir(d)
+        self._free = range(max_jobs)
+        self._running = {}
+        self._done = {}
+        self._njob = 0
+
+    def _clean(self, tdir):
+        for f in os.listdir(tdir):
+            path = os.path.join(tdir, f)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    def submit(self, h1e, eri, mo, nelec, inputstr, log=None):
+        while not self._free:
+            self.poll(True)
+        slot = self._free.pop(0)
+        tdir = self._slots[slot]
+        self._clean(tdir)
+        inpfile = write_inputs(tdir, h1e, eri, mo, nelec, inputstr, log)
+
+        job = _Job(self._njob, slot, mo.shape[1], log)
+        self._njob += 1
+        env = os.environ.copy()
+        env['TMPDIR'] = tdir
+# note fcidump and orb.matrop should be put in the runtime dir.  The job is
+# the leader of its own process group, so that a timeout kills all of molpro
+        with open(os.path.join(tdir, 'console'), 'w') as console:
+            job.proc = subprocess.Popen(self.exe.split() + [inpfile],
+                                        cwd=tdir, env=env, stdout=console,
+                                        stderr=subprocess.STDOUT,
+                                        preexec_fn=os.setsid)
+        job.t0 = time.time()
+        self._running[job.jid] = job
+        return job.jid
+
+    def _finish(self, job, reason=None):
+        tdir = self._slots[job.slot]
+        rec = open(os.path.join(tdir, 'console')).read()
+        if reason is None:
+            if 'fehler' in rec:
+                reason = 'fehler'
+            elif job.proc.returncode != 0:
+                reason = 'exit'
+        if reason is None:
+            try:
+                job.result = read_outputs(tdir, job.nmo, job.log)
+            except (IOError, ValueError, IndexError):
+                reason = 'output'
+        if reason is not None:
+# keep the files of the failed job, the slot gets a new directory
+            keep = tempfile.mkdtemp(prefix='tmolpro_failed', dir=self.basedir)
+            os.rmdir(keep)
+            os.rename(tdir, keep)
+            os.mkdir(tdir)
+            sys.stderr.write('molpro tempfiles in %s\n' % keep)
+            job.error = MolproError(job.jid, reason, job.proc.returncode,
+                                    rec[-2000:], keep)
+        del(self._running[job.jid])
+        self._done[job.jid] = job
+        self._free.append(job.slot)
+
+    def poll(self, block=False):
+        '''Collect the finished jobs.  With block, wait until at least one
+        job finishes'''
+        while True:
+            nfinished = 0
+            for job in self._running.values():
+                if job.proc.poll() is not None:
+                    self._finish(job)
+                    nfinished += 1
+                elif self.timeout is not None \
+                     and time.time() - job.t0 > self.timeout:
+                    os.killpg(job.proc.pid, signal.SIGKILL)
+                    job.proc.wait()
+                    self._finish(job, 'timeout')
+                    nfinished += 1
+            if nfinished > 0 or not block or not self._running:
+                return nfinished
+            time.sleep(POLL_INTERVAL)
+
+    def wait(self, jid):
+        '''(escf, eci, rdm1) of job jid.  Raise MolproError if it failed'''
+        while jid not in self._done:
+            self.poll(True)
+        job = self._done.pop(jid)
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def gather(self, jids):
+        '''Wait for all jids, then return their results.  The first error is
+        raised after all the jobs are finished'''
+        while [jid for jid in jids if jid in self._running]:
+            self.poll(True)
+        results = []
+        error = None
+        for jid in jids:
+            try:
+                results.append(self.wait(jid))
+            except MolproError as err:
+                results.append(None)
+                if error is None:
+                    error = err
+        if error is not None:
+            raise error
+        return results
+
+    def run(self, h1e, eri, mo, nelec, inputstr, log=None):
+        return self.wait(self.submit(h1e, eri, mo, nelec, inputstr, log))
+
+    def close(self):
+        for job in self._running.values():
+            os.killpg(job.proc.pid, signal.SIGKILL)
+            job.proc.wait()
+        self._running = {}
+        for d in self._slots:
+            shutil.rmtree(d, ignore_errors=True)
+# failed jobs are left for inspection
+        if not os.listdir(self.basedir):
+            os.rmdir(self.basedir)
+
+def call_molpro(h1e, eri, mo, nelec, inputstr, log=None, runner=None):
+    if runner is not None:
+        return runner.run(h1e, eri, mo, nelec, inputstr, log)
+    runner = MolproRunner(1)
+    try:
+        return runner.run(h1e, eri, mo, nelec, inputstr, log)
+    finally:
+        runner.close()
+
+
 #TODO:def part_eri_hermi(emb, eri):
 #TODO:    nimp = emb.imp_site.shape[0]
 #TODO:    mo = emb.mo_coeff_on_imp
@@ -163,22 +401,148 @@ def call_molpro(h1e, eri, mo, nelec, inputstr, log=None):
 #TODO:    return ao2mo.restore(8, eri1) * .25
 
 
-def simple_call(method, spin=0, verbose=0):
+# The solver function of the input generator make_inp(nmo, nelec, with_1pdm).
+# make_inp is kept as f.molpro_input for MolproPool.
+# runner: a MolproRunner shared by the calls, to reuse its scratch directories
+def _molpro_call(make_inp, verbose=0, runner=None):
     def f(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag):
         log = lib.logger.Logger(mol.stdout, verbose)
-        input = simple_inp(method, mo.shape[1], nelec, with_1pdm, spin=spin)
-        escf, eci, rdm1 = call_molpro(h1e, eri, mo, nelec, input, log=log)
+        input = make_inp(mo.shape[1], nelec, with_1pdm)
+        escf, eci, rdm1 = call_molpro(h1e, eri, mo, nelec, input, log=log,
+                                      runner=runner)
         return escf, eci, None, rdm1
+    f.molpro_input = make_inp
     return f
 
-def mr_call(method, ncas, nelecas, caslist=None, spin=0, verbose=0):
-    def f(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag):
-        log = lib.logger.Logger(mol.stdout, verbose)
-        input = mr_inp(method, mo.shape[1], nelec,
-                       ncas, nelecas, with_1pdm, caslist, spin=spin)
-        escf, eci, rdm1 = call_molpro(h1e, eri, mo, nelec, input, log=log)
-        return escf, eci, None, rdm1
-    return f
+def simple_call(method, spin=0, verbose=0, runner=None):
+    def make_inp(nmo, nelec, with_1pdm):
+        return simple_inp(method, nmo, nelec, with_1pdm, spin=spin)
+    return _molpro_call(make_inp, verbose, runner)
+
+def mr_call(method, ncas, nelecas, caslist=None, spin=0, verbose=0,
+            runner=None):
+    def make_inp(nmo, nelec, with_1pdm):
+        return mr_inp(method, nmo, nelec, ncas, nelecas, with_1pdm, caslist,
+                      spin=spin)
+    return _molpro_call(make_inp, verbose, runner)
+
+
+class _Secant(object):
+    '''The secant iterations of scipy.optimize.newton (without fprime),
+    driven from outside: trial is the next point to evaluate, tell gives its
+    value.  x is the root when the iterations are done'''
+    def __init__(self, x0, tol=1.48e-8, maxiter=500):
+        self.tol = tol
+        self.maxiter = maxiter
+        self.niter = 0
+        self.p0 = x0
+        if x0 >= 0:
+            self.p1 = x0*(1+1e-4) + 1e-4
+        else:
+            self.p1 = x0*(1+1e-4) - 1e-4
+        self.q0 = None
+        self.trial = self.p0
+        self.x = None
+
+    def tell(self, q):
+        if self.q0 is None:
+            self.q0 = q
+            self.trial = self.p1
+            return
+        q1 = q
+        if q1 == self.q0:
+            self.x = (self.p1 + self.p0) * .5
+            return
+        p = self.p1 - q1*(self.p1-self.p0)/(q1-self.q0)
+        if abs(p-self.p1) < self.tol:
+            self.x = p
+            return
+        self.niter += 1
+        if self.niter >= self.maxiter:
+            raise RuntimeError('chemical potential not converged in %d '
+                               'iterations, value %s' % (self.maxiter, p))
+        self.p0, self.q0 = self.p1, q1
+        self.p1 = self.trial = p
+
+class MolproPool(object):
+    '''The interface of solverpool.SolverPool (load, submit,
+    submit_chemical_potential, gather) for the molpro solvers of this module.
+    The jobs of all fragments are submitted to one MolproRunner and run
+    concurrently, up to max_jobs at a time.  The chemical potentials of the
+    fragments are fitted together: every secant step submits the trial
+    points of all fragments.  ImpSolver.cache is not used.
+
+    embsys.solver = molproitrf.CCSD()
+    embsys.solver_pool = molproitrf.MolproPool(embsys.solver, 4)
+    ...
+    embsys.solver_pool.close()
+    '''
+    def __init__(self, solver, max_jobs=1, timeout=None, exe=None,
+                 tmpdir=None):
+        self.molpro_input = solver.solver.molpro_input
+        self.runner = MolproRunner(max_jobs, timeout, exe, tmpdir)
+        self._embs = {}
+        self._tasks = {}
+        self._ntask = 0
+
+    def load(self, key, emb, eri=None):
+        if eri is None:
+            eri = emb._eri
+        h1e = numpy.asarray(emb.get_hcore(), dtype=float)
+        self._embs[key] = (h1e, eri, emb.mo_coeff_on_imp, emb.nelectron)
+
+    def _submit_job(self, key, vfit, with_1pdm, nimp=0, v=0):
+        h1e, eri, mo, nelec = self._embs[key]
+        h1e = h1e.copy()
+        if isinstance(vfit, numpy.ndarray):
+            nv = vfit.shape[0]
+            h1e[:nv,:nv] += vfit
+        h1e[:nimp,:nimp] += numpy.eye(nimp) * v
+        inp = self.molpro_input(mo.shape[1], nelec, with_1pdm)
+        return self.runner.submit(h1e, eri, mo, nelec, inp)
+
+    def submit(self, key, vfit=0, with_1pdm=False, with_e2frag=None):
+        '''Same arguments as ImpSolver.run, on the integrals loaded for key'''
+        tid = self._ntask
+        self._ntask += 1
+        self._tasks[tid] = (self._submit_job(key, vfit, with_1pdm), None)
+        return tid
+
+    def submit_chemical_potential(self, key, vfit, nimp, nelec_frag, v0=0):
+        '''Find the chemical potential on the impurity diagonal which gives
+        nelec_frag electrons on the impurity'''
+        tid = self._ntask
+        self._ntask += 1
+        sec = _Secant(v0)
+        jid = self._submit_job(key, vfit, True, nimp, sec.trial)
+        self._tasks[tid] = (jid, (key, vfit, nimp, nelec_frag, sec))
+        return tid
+
+    def gather(self, tids):
+        '''Wait for the tasks.  Return (etot, e2frag, dm1) of submit tasks
+        and the chemical potential of submit_chemical_potential tasks'''
+        done = {}
+        while len(done) < len(tids):
+            waiting = [tid for tid in tids if tid not in done]
+            res = self.runner.gather([self._tasks[tid][0] for tid in waiting])
+            for tid, (escf, eci, rdm1) in zip(waiting, res):
+                fit = self._tasks[tid][1]
+                if fit is None:
+                    done[tid] = (eci, None, rdm1)
+                    continue
+                key, vfit, nimp, nelec_frag, sec = fit
+                sec.tell(nelec_frag - rdm1[:nimp].trace())
+                if sec.x is None:
+                    jid = self._submit_job(key, vfit, True, nimp, sec.trial)
+                    self._tasks[tid] = (jid, fit)
+                else:
+                    done[tid] = sec.x
+        for tid in tids:
+            del(self._tasks[tid])
+        return [done[tid] for tid in tids]
+
+    def close(self):
+        self.runner.close()
 
 class CCSD(impsolver.ImpSolver):
     def __init__(self):
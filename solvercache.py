@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+#
+# On-disk cache of the impurity solver results, for reruns of the same
+# geometries and fragmentations (bond scans, fragment-size sweeps, restart
+# after a crash).
+#
+# solver = impsolver.FCI()
+# solver.cache = solvercache.ResultCache('fci_cache.h5')
+# ...
+# solver.cache.dump_stats(embsys)
+#
+# The key is the hash of the solver type and parameters and of h1e (with
+# vfit), eri, nelec, with_1pdm, with_e2frag.  h1e and eri are rounded to tol
+# before hashing, so that integrals from a rerun which agree to ~tol give the
+# same key.  Each entry is a group of the HDF5 file holding escf, etot,
+# e2frag, dm1 and, with with_ci, the CI vector of impsolver.FCI.  When the
+# entries take more than max_size bytes, the least recently used ones are
+# removed.
+#
+
+import os
+import time
+import hashlib
+import numpy
+import h5py
+import pyscf.lib.logger as log
+
+# the file is rewritten without the deleted entries when it grows beyond
+# REPACK_FACTOR * max_size + REPACK_MIN
+REPACK_FACTOR = 2
+REPACK_MIN = 2**20
+
+_SIMPLE_TYPES = (bool, int, long, float, str, type(None))
+
+def _simple(x):
+    if isinstance(x, _SIMPLE_TYPES):
+        return True
+    elif isinstance(x, (tuple, list)):
+        return all([_simple(i) for i in x])
+    else:
+        return False
+
+def solver_signature(solver):
+    '''Class name and the plain (number, string, list) parameters of an
+    ImpSolver.  The parameters kept in the closure of solver.solver (e.g.
+    ncas, nelecas of CASSCF) are included'''
+    sig = [solver.__class__.__module__, solver.__class__.__name__]
+    fn = getattr(solver, 'solver', None)
+    if fn is not None:
+        sig.append(getattr(fn, '__name__', ''))
+        cells = getattr(fn, 'func_closure', None) or ()
+        sig.append(tuple([c.cell_contents for c in cells
+                          if _simple(c.cell_contents)]))
+    for k, v in sorted(vars(solver).items()):
+        if k.startswith('_') or k in ('escf', 'etot', 'e2frag', 'dm1', 'ci',
+                                      'cache', 'solver'):
+            continue
+        if _simple(v):
+            sig.append((k, v))
+    return repr(tuple(sig))
+
+def quantize(a, tol):
+    '''Integer representation of a rounded to tol'''
+    a = numpy.asarray(a, dtype=float)
+    return numpy.round(a * (1./tol)).astype(numpy.int64)
+
+
+class ResultCache(object):
+    def __init__(self, path, max_size=2**30, tol=1e-10, with_ci=False):
+        self.path = path
+        self.max_size = max_size
+        self.tol = tol
+        self.with_ci = with_ci
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # eri is the same array for all the calls on one embedding
+        self._eri_digest = (None, None)
+
+    def _digest_eri(self, eri):
+        if self._eri_digest[0] is not eri:
+            self._eri_digest = \
+                    (eri, hashlib.sha1(quantize(eri, self.tol)).hexdigest())
+        return self._eri_digest[1]
+
+    def key(self, solver, h1e, eri, nelec, with_1pdm, with_e2frag):
+        h = hashlib.sha1(solver_signature(solver))
+        h.update(repr((numpy.shape(h1e), numpy.shape(eri), nelec,
+                       bool(with_1pdm), with_e2frag, self.tol)))
+        h.update(quantize(h1e, self.tol))
+        h.update(self._digest_eri(eri))
+        return h.hexdigest()
+
+    def load(self, key, with_1pdm=False):
+        '''Return (escf, etot, e2frag, dm1, ci) or None'''
+        if os.path.isfile(self.path):
+            with h5py.File(self.path, 'a') as f:
+                if key in f and (not with_1pdm or 'dm1' in f[key]):
+                    g = f[key]
+                    g.attrs['atime'] = time.time()
+                    e2frag = g['e2frag'][()]
+                    if numpy.isnan(e2frag):
+                        e2frag = None
+                    dm1 = ci = None
+                    if 'dm1' in g:
+                        dm1 = g['dm1'][:]
+                    if 'ci' in g:
+                        ci = g['ci'][:]
+                    self.hits += 1
+                    return g['escf'][()], g['etot'][()], e2frag, dm1, ci
+        self.misses += 1
+        return None
+
+    def store(self, key, escf, etot, e2frag, dm1, ci=None):
+        with h5py.File(self.path, 'a') as f:
+            if key in f:
+                del(f[key])
+            g = f.create_group(key)
+            g['escf'] = escf
+            g['etot'] = etot
+            if e2frag is None:
+                g['e2frag'] = numpy.nan
+            else:
+                g['e2frag'] = e2frag
+            nbytes = 24
+            if dm1 is not None:
+                g['dm1'] = dm1
+                nbytes += numpy.asarray(dm1).nbytes
+            if ci is not None and self.with_ci:
+                g['ci'] = ci
+                nbytes += numpy.asarray(ci).nbytes
+            g.attrs['atime'] = time.time()
+            g.attrs['nbytes'] = nbytes
+            self._evict(f, key)
+        if os.path.getsize(self.path) > self.max_size * REPACK_FACTOR + REPACK_MIN:
+            self._repack()
+
+    def _evict(self, f, keep):
+        entries = sorted([(f[k].attrs['atime'], k) for k in f.keys()])
+        total = sum([f[k].attrs['nbytes'] for k in f.keys()])
+        for atime, k in entries:
+            if total <= self.max_size:
+                break
+            if k == keep:
+                continue
+            total -= f[k].attrs['nbytes']
+            del(f[k])
+            self.evictions += 1
+
+# HDF5 does not give the space of the deleted groups back to the filesystem
+    def _repack(self):
+        tmp = self.path + '.repack'
+        with h5py.File(self.path, 'r') as fin:
+            with h5py.File(tmp, 'w') as fout:
+                for k in fin.keys():
+                    fin.copy(k, fout)
+        os.rename(tmp, self.path)
+
+    def clear(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def stats(self):
+        n = 0
+        size = 0
+        if os.path.isfile(self.path):
+            with h5py.File(self.path, 'r') as f:
+                n = len(f)
+                size = sum([f[k].attrs['nbytes'] for k in f.keys()])
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': n, 'nbytes': size}
+
+    def dump_stats(self, rec):
+        '''Log the statistics on rec, an object with verbose and stdout
+        (e.g. the EmbSys) or a pyscf.lib.logger.Logger'''
+        s = self.stats()
+        ncall = max(1, s['hits']+s['misses'])
+        log.info(rec, 'solver cache %s: %d hits, %d misses (hit rate %.1f%%), '
+                 '%d evictions, %d entries, %.1f MB', self.path,
+                 s['hits'], s['misses'], s['hits']*100./ncall,
+                 s['evictions'], s['entries'], s['nbytes']/1e6)
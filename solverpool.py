@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+#
+# Run the impurity solver of several embeddings in long-lived worker
+# processes.  The embedding integrals (h1e, packed eri, mo) are written once
+# to memory-mapped .npy files (on /dev/shm when available); the workers map
+# them read-only and receive only small task descriptors.  The results are
+# written back to a per-embedding memory-mapped buffer.
+#
+# When the solver is an ImpSolver with a cache (solvercache.ResultCache),
+# submit looks the result up in the parent process and only the misses are
+# sent to the workers; their results are stored in the cache by gather.  The
+# solver calls inside submit_chemical_potential are not cached.
+#
+# pool = solverpool.SolverPool(impsolver.FCI(), nproc=4)
+# embsys.solver_pool = pool
+# ...
+# pool.close()
+#
+
+import os
+import shutil
+import tempfile
+import time
+import traceback
+import Queue
+import multiprocessing
+import numpy
+import numpy.lib.format
+import scipy.optimize
+from pyscf import gto
+
+# task kinds
+RUN_SOLVER     = 1
+FIT_CHEM_POT   = 2
+
+# gather checks the workers are alive when no result comes within
+# POLL_INTERVAL seconds
+POLL_INTERVAL = 1.
+
+def _shm_dir():
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    else:
+        return tempfile.gettempdir()
+
+def _light_mol():
+# the solvers only take verbose/stdout from mol.  Do not send emb.mol, which
+# carries the entire system
+    mol = gto.Mole()
+    mol.verbose = 0
+    mol.output = None
+    mol.build(False, False)
+    return mol
+
+def _write_npy(path, a):
+    mm = numpy.lib.format.open_memmap(path, mode='w+', dtype=a.dtype,
+                                      shape=a.shape)
+    mm[:] = a
+    mm.flush()
+    del mm
+
+
+class _EmbBuffer(object):
+    '''The memory-mapped files of one embedding'''
+    def __init__(self, prefix, nemb):
+        self.prefix = prefix
+        self.nemb = nemb
+        self.version = 0
+        self.eri_ref = None
+        self.h1e = None
+        self.busy = False
+        _write_npy(prefix+'vfit.npy', numpy.zeros((nemb,nemb)))
+        # etot, e2frag, escf, dm1
+        _write_npy(prefix+'out.npy', numpy.zeros(3+nemb*nemb))
+
+    def int_path(self, name, version=None):
+        if version is None:
+            version = self.version
+        return '%s%s.%d.npy' % (self.prefix, name, version)
+
+
+class _Worker(object):
+    def __init__(self, solver):
+        self.solver = solver
+        self.mol = _light_mol()
+        self._cached = {}
+
+    def load(self, path):
+        if path not in self._cached:
+            # drop the maps of the old versions
+            prefix = path.rsplit('.', 2)[0]
+            for k in self._cached.keys():
+                if k.rsplit('.', 2)[0] == prefix:
+                    del(self._cached[k])
+            self._cached[path] = numpy.load(path, mmap_mode='r')
+        return self._cached[path]
+
+    def run(self, task):
+        kind, prefix, version, nelec, args = task[1:]
+        h1e = numpy.array(self.load('%sh1e.%d.npy' % (prefix, version)))
+        eri = self.load('%seri.%d.npy' % (prefix, version))
+        mo = self.load('%smo.%d.npy' % (prefix, version))
+        vfit = numpy.load(prefix+'vfit.npy')
+        out = numpy.load(prefix+'out.npy', mmap_mode='r+')
+        if kind == RUN_SOLVER:
+            with_1pdm, with_e2frag = args
+            escf, etot, e2frag, dm1 = \
+                    self.solver(self.mol, h1e+vfit, numpy.array(eri), mo,
+                                nelec, with_1pdm, with_e2frag)
+            out[0] = etot
+            if e2frag is None:
+                out[1] = numpy.nan
+            else:
+                out[1] = e2frag
+            out[2] = escf
+            if dm1 is not None:
+                out[3:] = dm1.ravel()
+            ret = (e2frag is not None, dm1 is not None)
+        else:
+            nimp, nelec_frag, v0 = args
+            eri = numpy.array(eri)
+            def nelec_diff(v):
+                h = h1e + vfit
+                h[:nimp,:nimp] += numpy.eye(nimp) * v
+                dm = self.solver(self.mol, h, eri, mo, nelec, True, False)[3]
+                return nelec_frag - dm[:nimp].trace()
+            out[0] = scipy.optimize.newton(nelec_diff, v0, maxiter=500)
+            ret = None
+        out.flush()
+        del out
+        return ret
+
+def _worker_loop(solver, tasks, results):
+    worker = _Worker(solver)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        try:
+            results.put((task[0], worker.run(task), None))
+        except Exception:
+            results.put((task[0], None, traceback.format_exc()))
+
+
+class SolverPool(object):
+    '''Worker processes for solver.  solver is an ImpSolver or a solver
+    function solver(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag).'''
+    def __init__(self, solver, nproc=None, tmpdir=None):
+        if hasattr(solver, 'solver'):
+            self.impsolver = solver
+            solver = solver.solver
+        else:
+            self.impsolver = None
+        if nproc is None:
+            nproc = multiprocessing.cpu_count()
+        if tmpdir is None:
+            tmpdir = _shm_dir()
+        self.tmpdir = tempfile.mkdtemp(prefix='dmetpool', dir=tmpdir)
+        self._bufs = {}
+        self._ntask = 0
+        self._pending = {}
+        # results of the tasks found in the cache
+        self._cached = {}
+        self._tasks = multiprocessing.Queue()
+        self._results = multiprocessing.Queue()
+        self._procs = []
+        for i in range(nproc):
+            p = multiprocessing.Process(target=_worker_loop,
+                                        args=(solver, self._tasks,
+                                              self._results))
+            p.daemon = True
+            p.start()
+            self._procs.append(p)
+
+    def load(self, key, emb, eri=None):
+        '''Put the integrals of emb on the shared buffers.  eri is written
+        only when it is not the array loaded last time.'''
+        if eri is None:
+            eri = emb._eri
+        h1e = numpy.asarray(emb.get_hcore(), dtype=float)
+        nemb = h1e.shape[0]
+        if key not in self._bufs or self._bufs[key].nemb != nemb:
+            prefix = os.path.join(self.tmpdir, '%s.' % str(key))
+            self._bufs[key] = _EmbBuffer(prefix, nemb)
+        buf = self._bufs[key]
+        assert(not buf.busy)
+        old = buf.version
+        buf.version += 1
+        _write_npy(buf.int_path('h1e'), h1e)
+        _write_npy(buf.int_path('mo'), numpy.asarray(emb.mo_coeff_on_imp))
+        if buf.eri_ref is eri:
+            os.rename(buf.int_path('eri', old), buf.int_path('eri'))
+        else:
+            _write_npy(buf.int_path('eri'), numpy.asarray(eri))
+            if os.path.exists(buf.int_path('eri', old)):
+                os.remove(buf.int_path('eri', old))
+            buf.eri_ref = eri
+        for name in ('h1e', 'mo'):
+            if os.path.exists(buf.int_path(name, old)):
+                os.remove(buf.int_path(name, old))
+        buf.nelec = emb.nelectron
+        buf.h1e = h1e
+        if self.impsolver is not None:
+            buf.solver = self.impsolver.solver_for(emb)
+        return buf
+
+    def _vfit(self, buf, vfit):
+        v = numpy.zeros((buf.nemb,buf.nemb))
+        if isinstance(vfit, numpy.ndarray):
+            nv = vfit.shape[0]
+            v[:nv,:nv] = vfit
+        return v
+
+    def _submit(self, key, vfit, kind, args, cache_key=None):
+        buf = self._bufs[key]
+        assert(not buf.busy)
+        v = self._vfit(buf, vfit)
+        vbuf = numpy.load(buf.prefix+'vfit.npy', mmap_mode='r+')
+        vbuf[:] = v
+        vbuf.flush()
+        del vbuf
+        buf.busy = True
+        tid = self._ntask
+        self._ntask += 1
+        self._pending[tid] = (key, kind, cache_key)
+        self._tasks.put((tid, kind, buf.prefix, buf.version, buf.nelec, args))
+        return tid
+
+    def submit(self, key, vfit=0, with_1pdm=False, with_e2frag=None):
+        '''Same arguments as ImpSolver.run, on the integrals loaded for key'''
+        cache = getattr(self.impsolver, 'cache', None)
+        cache_key = None
+        if cache is not None:
+            buf = self._bufs[key]
+            h1e = buf.h1e + self._vfit(buf, vfit)
+            cache_key = cache.key(buf.solver, h1e, buf.eri_ref, buf.nelec,
+                                  with_1pdm, with_e2frag)
+            res = cache.load(cache_key, with_1pdm)
+            if res is not None:
+                tid = self._ntask
+                self._ntask += 1
+                self._cached[tid] = res[1:4]
+                return tid
+        return self._submit(key, vfit, RUN_SOLVER, (with_1pdm, with_e2frag),
+                            cache_key)
+
+    def submit_chemical_potential(self, key, vfit, nimp, nelec_frag, v0=0):
+        '''Find the chemical potential on the impurity diagonal which gives
+        nelec_frag electrons on the impurity'''
+        return self._submit(key, vfit, FIT_CHEM_POT, (nimp, nelec_frag, v0))
+
+    def gather(self, tids, timeout=None):
+        '''Wait for the tasks.  Return (etot, e2frag, dm1) of RUN_SOLVER
+        tasks and the chemical potential of FIT_CHEM_POT tasks.  Raise
+        RuntimeError when a worker process dies or the tasks take more than
+        timeout seconds; the pool should be closed then.'''
+        done = {}
+        errors = []
+        waiting = set(tids)
+        for tid in tids:
+            if tid in self._cached:
+                done[tid] = self._cached.pop(tid)
+                waiting.discard(tid)
+        t0 = time.time()
+        while waiting:
+            try:
+                tid, ret, err = self._results.get(timeout=POLL_INTERVAL)
+            except Queue.Empty:
+                self._check_workers()
+                if timeout is not None and time.time() - t0 > timeout:
+                    raise RuntimeError('solver pool: %d tasks not finished '
+                                       'in %g s' % (len(waiting), timeout))
+                continue
+            key, kind, cache_key = self._pending.pop(tid)
+            buf = self._bufs[key]
+            buf.busy = False
+            if err is not None:
+                errors.append(err)
+            else:
+                out = numpy.load(buf.prefix+'out.npy')
+                if kind == RUN_SOLVER:
+                    with_e2frag, with_dm1 = ret
+                    e2frag = dm1 = None
+                    if with_e2frag:
+                        e2frag = out[1]
+                    if with_dm1:
+                        dm1 = out[3:].reshape(buf.nemb,buf.nemb)
+                    done[tid] = (out[0], e2frag, dm1)
+                    if cache_key is not None:
+                        self.impsolver.cache.store(cache_key, out[2], out[0],
+                                                   e2frag, dm1)
+                else:
+                    done[tid] = out[0]
+            waiting.discard(tid)
+        if errors:
+            raise RuntimeError('solver failed in the worker\n' + errors[0])
+        return [done[tid] for tid in tids]
+
+    def _check_workers(self):
+        for p in self._procs:
+            if not p.is_alive():
+                raise RuntimeError('solver pool: worker %d died, exitcode %s'
+                                   % (p.pid, p.exitcode))
+
+    def run(self, key, emb, eri, vfit=0, with_1pdm=False, with_e2frag=None):
+        self.load(key, emb, eri)
+        return self.gather([self.submit(key, vfit, with_1pdm, with_e2frag)])[0]
+
+    def close(self):
+        for p in self._procs:
+            self._tasks.put(None)
+        for p in self._procs:
+            p.join()
+        self._procs = []
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+#
+# Benchmark of vasphf.read_clustdump against the line-by-line reader it
+# replaces, on synthetic FCIDUMP.CLUST.GTO files of nemb = 10 ... 40.  The
+# dictionaries of the two readers must be identical.
+#
+#   python bench_clustdump.py [nemb ...]
+#
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import re
+import time
+import tempfile
+import numpy
+import vasphf
+
+def read_clustdump_lines(clustdump, hfdic):
+    dic = {}
+    finp = open(clustdump, 'r')
+    dat = finp.readline()
+    head = []
+    while dat:
+        if 'END' in dat:
+            break
+        head.append(dat[:-1])
+        dat = finp.readline()
+    head = ''.join(head).replace(' ','')
+    head = re.split('[=,]', head[4:])
+    for kv in head:
+        if kv.isdigit():
+            dic[klast].append(int(kv))
+        else:
+            try:
+                float(kv)
+                dic[klast].append(float(kv))
+            except ValueError:
+                klast = kv
+                dic[klast] = []
+    for k, v in dic.items():
+        if k != 'ORBIND':
+            dic[k] = v[0]
+    dic['ORBIND'] = [i-1 for i in dic['ORBIND']]
+    dic['NEMB'] = dic['NORB']
+
+    nemb = dic['NEMB']
+    norb = hfdic['NORB']
+    npair = nemb*(nemb+1)/2
+    h1emb = numpy.zeros((nemb,nemb))
+    corrpot = numpy.zeros((nemb,nemb))
+    mo_coeff = numpy.zeros((norb,norb))
+    embasis = numpy.zeros((norb,nemb))
+    eri = numpy.zeros((npair*(npair+1)/2))
+    dat = finp.readline().split()
+    while dat:
+        i, j, k, l = map(int, dat[1:])
+        if l == 0:
+            h1emb[i-1,j-1] = h1emb[j-1,i-1] = float(dat[0])
+        elif l == -1:
+            mo_coeff[i-1,j-1] = float(dat[0])
+        elif l == -2:
+            embasis[i-1,j-1] = float(dat[0])
+        elif l == -3:
+            corrpot[i-1,j-1] = corrpot[j-1,i-1] = float(dat[0])
+        else:
+            if i >= j:
+                ij = (i-1)*i/2 + j-1
+            else:
+                ij = (j-1)*j/2 + i-1
+            if k >= l:
+                kl = (k-1)*k/2 + l-1
+            else:
+                kl = (l-1)*l/2 + k-1
+            if ij >= kl:
+                eri[ij*(ij+1)/2+kl] = float(dat[0])
+            else:
+                eri[kl*(kl+1)/2+ij] = float(dat[0])
+        dat = finp.readline().split()
+    dic['ERI'] = eri
+    dic['MO_COEFF'] = mo_coeff
+    dic['EMBASIS'] = numpy.dot(mo_coeff, embasis)
+    dic['H1EMB'] = h1emb
+    dic['CORRPOT'] = corrpot
+    return dic
+
+# eri records in all the label orders, duplicated h1emb/corrpot records
+def write_clustdump(fname, nemb, norb, seed=1):
+    rand = numpy.random.RandomState(seed)
+    with open(fname, 'w') as f:
+        f.write(' &FCI NORB=%4d,NELECEMB=%4d,NIMP=%4d,\n' % (nemb, nemb, nemb))
+        f.write('  ORBIND=%s\n' % ','.join([str(i+1) for i in range(nemb)]))
+        f.write(' &END\n')
+        lines = []
+        for i in range(nemb):
+            for j in range(i+1):
+                for k in range(nemb):
+                    for l in range(k+1):
+                        if (i*(i+1)//2+j) >= (k*(k+1)//2+l):
+                            p = [i+1, j+1, k+1, l+1]
+                            if rand.random_sample() < .3:
+                                p = p[2:] + p[:2]
+                            if rand.random_sample() < .3:
+                                p[0], p[1] = p[1], p[0]
+                            lines.append('%.16E %4d %4d %4d %4d\n' %
+                                         tuple([rand.random_sample()-.5]+p))
+        f.write(''.join(lines))
+        for code, n1, n2 in ((0, nemb, nemb), (-1, norb, norb),
+                             (-2, norb, nemb), (-3, nemb, nemb)):
+            for i in range(n1):
+                for j in range(n2):
+                    f.write('%.16E %4d %4d %4d %4d\n' %
+                            (rand.random_sample(), i+1, j+1, 0, code))
+        f.write('\n')
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sizes = [int(x) for x in sys.argv[1:]]
+    else:
+        sizes = (10, 20, 30, 40)
+    tdir = tempfile.mkdtemp()
+    fname = os.path.join(tdir, 'FCIDUMP.CLUST.GTO')
+    print '%5s %11s %10s %10s %8s %6s' % \
+            ('nemb', 'bytes', 'lines/s', 'numpy/s', 'speedup', 'same')
+    for nemb in sizes:
+        norb = nemb * 2
+        hfdic = {'NORB': norb}
+        write_clustdump(fname, nemb, norb)
+        t0 = time.time()
+        ref = read_clustdump_lines(fname, hfdic)
+        t1 = time.time()
+        sys.stdout = open(os.devnull, 'w')
+        dic = vasphf.read_clustdump(fname, hfdic)
+        sys.stdout = sys.__stdout__
+        t2 = time.time()
+        same = sorted(ref.keys()) == sorted(dic.keys())
+        for k in ref:
+            same = same and numpy.array_equal(ref[k], dic[k])
+        print '%5d %11d %10.3f %10.3f %8.1f %6s' % \
+                (nemb, os.path.getsize(fname), t1-t0, t2-t1, (t1-t0)/(t2-t1),
+                 same)
+    os.remove(fname)
+    os.rmdir(tdir)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#
+# Benchmark of the integral export of molproitrf against the per-element
+# writers of pyscf.tools.fcidump, for embeddings of nemb = 10 ... 40 orbitals.
+# Reports the bytes written, the time per call, and checks that the files
+# are identical.
+#
+#   python bench_fcidump.py [nemb ...]
+#
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import time
+import tempfile
+import numpy
+from pyscf.tools import fcidump
+import molproitrf
+
+def write_matrop_loop(fname, mat):
+    mat = mat.reshape(-1)
+    with open(fname, 'w') as fin:
+        fin.write('BEGIN_DATA,\n')
+        for x in mat:
+            fin.write('%25.15f\n' % x)
+        fin.write('END_DATA,\n')
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sizes = [int(x) for x in sys.argv[1:]]
+    else:
+        sizes = (10, 20, 30, 40)
+    rand = numpy.random.RandomState(1)
+    tdir = tempfile.mkdtemp()
+    f0 = os.path.join(tdir, 'ref')
+    f1 = os.path.join(tdir, 'new')
+    print '%5s %-8s %11s %10s %10s %8s %6s' % \
+            ('nemb', 'file', 'bytes', 'loop/s', 'numpy/s', 'speedup', 'same')
+    for nemb in sizes:
+        npair = nemb*(nemb+1)//2
+        eri = rand.random_sample(npair*(npair+1)//2) - .5
+        eri[rand.random_sample(eri.size) < .2] = 0
+        h1e = rand.random_sample((nemb,nemb))
+        h1e = h1e + h1e.T
+
+        t0 = time.time()
+        fcidump.from_integrals(f0, h1e, eri, nemb, nemb, 0)
+        t1 = time.time()
+        nbytes = molproitrf.write_fcidump(f1, h1e, eri, nemb, nemb, 0)
+        t2 = time.time()
+        print '%5d %-8s %11d %10.3f %10.3f %8.1f %6s' % \
+                (nemb, 'fcidump', nbytes, t1-t0, t2-t1, (t1-t0)/(t2-t1),
+                 open(f0).read() == open(f1).read())
+
+        mo = rand.random_sample((nemb,nemb))
+        t0 = time.time()
+        write_matrop_loop(f0, mo)
+        t1 = time.time()
+        nbytes = molproitrf.write_matrop(f1, mo)
+        t2 = time.time()
+        print '%5d %-8s %11d %10.4f %10.4f %8.1f %6s' % \
+                (nemb, 'matrop', nbytes, t1-t0, t2-t1, (t1-t0)/(t2-t1),
+                 open(f0).read() == open(f1).read())
+
+        t0 = time.time()
+        with open(f0) as fin:
+            fin.readline()
+            dat = fin.read().replace(',', ' ').split()
+        ref = numpy.array(map(float, dat[:-1]))
+        t1 = time.time()
+        dat = molproitrf.read_matrop(f0)
+        t2 = time.time()
+        print '%5d %-8s %11d %10.4f %10.4f %8.1f %6s' % \
+                (nemb, 'read', os.path.getsize(f0), t1-t0, t2-t1,
+                 (t1-t0)/(t2-t1), abs(ref-dat).max() == 0)
+    os.remove(f0)
+    os.remove(f1)
+    os.rmdir(tdir)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+#
+# Benchmark of fitdm.fit_solver.
+# Run every v_domain x dm_domain x constr combination on reproducible random
+# and Hubbard-like embedding problems, and report the wall time, the number
+# of eigh calls, the peak memory and the final residuals.
+#
+#   python bench_fitdm.py [nimp ...]
+#
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import time
+import resource
+import numpy
+import scipy.linalg
+import fitdm
+
+V_DOMAINS = ((fitdm.IMP_AND_BATH, 'IMP_AND_BATH'),
+             (fitdm.IMP_BLK     , 'IMP_BLK'     ),
+             (fitdm.NO_BATH_BLK , 'NO_BATH_BLK' ),
+             (fitdm.IMP_DIAG    , 'IMP_DIAG'    ))
+DM_DOMAINS = V_DOMAINS
+CONSTRAINTS = ((fitdm.NO_CONSTRAINT, 'NO_CONSTR'),
+               (fitdm.IMP_DIAG     , 'IMP_DIAG' ),
+               (fitdm.TRACE_IMP    , 'TRACE_IMP'))
+METHODS = ((fitdm.FIT_SCIPY       , 'scipy'),
+           (fitdm.FIT_TRUST_REGION, 'trust'),
+           (fitdm.FIT_NEWTON_GAUSS, 'gauss'))
+
+def fermi_dm(f, nocc, sigma):
+    e, c = scipy.linalg.eigh(f)
+    mo_occ = fitdm.fermi_smearing_occ(e, nocc, sigma)
+    return numpy.dot(c*mo_occ, c.T)
+
+# random fock0 in the embedding basis.  dm_ref is a smeared (non-idempotent)
+# DM of a perturbed fock0, like the 1-RDM of a correlated solver
+def random_problem(nimp, seed):
+    rand = numpy.random.RandomState(seed)
+    nemb = nimp * 2
+    nocc = nimp
+    a = rand.random_sample((nemb,nemb)) - .5
+    fock0 = a + a.T
+    a = (rand.random_sample((nemb,nemb)) - .5) * .2
+    dm_ref = fermi_dm(fock0+a+a.T, nocc, .05)
+    return fock0, nocc, dm_ref
+
+# half-filled Hubbard ring of nimp*8 sites, mean-field hopping plus a weak
+# staggered field.  The impurity is the first nimp sites, the bath is taken
+# from the SVD of the impurity-environment block of the lattice DM.  dm_ref is
+# the embedding projection of the lattice DM smeared by ~U/4
+def hubbard_problem(nimp, seed, u=4.):
+    rand = numpy.random.RandomState(seed)
+    nsite = nimp * 8
+    h = numpy.zeros((nsite,nsite))
+    for i in range(nsite):
+        h[i,(i+1)%nsite] = h[(i+1)%nsite,i] = -1
+    h += numpy.diag((-1)**numpy.arange(nsite) * .1 * u \
+                    + rand.random_sample(nsite) * 1e-3)
+    nocc = nsite // 2
+    e, c = scipy.linalg.eigh(h)
+    dm = numpy.dot(c[:,:nocc], c[:,:nocc].T)
+    u_, s, vt = numpy.linalg.svd(dm[:nimp,nimp:])
+    proj = numpy.zeros((nsite,nimp*2))
+    proj[:nimp,:nimp] = numpy.eye(nimp)
+    proj[nimp:,nimp:] = vt[:nimp].T
+    fock0 = reduce(numpy.dot, (proj.T, h, proj))
+    dm_ref = reduce(numpy.dot, (proj.T, fermi_dm(h, nocc, u*.25), proj))
+    return fock0, nimp, dm_ref
+
+def peak_mem():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def run(title, fock0, nocc, nimp, dm_ref):
+    print '%-10s %-12s %-12s %-9s %-5s %8s %5s %5s %8s %9s %9s' % \
+            (title, 'v_domain', 'dm_domain', 'constr', 'meth', 'time/ms',
+             'neigh', 'nfev', 'peak/MB', 'norm_ddm', 'constr')
+    for v_domain, vkey in V_DOMAINS:
+        for dm_domain, dmkey in DM_DOMAINS:
+# ImpDiagV only has the response of the diagonal DM
+            if v_domain == fitdm.IMP_DIAG and dm_domain != fitdm.IMP_DIAG:
+                continue
+            for constr, ckey in CONSTRAINTS:
+                for method, mkey in METHODS:
+                    t0 = time.time()
+                    try:
+                        vfit, info = fitdm.fit_solver_quiet(fock0, nocc, nimp, \
+                                                            dm_ref, v_domain, \
+                                                            dm_domain, constr, \
+                                                            method=method, \
+                                                            with_info=True)
+                    except Exception as err:
+                        print '%-10s %-12s %-12s %-9s %-5s  failed: %s' % \
+                                (title, vkey, dmkey, ckey, mkey,
+                                 str(err).split('\n')[0][:40])
+                        continue
+                    t1 = time.time()
+                    print '%-10s %-12s %-12s %-9s %-5s %8.2f %5d %5s %8.1f %9.2e %9.2e' % \
+                            (title, vkey, dmkey, ckey, mkey, (t1-t0)*1e3,
+                             info['neigh'], info.get('nfev', '-'), peak_mem(),
+                             info['norm_ddm'], info['norm_constr'])
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sizes = [int(x) for x in sys.argv[1:]]
+    else:
+        sizes = (2, 4, 8)
+    for nimp in sizes:
+        fock0, nocc, dm_ref = random_problem(nimp, 12)
+        run('rand%d' % nimp, fock0, nocc, nimp, dm_ref)
+        fock0, nocc, dm_ref = hubbard_problem(nimp, 12)
+        run('hubbard%d' % nimp, fock0, nocc, nimp, dm_ref)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+#
+# Benchmark of vasphf.read_hfdump (concurrent, numpy-parsed) against the
+# sequential line reader it replaces, on synthetic FOCKDUMP, JDUMP, KDUMP and
+# CORRPOTDUMP of norb = 200 ... 500.  The dictionaries must be identical.
+#
+#   python bench_hfdump.py [norb ...]
+#
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import re
+import time
+import tempfile
+import shutil
+import numpy
+import scipy.linalg
+import vasphf
+
+# the old reader.  It looks for CORRPOTDUMP in the working directory
+def read_hfdump_lines(jdump, kdump, fockdump):
+    dic = {}
+    finp = open(fockdump, 'r')
+    dat = re.split('[=,]', finp.readline())
+    while dat[0]:
+        if 'FCI' in dat[0].upper():
+            dic['NORB'] = int(dat[1])
+            dic['NELEC'] = int(dat[3])
+            dic['MS2'] = int(dat[5])
+        elif 'UHF' in dat[0].upper():
+            if 'TRUE' in dat[1].upper():
+                dic['UHF'] = True
+            else:
+                dic['UHF'] = False
+        elif 'END' in dat[0].upper():
+            break
+        dat = re.split('[=,]', finp.readline())
+    norb = dic['NORB']
+    fock = numpy.zeros((norb,norb))
+    dat = finp.readline().split()
+    while dat:
+        i, j = map(int, dat[1:3])
+        if j != 0:
+            fock[i-1,j-1] = float(dat[0])
+        dat = finp.readline().split()
+
+    corrpot = numpy.zeros((norb,norb))
+    try:
+        with open('CORRPOTDUMP', 'r') as finp:
+            dat = finp.readline()
+            while 'END' not in dat:
+                dat = finp.readline()
+            dat = finp.readline().split()
+            while dat:
+                i, j = map(int, dat[1:3])
+                corrpot[i-1,j-1] = float(dat[0])
+                dat = finp.readline().split()
+    except:
+        pass
+
+    mats = []
+    for fname in (jdump, kdump):
+        v = numpy.zeros((norb,norb))
+        finp = open(fname, 'r')
+        dat = finp.readline()
+        while 'END' not in dat:
+            dat = finp.readline()
+        dat = finp.readline().split()
+        while dat:
+            i, j = map(int, dat[1:3])
+            v[i-1,j-1] = float(dat[0])
+            dat = finp.readline().split()
+        finp.close()
+        mats.append(v)
+    vj, vk = mats
+
+    dic['MO_ENERGY'] = scipy.linalg.eigh(fock+corrpot)[0]
+    dic['HCORE'] = fock-(vj+vk)
+    dic['J'] = vj
+    dic['K'] = vk
+    return dic
+
+def write_dump(fname, mat, with_diag=False, nelec=None):
+    norb = mat.shape[0]
+    if nelec is None:
+        nelec = norb
+    with open(fname, 'w') as f:
+        f.write(' &FCI NORB=%4d,NELEC=%4d,MS2=0,\n' % (norb, nelec))
+        f.write('  UHF=.FALSE.,\n')
+        f.write(' &END\n')
+        i, j = numpy.indices((norb,norb))
+        i = i.ravel() + 1
+        j = j.ravel() + 1
+        v = mat.ravel()
+        f.write(('%.16E %4d %4d    0    0\n' * v.size) %
+                tuple(numpy.vstack((v, i, j)).T.ravel().tolist()))
+        if with_diag:
+            for k in range(norb):
+                f.write('%.16E %4d    0    0    0\n' % (mat[k,k], k+1))
+
+def gen_dumps(path, norb, seed=1):
+    rand = numpy.random.RandomState(seed)
+    for name in ('FOCKDUMP', 'JDUMP', 'KDUMP', 'CORRPOTDUMP'):
+        a = rand.random_sample((norb,norb))
+        write_dump(os.path.join(path, name), a+a.T, name == 'FOCKDUMP')
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sizes = [int(x) for x in sys.argv[1:]]
+    else:
+        sizes = (200, 300, 400, 500)
+    tdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    print '%5s %11s %10s %10s %8s %6s' % \
+            ('norb', 'bytes', 'lines/s', 'new/s', 'speedup', 'same')
+    for norb in sizes:
+        gen_dumps(tdir, norb)
+        files = [os.path.join(tdir, x) for x in ('JDUMP', 'KDUMP', 'FOCKDUMP')]
+        nbytes = sum([os.path.getsize(os.path.join(tdir, x)) for x in
+                      ('JDUMP', 'KDUMP', 'FOCKDUMP', 'CORRPOTDUMP')])
+        os.chdir(tdir)
+        t0 = time.time()
+        ref = read_hfdump_lines(*files)
+        t1 = time.time()
+        os.chdir(cwd)
+        sys.stdout = open(os.devnull, 'w')
+        dic = vasphf.read_hfdump(*files)
+        sys.stdout = sys.__stdout__
+        t2 = time.time()
+        same = sorted(ref.keys()) == sorted(dic.keys())
+        for k in ref:
+            same = same and numpy.array_equal(ref[k], dic[k])
+        print '%5d %11d %10.3f %10.3f %8.1f %6s' % \
+                (norb, nbytes, t1-t0, t2-t1, (t1-t0)/(t2-t1), same)
+    shutil.rmtree(tdir)
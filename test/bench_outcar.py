@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+#
+# Benchmark of the Vasp.read_* methods served by vasp.OutcarIndex against the
+# line scans they replace, on a synthetic OUTCAR of nelm iterations.  The
+# results must be identical.  The OUTCAR is then appended to, and the index
+# is updated incrementally.
+#
+#   python bench_outcar.py [nelm ...]
+#
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import re
+import time
+import tempfile
+import shutil
+import numpy
+import vasp
+
+NATM = 8
+NBANDS = 64
+NKPT = 4
+
+# the old readers, one scan of OUTCAR each
+def read_energy_lines():
+    energy_free = energy_zero = 0
+    for line in open('OUTCAR', 'r'):
+        if line.lower().startswith('  free  energy   toten'):
+            energy_free = float(line.split()[-2])
+        if line.startswith('  energy  without entropy'):
+            energy_zero = float(line.split()[-1])
+    return [energy_free, energy_zero]
+
+def read_number_of_iterations_lines():
+    niter = None
+    for line in open('OUTCAR'):
+        if line.find('- Iteration') != -1:
+            niter = int(line.split(')')[0].split('(')[-1].strip())
+    return niter
+
+def read_fermi_lines():
+    E_f = None
+    for line in open('OUTCAR', 'r'):
+        if line.rfind('E-fermi') > -1:
+            E_f = float(line.split()[2])
+    return E_f
+
+def read_nbands_lines():
+    for line in open('OUTCAR', 'r'):
+        if line[0] != '|' and line.rfind('NBANDS') > -1:
+            return int(line.split()[-1])
+
+def read_convergence_lines():
+    converged = None
+    for line in open('OUTCAR', 'r'):
+        if line.rfind('EDIFF  ') > -1:
+            ediff = float(line.split()[2])
+        if line.rfind('total energy-change') > -1:
+            split = line.split(':')
+            a = float(split[1].split('(')[0])
+            b = float(split[1].split('(')[1][0:-2])
+            converged = [abs(a), abs(b)] < [ediff, ediff]
+    return converged
+
+def read_forces_lines():
+    lines = open('OUTCAR', 'r').readlines()
+    for n, line in enumerate(lines):
+        if line.rfind('TOTAL-FORCE') > -1:
+            forces = [[float(f) for f in lines[n+2+i].split()[3:6]]
+                      for i in range(NATM)]
+    return numpy.array(forces)
+
+def read_occupation_numbers_lines(kpt):
+    lines = open('OUTCAR').readlines()
+    start = 0
+    for n, line in enumerate(lines):
+        if re.search(' k-point *'+str(kpt+1)+' *:', line) is not None:
+            start = n
+    for n2, line2 in enumerate(lines[start+2:]):
+        if not line2.strip():
+            break
+    return numpy.array([float(line.split()[2])
+                        for line in lines[start+2:start+2+n2]])
+
+def write_iterations(f, rand, it0, nelm):
+    for it in range(it0, it0+nelm):
+        f.write('-------------------------------------- Iteration      1(%4d)'
+                '  ---------------------------------------\n\n' % (it+1))
+        for i in range(40):
+            f.write('    POTLOK:  cpu time    0.0%03d: real time    0.0%03d\n'
+                    % (i, i))
+        f.write('  free energy    TOTEN  =      %.8f eV\n\n'
+                % rand.random_sample())
+        f.write('  total energy-change (2. order) :%.7E  (%.7E)\n'
+                % (rand.random_sample()*1e-3, rand.random_sample()*1e-3))
+        for k in range(NKPT):
+            f.write(' k-point %4d :       0.0000    0.0000    0.0000\n' % (k+1))
+            f.write('  band No.  band energies     occupation\n')
+            for b in range(NBANDS):
+                f.write('  %6d    %10.4f    %10.5f\n' %
+                        (b+1, rand.random_sample(), rand.random_sample()))
+            f.write('\n')
+        f.write(' E-fermi :   %.4f     XC(G=0):  -0.1\n' % rand.random_sample())
+        f.write('  FREE ENERGIE OF THE ION-ELECTRON SYSTEM (eV)\n')
+        f.write('  free  energy   TOTEN  =       %.8f eV\n\n'
+                % rand.random_sample())
+        f.write('  energy  without entropy=      %.8f  energy(sigma->0) =  '
+                '%.8f\n\n' % (rand.random_sample(), rand.random_sample()))
+        f.write(' POSITION                                       TOTAL-FORCE '
+                '(eV/Angst)\n')
+        f.write(' ' + '-'*83 + '\n')
+        for a in range(NATM):
+            f.write('      0.00000      0.00000      0.00000     '
+                    ' %.6f     %.6f     %.6f\n' % tuple(rand.random_sample(3)))
+        f.write(' ' + '-'*83 + '\n\n')
+
+def write_outcar(fname, nelm, seed=1):
+    rand = numpy.random.RandomState(seed)
+    with open(fname, 'w') as f:
+        f.write(' vasp.5.3.5 31Mar14 (build Nov 19 2014) complex\n')
+        f.write('   NBANDS=     %d\n' % NBANDS)
+        f.write('   EDIFF  = 0.1E-08   stopping-criterion for ELM\n')
+        f.write('   Fermi-smearing in eV        SIGMA  =   0.10\n')
+        f.write('   total number of electrons =  %d  \n\n' % NBANDS)
+        write_iterations(f, rand, 0, nelm)
+
+def read_all(calc):
+    return [calc.read_number_of_iterations(), calc.read_energy(),
+            calc.read_fermi(), calc.read_nbands(), calc.read_convergence(),
+            calc.read_forces(range(NATM)), calc.read_occupation_numbers(0),
+            calc.read_occupation_numbers(NKPT-1)]
+
+def read_all_lines():
+    return [read_number_of_iterations_lines(), read_energy_lines(),
+            read_fermi_lines(), read_nbands_lines(), read_convergence_lines(),
+            read_forces_lines(), read_occupation_numbers_lines(0),
+            read_occupation_numbers_lines(NKPT-1)]
+
+def same(a, b):
+    return all([numpy.array_equal(x, y) for x, y in zip(a, b)])
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sizes = [int(x) for x in sys.argv[1:]]
+    else:
+        sizes = (100, 500, 2000)
+    tdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(tdir)
+    print '%5s %11s %10s %10s %8s %10s %6s' % \
+            ('nelm', 'bytes', 'lines/s', 'index/s', 'speedup', 'append/s',
+             'same')
+    for nelm in sizes:
+        write_outcar('OUTCAR', nelm)
+        calc = vasp.Vasp()
+        calc.resort = range(NATM)
+        calc.int_params = {'ibrion': None, 'nsw': None}
+        calc.get_number_of_spins = lambda: 1
+        t0 = time.time()
+        ref = read_all_lines()
+        t1 = time.time()
+        res = read_all(calc)
+        t2 = time.time()
+        ok = same(ref, res)
+        # VASP goes on: 10% more iterations
+        with open('OUTCAR', 'a') as f:
+            write_iterations(f, numpy.random.RandomState(2), nelm, nelm//10)
+        t3 = time.time()
+        res = read_all(calc)
+        t4 = time.time()
+        ok = ok and same(read_all_lines(), res)
+        print '%5d %11d %10.3f %10.3f %8.1f %10.3f %6s' % \
+                (nelm, os.path.getsize('OUTCAR'), t1-t0, t2-t1,
+                 (t1-t0)/(t2-t1), t4-t3, ok)
+    # a new OUTCAR replaces the old one
+    write_outcar('OUTCAR', 10, seed=5)
+    print 'replaced', same(read_all_lines(), read_all(calc))
+    os.chdir(cwd)
+    shutil.rmtree(tdir)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+#
+# Benchmark of impsolver.part_eri_hermi against the row-by-row loop it
+# replaces, for embeddings of nemb = 10 ... 40 orbitals.
+#
+#   python bench_part_eri.py [nemb ...]
+#
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import time
+import numpy
+from pyscf import lib
+from pyscf import ao2mo
+import impsolver
+
+def part_eri_hermi_loop(eri, norb, nimp):
+    eri1 = ao2mo.restore(4, eri, norb).copy()
+    for i in range(eri1.shape[0]):
+        tmp = lib.unpack_tril(eri1[i])
+        tmp[nimp:] = 0
+        eri1[i] = lib.pack_tril(tmp+tmp.T)
+    eri1 = lib.transpose_sum(eri1, inplace=True)
+    return ao2mo.restore(8, eri1, norb) * .25
+
+def timing(fn, *args):
+    t0 = time.time()
+    ncall = 0
+    while True:
+        res = fn(*args)
+        ncall += 1
+        if time.time() - t0 > .5:
+            break
+    return res, (time.time()-t0) / ncall
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sizes = [int(x) for x in sys.argv[1:]]
+    else:
+        sizes = (10, 20, 30, 40)
+    rand = numpy.random.RandomState(1)
+    print '%5s %5s %11s %11s %8s %9s' % \
+            ('nemb', 'nimp', 'loop/ms', 'vector/ms', 'speedup', 'max_diff')
+    for nemb in sizes:
+        npair = nemb*(nemb+1)//2
+        eri = rand.random_sample((npair,npair))
+        eri = eri + eri.T
+        nimp = nemb // 2
+        ref, t_loop = timing(part_eri_hermi_loop, eri, nemb, nimp)
+        res, t_vec = timing(impsolver.part_eri_hermi, eri, nemb, nimp)
+        print '%5d %5d %11.2f %11.2f %8.1f %9.2e' % \
+                (nemb, nimp, t_loop*1e3, t_vec*1e3, t_loop/t_vec,
+                 abs(res-ref).max())
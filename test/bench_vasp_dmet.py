@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#
+# Benchmark of the periodic DMET code path on the dumps of mock_vaspdump.py,
+# as the number of orbitals grows: parsing of the text and binary dumps
+# (vasphf.parse_vaspdump), loading of the HDF5 dump, embedding setup
+# (vasphf.RHF + vaspimp.OneImp.imp_scf) and one-shot DMET of
+# vaspdmet_nonsc.EmbSysPeriod with the FCI solver.  The one-shot energies of
+# the three formats must be the same.
+#
+#   python bench_vasp_dmet.py [hubbard|hchain] [norb ...]
+#
+
+import os, sys
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import time
+import tempfile
+import shutil
+import numpy
+from pyscf import gto
+import vasphf
+import vaspimp
+import vaspdmet_nonsc
+import impsolver
+import mock_vaspdump
+
+NIMP = 2
+
+def dump_size(path):
+    return sum([os.path.getsize(os.path.join(path, x))
+                for x in os.listdir(path)])
+
+def setup(path):
+    mol = gto.Mole()
+    mol.verbose = 0
+    mol.build(False, False)
+    emb = vaspimp.OneImp(vasphf.RHF(mol, path))
+    emb.verbose = 0
+    emb.imp_scf()
+    return emb
+
+def one_shot(path):
+    embsys = vaspdmet_nonsc.EmbSysPeriod(path)
+    embsys.mol.verbose = 0
+    embsys.solver = impsolver.FCI()
+    embsys.verbose = 0
+    embsys.emb_verbose = 0
+    return embsys.one_shot()
+
+if __name__ == '__main__':
+    model = 'hubbard'
+    args = sys.argv[1:]
+    if args and not args[0].isdigit():
+        model = args.pop(0)
+    if args:
+        sizes = [int(x) for x in args]
+    elif model == 'hubbard':
+        sizes = (50, 100, 200, 400)
+    else:
+        sizes = (10, 20, 40)
+    tdir = tempfile.mkdtemp()
+    print '%5s %5s %11s %8s %8s %8s %8s %8s %8s %6s' % \
+            ('norb', 'nemb', 'text bytes', 'text/s', 'binary/s', 'h5/s',
+             'setup/s', '1shot/s', 'total/s', 'same')
+    for norb in sizes:
+        if model == 'hubbard':
+            dic = mock_vaspdump.mock_hubbard(norb, range(NIMP))
+        else:
+            dic = mock_vaspdump.mock_mol(mock_vaspdump.hchain(norb),
+                                         range(NIMP))
+        timing = {}
+        energy = {}
+        for format in mock_vaspdump.FORMATS:
+            path = os.path.join(tdir, format)
+            os.mkdir(path)
+            sys.stdout = open(os.devnull, 'w')
+            mock_vaspdump.write_vaspdump(path, dic, format)
+            if format == 'text':
+                nbytes = dump_size(path)
+            t0 = time.time()
+            if format == 'h5':
+                vasphf.read_vaspdump(path)
+            else:
+                vasphf.parse_vaspdump(path)
+            t1 = time.time()
+# the text and binary dumps are converted to the HDF5 sidecar here
+            setup(path)
+            t2 = time.time()
+            energy[format] = one_shot(path)
+            t3 = time.time()
+            sys.stdout = sys.__stdout__
+            timing[format] = (t1-t0, t2-t1, t3-t2)
+            shutil.rmtree(path)
+        e = energy['text']
+        same = all([abs(x-e) < 1e-9 for x in energy.values()])
+        t_setup, t_1shot = timing['h5'][1:]
+        print '%5d %5d %11d %8.3f %8.3f %8.3f %8.3f %8.3f %8.3f %6s' % \
+                (norb, dic['NEMB'], nbytes, timing['text'][0],
+                 timing['binary'][0], timing['h5'][0], t_setup, t_1shot,
+                 sum(timing['text']), same)
+    shutil.rmtree(tdir)
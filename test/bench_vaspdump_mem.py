@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# Peak memory of loading a VASP dump and handing the ERI to the impurity
+# solver, with the arrays read into memory (as load_h5dump did before) and
+# with vasphf.LazyDump.  Each case runs in a fresh process; VmHWM is the peak
+# resident size, RssAnon the resident memory which is not backed by a file.
+#
+#   python bench_vaspdump_mem.py [nemb ...]
+#
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import tempfile
+import shutil
+import subprocess
+import numpy
+import h5py
+from pyscf import ao2mo
+import vasphf
+
+def proc_status():
+    dic = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            k, v = line.split(':', 1)
+            if v.strip().endswith('kB'):
+                dic[k] = int(v.split()[0]) * 1024
+    return dic
+
+def load_eager(h5dump):
+    f = h5py.File(h5dump, 'r')
+    dic = {}
+    for k,v in f.items():
+        if v.shape:
+            dic[k] = numpy.array(v)
+        else:
+            dic[k] = v[()]
+    f.close()
+    return dic
+
+def run(h5dump, mode):
+    if mode == 'eager':
+        dic = load_eager(h5dump)
+        nemb = dic['NEMB']
+        eri = ao2mo.restore(8, ao2mo.restore(8, dic['ERI'], nemb), nemb)
+    else:
+        dic = vasphf.load_h5dump(h5dump)
+        eri = dic['ERI'].reshape(-1)
+    mo = dic['MO_COEFF']
+    embasis = dic['EMBASIS']
+    # what the solvers do with the integrals: read all of them
+    s = eri.sum() + mo.sum() + embasis.sum()
+    st = proc_status()
+    return st['VmHWM'], st['RssAnon']
+
+def make_h5dump(h5dump, nemb, norb):
+    npair = nemb*(nemb+1)//2
+    rand = numpy.random.RandomState(1)
+    with h5py.File(h5dump, 'w') as f:
+        f['ERI'] = rand.random_sample(npair*(npair+1)//2)
+        f['MO_COEFF'] = rand.random_sample((norb,norb))
+        f['EMBASIS'] = rand.random_sample((norb,nemb))
+        f['H1EMB'] = rand.random_sample((nemb,nemb))
+        f['NEMB'] = nemb
+        f['NORB'] = norb
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] in ('eager', 'lazy', 'base'):
+        if sys.argv[1] == 'base':
+            st = proc_status()
+            print st['VmHWM'], st['RssAnon']
+        else:
+            print '%d %d' % run(sys.argv[2], sys.argv[1])
+        sys.exit()
+
+    if len(sys.argv) > 1:
+        sizes = [int(x) for x in sys.argv[1:]]
+    else:
+        sizes = (40, 60, 80)
+    tdir = tempfile.mkdtemp()
+    h5dump = os.path.join(tdir, 'FCIDUMP.CLUST.GTO.h5')
+    base = subprocess.check_output([sys.executable, __file__, 'base', h5dump])
+    base = [int(x) for x in base.split()]
+    print '%5s %9s %14s %14s %14s %14s' % \
+            ('nemb', 'ERI/MB', 'eager peak/MB', 'lazy peak/MB',
+             'eager anon/MB', 'lazy anon/MB')
+    for nemb in sizes:
+        make_h5dump(h5dump, nemb, nemb*2)
+        res = []
+        for mode in ('eager', 'lazy'):
+            out = subprocess.check_output([sys.executable, __file__, mode, h5dump])
+            res.append([int(x) for x in out.split()])
+        npair = nemb*(nemb+1)//2
+        print '%5d %9.1f %14.1f %14.1f %14.1f %14.1f' % \
+                (nemb, npair*(npair+1)/2*8e-6,
+                 (res[0][0]-base[0])/1e6, (res[1][0]-base[0])/1e6,
+                 (res[0][1]-base[1])/1e6, (res[1][1]-base[1])/1e6)
+    shutil.rmtree(tdir)
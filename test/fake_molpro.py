@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+#
+# Stand-in for the molpro executable, to test molproitrf without molpro.
+#   fake_molpro.py inputs
+# It reads fcidump and orb.matrop of the current directory, runs RHF in the
+# fcidump basis and writes inputs.out (and rdm1 if the input asks for the
+# density) in the layout molproitrf.read_outputs expects.  The "correlated"
+# energy and density are the HF ones.
+#
+# FAKE_MOLPRO_SLEEP=t   sleep t seconds before the calculation
+# FAKE_MOLPRO_FAIL=x    x = fehler: print molpro's error message
+#                       x = exit:   exit with status 3
+#                       x = output: do not write inputs.out
+#
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import time
+import numpy
+from pyscf.tools import fcidump
+import impsolver
+
+def read_matrop(fname):
+    dat = open(fname).read().replace(',', ' ').split()
+    return numpy.array(map(float, dat[1:-1]))
+
+if __name__ == '__main__':
+    inpfile = sys.argv[1]
+    time.sleep(float(os.environ.get('FAKE_MOLPRO_SLEEP', 0)))
+    fail = os.environ.get('FAKE_MOLPRO_FAIL', '')
+    if fail == 'fehler':
+        print ' ? Error\n ? fehler in input'
+        sys.exit(0)
+    elif fail == 'exit':
+        print 'killed'
+        sys.exit(3)
+    elif fail == 'output':
+        sys.exit(0)
+
+    dump = fcidump.read('fcidump')
+    nmo = dump['NORB']
+    nelec = dump['NELEC']
+    mo = read_matrop('orb.matrop').reshape(nmo,nmo)
+    escf, mo_energy, mo, mo_occ = \
+            impsolver.simple_hf(dump['H1'], dump['H2'], mo, nelec)
+    escf += dump['ECORE']
+
+    with open(inpfile+'.out', 'w') as f:
+        f.write(' fake molpro\n')
+        f.write('      CORR           HF-SCF\n')
+        f.write('  %16.10f %16.10f\n' % (escf, escf))
+        f.write(' ' + '*'*60 + '\n')
+        f.write(' Molpro calculation terminated\n')
+    if 'dm,5000.2' in open(inpfile).read():
+        dm = numpy.dot(mo*mo_occ, mo.T)
+        with open('rdm1', 'w') as f:
+            f.write('# MATROP DENSITY\n')
+            f.write('BEGIN_DATA,\n')
+            f.write(',\n'.join(['%25.15f' % x for x in dm.ravel()]))
+            f.write(',\nEND_DATA,\n')
+    print ' Molpro calculation terminated'
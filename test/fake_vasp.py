@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+#
+# Stand-in for the second VASP pass, to test vasprunner and vaspdmet_sc
+# without VASP.
+#   fake_vasp.py refdir
+# Run in the dump directory.  It reads CorrPot (nimp*nimp values) and, like
+# VASP, writes the dumps in two stages: JDUMP, KDUMP, FOCKDUMP and
+# CORRPOTDUMP (CorrPot on the first nimp orbitals), then FCIDUMP.CLUST.GTO.
+# The dumps other than CORRPOTDUMP are copied from refdir.  HF takes 10
+# iterations from scratch, 3 when it restarts from WAVECAR.  It writes
+# WAVECAR and CHGCAR.  With CorrPot.bin (newer than CorrPot), it reads
+# CorrPot.bin and writes the binary dumps instead, copying the *.bin of refdir.
+#
+# FAKE_VASP_SLEEP=t   each iteration takes t/5 seconds
+# FAKE_VASP_FAIL=x    x = exit:   exit with status 1 after the first stage
+#                     x = nodump: do not write FCIDUMP.CLUST.GTO
+#                     x = hang:   do not finish the first stage
+#                     x = baddump: JDUMP is corrupt
+#                     x = halfdump: JDUMP is half written in the first stage
+#                                   and completed in the second stage
+#                     x = latecorrpot: write CORRPOTDUMP in the second stage
+#
+
+import os, sys
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import time
+import shutil
+import numpy
+import vasphf
+from bench_hfdump import write_dump
+
+def stage(name, t, niter=5):
+    for i in range(niter):
+        sys.stdout.write('%s iteration %d\n' % (name, i+1))
+        sys.stdout.flush()
+        time.sleep(t/5)
+
+if __name__ == '__main__':
+    refdir = sys.argv[1]
+    t = float(os.environ.get('FAKE_VASP_SLEEP', 0))
+    fail = os.environ.get('FAKE_VASP_FAIL', '')
+
+    binary = os.path.isfile('CorrPot.bin') and \
+            (not os.path.isfile('CorrPot') or
+             os.path.getmtime('CorrPot.bin') >= os.path.getmtime('CorrPot'))
+    if binary:
+        suffix = vasphf.BIN_SUFFIX
+    else:
+        suffix = ''
+    v = vasphf.read_corrpot('.', binary)
+    nimp = v.shape[0]
+    norb = int(open(os.path.join(refdir, 'FOCKDUMP')).readline()
+               .split('=')[1].split(',')[0])
+    corrpot = numpy.zeros((norb,norb))
+    corrpot[:nimp,:nimp] = v
+
+    if fail == 'hang':
+        stage('HF', 3600)
+    if os.path.isfile('WAVECAR') and os.path.getsize('WAVECAR') > 0:
+        stage('HF', t, 3)
+    else:
+        stage('HF', t, 10)
+    with open('WAVECAR', 'wb') as f:
+        f.write(os.urandom(4096))
+    with open('CHGCAR', 'w') as f:
+        f.write('fake charge density %s\n' % time.time())
+    for name in ('JDUMP', 'KDUMP', 'FOCKDUMP'):
+        shutil.copy(os.path.join(refdir, name+suffix), name+suffix)
+    def write_corrpot():
+        if binary:
+            vasphf.write_bindump('CORRPOTDUMP.bin', [('CORRPOT', corrpot)])
+        else:
+            write_dump('CORRPOTDUMP', corrpot)
+    if fail == 'baddump':
+        with open('JDUMP'+suffix, 'w') as f:
+            f.write(' &FCI NORB=%4d,\n &END\n1.0 1 1 0\n' % norb)
+    if fail == 'halfdump':
+        jdump = open(os.path.join(refdir, 'JDUMP'+suffix), 'rb').read()
+        with open('JDUMP'+suffix, 'wb') as f:
+            f.write(jdump[:len(jdump)//2])
+    if fail != 'latecorrpot':
+        write_corrpot()
+    sys.stderr.write('warning: fake VASP\n')
+    if fail == 'exit':
+        sys.stderr.write('error: fake VASP failure\n')
+        sys.exit(1)
+
+    stage('CLUSTDUMP', t)
+    if fail == 'latecorrpot':
+        write_corrpot()
+    if fail == 'halfdump':
+        shutil.copy(os.path.join(refdir, 'JDUMP'+suffix), 'JDUMP'+suffix)
+    if fail != 'nodump':
+        shutil.copy(os.path.join(refdir, 'FCIDUMP.CLUST.GTO'+suffix),
+                    'FCIDUMP.CLUST.GTO'+suffix)
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+#
+# Synthetic VASP dump directories, for vasphf.RHF, vaspimp.OneImp and the
+# EmbSysPeriod drivers without VASP.  The dumps are the ones VASP writes for
+# the RHF of
+#   mock_mol      a PySCF molecule, on its Lowdin orthogonalized AOs
+#   mock_hubbard  the 1D Hubbard ring, on the sites
+# with the impurity orbitals orbind and the DMET bath of the RHF density
+# matrix.  They are consistent: without correlation potential, the embedding
+# HF of vaspimp.OneImp gives back the RHF density matrix on the embedding
+# basis.  The dumps are written as
+#   'text'    FCIDUMP.CLUST.GTO, JDUMP, KDUMP, FOCKDUMP, CORRPOTDUMP
+#   'binary'  the same with vasphf.BIN_SUFFIX (vasphf.write_bindump)
+#   'h5'      FCIDUMP.CLUST.GTO as the HDF5 dump of vasphf.write_h5dump
+#
+#   python mock_vaspdump.py path hubbard|hchain norb [nimp [format]]
+#
+
+import os, sys
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import numpy
+import scipy.linalg
+from pyscf import gto
+from pyscf import scf
+from pyscf import ao2mo
+from pyscf import lib
+from pyscf.lo import orth
+import vasphf
+from bench_hfdump import write_dump
+
+# bath orbitals of smaller singular value (no entanglement with the impurity)
+# are dropped
+BATH_CUTOFF = 1e-8
+FORMATS = ('text', 'binary', 'h5')
+
+class _OrthRHF(scf.hf.RHF):
+# RHF on an orthonormal basis, h1 includes the correlation potential
+    def __init__(self, h1, get_jk, nelec):
+        mol = gto.Mole()
+        mol.verbose = 0
+        mol.build(False, False)
+        mol.nelectron = nelec
+        scf.hf.RHF.__init__(self, mol)
+        self._h1 = h1
+        self._get_jk = get_jk
+        self.conv_tol = 1e-12
+        self.max_cycle = 200
+
+    def get_hcore(self, *args):
+        return self._h1
+    def get_ovlp(self, *args):
+        return numpy.eye(self._h1.shape[0])
+    def get_jk(self, mol=None, dm=None, hermi=1, *args, **kwargs):
+        return self._get_jk(dm)
+    def energy_nuc(self):
+        return 0
+
+def dmet_bath(dm, orbind):
+    '''Embedding basis, the impurity orbitals orbind then the bath'''
+    norb = dm.shape[0]
+    env = numpy.array([i for i in range(norb) if i not in orbind])
+    u, s, vt = numpy.linalg.svd(dm[env][:,orbind], full_matrices=False)
+    bath = u[:,s > BATH_CUTOFF]
+    embasis = numpy.zeros((norb,len(orbind)+bath.shape[1]))
+    embasis[orbind,numpy.arange(len(orbind))] = 1
+    embasis[env,len(orbind):] = bath
+    return embasis
+
+def make_vaspdump(h1, get_jk, get_eri_emb, nelec, orbind, corrpot=None):
+    '''The dictionary of vasphf.parse_vaspdump for the RHF of h1 (and
+    corrpot) on an orthonormal basis.  get_jk(dm) returns the PySCF vj, vk,
+    get_eri_emb(embasis) the 8-fold ERI on the embedding basis'''
+    norb = h1.shape[0]
+    if corrpot is None:
+        corrpot = numpy.zeros((norb,norb))
+    mf = _OrthRHF(h1+corrpot, get_jk, nelec)
+    e, c = scipy.linalg.eigh(h1+corrpot)
+    mf.kernel(mf.make_rdm1(c, mf.get_occ(e, c)))
+    if not mf.converged:
+        raise RuntimeError('RHF of the mock system not converged')
+    mo_coeff = mf.mo_coeff
+    dm = mf.make_rdm1()
+    vj, vk = get_jk(dm)
+# the conventions of JDUMP and KDUMP
+    vk = vk * -.5
+    hcore = h1
+    fock = hcore + vj + vk
+
+    embasis = dmet_bath(dm, orbind)
+    dmemb = reduce(numpy.dot, (embasis.T, dm, embasis))
+    dic = {'NORB': norb, 'NELEC': nelec, 'MS2': 0, 'UHF': False,
+           'MO_ENERGY': scipy.linalg.eigh(fock+corrpot)[0],
+           'HCORE': hcore, 'J': vj, 'K': vk,
+           'NEMB': embasis.shape[1],
+           'NELECEMB': int(round(dmemb.trace())),
+           'NIMP': len(orbind), 'ORBIND': list(orbind),
+           'ERI': get_eri_emb(embasis), 'MO_COEFF': mo_coeff,
+           'EMBASIS': embasis,
+           'H1EMB': reduce(numpy.dot, (embasis.T, hcore+corrpot, embasis)),
+           'CORRPOT': reduce(numpy.dot, (embasis.T, corrpot, embasis))}
+    return dic
+
+def mock_mol(mol, orbind, corrpot=None):
+    '''Dump dictionary of the molecule mol'''
+    c = orth.lowdin(scf.hf.get_ovlp(mol))
+    h1 = reduce(numpy.dot, (c.T, scf.hf.get_hcore(mol), c))
+    def get_jk(dm):
+        vj, vk = scf.hf.get_jk(mol, reduce(numpy.dot, (c, dm, c.T)))
+        return reduce(numpy.dot, (c.T, vj, c)), reduce(numpy.dot, (c.T, vk, c))
+    def get_eri_emb(embasis):
+        eri = ao2mo.full(mol, numpy.dot(c, embasis))
+        return ao2mo.restore(8, eri, embasis.shape[1])
+    return make_vaspdump(h1, get_jk, get_eri_emb, mol.nelectron, orbind,
+                         corrpot)
+
+def hubbard_h1(nsite, t=1.):
+    '''Hopping of the ring, antiperiodic when the half filled ring is open
+    shell'''
+    h1 = numpy.zeros((nsite,nsite))
+    for i in range(nsite-1):
+        h1[i,i+1] = h1[i+1,i] = -t
+    if nsite % 4 == 0:
+        h1[nsite-1,0] = h1[0,nsite-1] = t
+    else:
+        h1[nsite-1,0] = h1[0,nsite-1] = -t
+    return h1
+
+def mock_hubbard(nsite, orbind, U=4., nelec=None, corrpot=None):
+    '''Dump dictionary of the Hubbard ring, half filled by default'''
+    if nelec is None:
+        nelec = nsite
+    def get_jk(dm):
+        v = numpy.diag(U*dm.diagonal())
+        return v, v
+    def get_eri_emb(embasis):
+        nemb = embasis.shape[1]
+        idx = numpy.tril_indices(nemb)
+        pair = embasis[:,idx[0]] * embasis[:,idx[1]]
+        return lib.pack_tril(numpy.dot(pair.T, pair) * U)
+    return make_vaspdump(hubbard_h1(nsite), get_jk, get_eri_emb, nelec,
+                         orbind, corrpot)
+
+def hchain(natm, bond=1.4, basis='sto-3g'):
+    mol = gto.Mole()
+    mol.verbose = 0
+    mol.atom = [('H', (0, 0, i*bond)) for i in range(natm)]
+    mol.basis = basis
+    mol.unit = 'B'
+    mol.build()
+    return mol
+
+def write_clustdump(fname, nelecemb, orbind, h1emb, mo, embasis, corrpot, eri):
+    '''FCIDUMP.CLUST.GTO, embasis on MO'''
+    nemb = h1emb.shape[0]
+    with open(fname, 'w') as f:
+        f.write(' &FCI NORB=%4d,NELECEMB=%4d,NIMP=%4d,\n' %
+                (nemb, nelecemb, len(orbind)))
+        f.write('  ORBIND=%s\n' % ','.join([str(i+1) for i in orbind]))
+        f.write(' &END\n')
+        ij = numpy.array([(i, j) for i in range(nemb) for j in range(i+1)])
+        p, q = numpy.tril_indices(len(ij))
+        idx = numpy.hstack((ij[p], ij[q])) + 1
+        f.write(('%.16E %4d %4d %4d %4d\n' * eri.size) %
+                tuple(numpy.hstack((eri.reshape(-1,1), idx)).ravel().tolist()))
+        for code, mat in ((0, h1emb), (-1, mo), (-2, embasis), (-3, corrpot)):
+            i, j = numpy.indices(mat.shape)
+            rec = numpy.vstack((mat.ravel(), i.ravel()+1, j.ravel()+1))
+            f.write(('%%.16E %%4d %%4d    0 %4d\n' % code * mat.size) %
+                    tuple(rec.T.ravel().tolist()))
+        f.write('\n')
+
+def write_vaspdump(path, dic, format='text', corrpot=None):
+    '''Write the dump dictionary of make_vaspdump in path.  corrpot, the
+    correlation potential given to make_vaspdump, goes to CORRPOTDUMP'''
+    assert(format in FORMATS)
+    if format == 'h5':
+        vasphf.write_h5dump(os.path.join(path, 'FCIDUMP.CLUST.GTO'), dic)
+        return
+# the HF dumps and embasis are on MO
+    mo = dic['MO_COEFF']
+    vj, vk = [reduce(numpy.dot, (mo.T, dic[k], mo)) for k in ('J', 'K')]
+    fock = reduce(numpy.dot, (mo.T, dic['HCORE'], mo)) + vj + vk
+    embasis = numpy.dot(mo.T, dic['EMBASIS'])
+    if corrpot is not None:
+        corrpot = reduce(numpy.dot, (mo.T, corrpot, mo))
+    if format == 'text':
+        nelec = dic['NELEC']
+        write_dump(os.path.join(path, 'FOCKDUMP'), fock, True, nelec)
+        write_dump(os.path.join(path, 'JDUMP'), vj, nelec=nelec)
+        write_dump(os.path.join(path, 'KDUMP'), vk, nelec=nelec)
+        if corrpot is not None:
+            write_dump(os.path.join(path, 'CORRPOTDUMP'), corrpot,
+                       nelec=nelec)
+        write_clustdump(os.path.join(path, 'FCIDUMP.CLUST.GTO'),
+                        dic['NELECEMB'], dic['ORBIND'], dic['H1EMB'], mo,
+                        embasis, dic['CORRPOT'], dic['ERI'])
+    else:
+        def fname(name):
+            return os.path.join(path, name+vasphf.BIN_SUFFIX)
+        vasphf.write_bindump(fname('FOCKDUMP'),
+                             [('NORB', dic['NORB']), ('NELEC', dic['NELEC']),
+                              ('MS2', dic['MS2']), ('UHF', int(dic['UHF'])),
+                              ('FOCK', fock)])
+        vasphf.write_bindump(fname('JDUMP'), [('J', vj)])
+        vasphf.write_bindump(fname('KDUMP'), [('K', vk)])
+        if corrpot is not None:
+            vasphf.write_bindump(fname('CORRPOTDUMP'),
+                                 [('CORRPOT', corrpot)])
+        vasphf.write_bindump(fname('FCIDUMP.CLUST.GTO'),
+                             [('NORB', dic['NEMB']),
+                              ('NELECEMB', dic['NELECEMB']),
+                              ('NIMP', dic['NIMP']),
+                              ('ORBIND', numpy.array(dic['ORBIND'])+1),
+                              ('H1EMB', dic['H1EMB']), ('MO_COEFF', mo),
+                              ('EMBASIS', embasis),
+                              ('CORRPOT', dic['CORRPOT']),
+                              ('ERI', dic['ERI'])])
+
+
+if __name__ == '__main__':
+    path, model, norb = sys.argv[1], sys.argv[2], int(sys.argv[3])
+    if len(sys.argv) > 4:
+        nimp = int(sys.argv[4])
+    else:
+        nimp = 2
+    if len(sys.argv) > 5:
+        format = sys.argv[5]
+    else:
+        format = 'text'
+    if model == 'hubbard':
+        dic = mock_hubbard(norb, range(nimp))
+    else:
+        dic = mock_mol(hchain(norb), range(nimp))
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    write_vaspdump(path, dic, format)
+    print '%s: norb %d, nemb %d, nelecemb %d, %s' % \
+            (path, dic['NORB'], dic['NEMB'], dic['NELECEMB'], format)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+#
+# The fragment energies h1e.dm1 + e2frag of the impurity solvers sum to the
+# total energy over a full partition (H6/sto-3g, Lowdin basis, three 2-site
+# fragments)
+#
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import numpy
+from pyscf import gto
+from pyscf import scf
+from pyscf import ao2mo
+from pyscf import lo
+import impsolver
+
+mol = gto.M(atom=[('H', (0, 0, i*1.4)) for i in range(6)], basis='sto-3g',
+            unit='B', verbose=0)
+mf = scf.RHF(mol)
+mf.kernel()
+c = lo.orth.lowdin(mf.get_ovlp())
+h1 = reduce(numpy.dot, (c.T, mf.get_hcore(), c))
+eri = ao2mo.restore(1, ao2mo.kernel(mol, c), 6)
+mo = numpy.linalg.solve(c, mf.mo_coeff)
+
+for name, solver in (('FCI', impsolver.fci), ('CCSD', impsolver.ccsd)):
+    e_sum = 0
+    for f in range(3):
+        # the impurity orbitals go first
+        idx = [2*f, 2*f+1] + [i for i in range(6) if i//2 != f]
+        h = h1[idx][:,idx]
+        g = ao2mo.restore(4, eri[idx][:,idx][:,:,idx][:,:,:,idx], 6)
+        ehf, etot, e2frag, dm1 = solver(mol, h, g, mo[idx], 6, True, 2)
+        e_sum += numpy.dot(h[:2].ravel(), dm1[:2].ravel()) + e2frag
+    print name, 'sum of e_frag', abs(e_sum - etot) < 1e-8
+
+# the CCSD e2frag contraction against the dense lambda 2-RDM (H4/6-31g)
+mol = gto.M(atom=[('H', (0, 0, i*1.6)) for i in range(4)], basis='6-31g',
+            unit='B', verbose=0)
+mf = scf.RHF(mol)
+mf.kernel()
+mycc = impsolver.pyscf.cc.ccsd.CCSD(mf)
+mycc.conv_tol = 1e-10
+mycc.kernel()
+mycc.solve_lambda()
+nmo = mf.mo_coeff.shape[1]
+eri1 = impsolver.part_eri_hermi(mol.intor('cint2e_sph'), nmo, 3)
+dm1 = mycc.make_rdm1()
+e2frag = impsolver.ccsd_e2frag(mycc, eri1, mf.mo_coeff, dm1,
+                               mycc.t1, mycc.t2, mycc.l1, mycc.l2)
+eri_mo = ao2mo.restore(1, ao2mo.incore.full(eri1, mf.mo_coeff), nmo)
+ref = numpy.dot(mycc.make_rdm2().ravel(), eri_mo.ravel()) * .5
+print 'CCSD e2frag == dense 2-RDM', abs(e2frag - ref) < 1e-10
+
+# the amplitudes of at most CCSD_AMPS_CACHE_SIZE embeddings are kept
+solver = impsolver.CCSD()
+for i in range(impsolver.CCSD_AMPS_CACHE_SIZE + 3):
+    solver.solver(mol, h, g.copy(), mo[idx], 6, False, None)
+print 'CCSD amplitude cache', \
+        len(solver._amps) == impsolver.CCSD_AMPS_CACHE_SIZE
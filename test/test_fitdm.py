@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+#
+# fitdm.trust_region_newton on a gapless 4-site ring (sigma = 0): the
+# singular Hessian must not give inf/nan steps, and a fit which stops with a
+# large residual is reported as stalled, not converged
+#
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import warnings
+import numpy
+import scipy.linalg
+import fitdm
+
+warnings.simplefilter('error', RuntimeWarning)
+
+n = 4
+h = numpy.zeros((n,n))
+for i in range(n):
+    h[i,(i+1)%n] = h[(i+1)%n,i] = -1
+# HOMO and LUMO of the half-filled ring are degenerate
+e, c = scipy.linalg.eigh(h)
+dm_ref = numpy.dot(c*fitdm.fermi_smearing_occ(e, 2, .5), c.T)
+
+for constr, key in ((fitdm.NO_CONSTRAINT, 'NO_CONSTR'),
+                    (fitdm.TRACE_IMP    , 'TRACE_IMP')):
+    v, info = fitdm.fit_solver_quiet(h, 2, 2, dm_ref, fitdm.IMP_AND_BATH,
+                                     fitdm.IMP_AND_BATH, constr,
+                                     method=fitdm.FIT_TRUST_REGION,
+                                     with_info=True)
+    print 'gapless ring', key, numpy.isfinite(v).all(), \
+            info['norm_ddm'] > 1e-4, not info['converged'], info['stalled']
+
+# a reachable target converges
+rand = numpy.random.RandomState(3)
+a = (rand.random_sample((n,n)) - .5) * .6
+e, c = scipy.linalg.eigh(h+a+a.T)
+dm_ref = numpy.dot(c[:,:2], c[:,:2].T)
+v, info = fitdm.fit_solver_quiet(h, 2, 2, dm_ref, fitdm.IMP_BLK,
+                                 fitdm.IMP_BLK, fitdm.NO_CONSTRAINT,
+                                 method=fitdm.FIT_TRUST_REGION, with_info=True)
+print 'reachable target', info['converged'], not info['stalled'], \
+        info['norm_ddm'] < 1e-8
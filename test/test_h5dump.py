@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#
+# vasphf.write_h5dump / LazyDump round trip over the two layouts of the HDF5
+# dump: version 1 (contiguous, no format_version) and version 2 (chunked and
+# compressed, symmetric matrices as the lower triangle).  LazyDump.eri_rows
+# against the unpacked ERI, and a newer format_version is rejected.
+#
+
+import os, sys
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import tempfile
+import shutil
+import cStringIO
+import numpy
+import h5py
+from pyscf import ao2mo
+import vasphf
+from mock_vaspdump import mock_mol, hchain
+
+dic = mock_mol(hchain(10), range(5))
+# the matrices of SYM_KEYS are symmetric only up to round-off here
+for k in vasphf.SYM_KEYS:
+    dic[k] = (dic[k] + dic[k].T) * .5
+nemb = dic['NEMB']
+npair = nemb*(nemb+1)//2
+eri_pair = ao2mo.restore(4, dic['ERI'], nemb)
+tdir = tempfile.mkdtemp()
+
+def same(dump):
+    ok = sorted(dump.keys()) == sorted(dic.keys())
+    for k in dic:
+        ok = ok and numpy.array_equal(numpy.asarray(dump[k]),
+                                      numpy.asarray(dic[k]))
+    return ok
+
+def same_rows(dump):
+    ok = True
+    for p0, p1 in ((0, npair), (0, 1), (3, 17), (17, npair), (npair-1, npair)):
+        ok = ok and numpy.array_equal(dump.eri_rows(p0, p1),
+                                      eri_pair[p0:p1,:p1])
+    return ok
+
+def write_v1(h5dump, dic):
+    with h5py.File(h5dump, 'w') as f:
+        for k, v in dic.items():
+            f[k] = v
+
+# version 1
+h5v1 = os.path.join(tdir, 'v1.h5')
+write_v1(h5v1, dic)
+dump = vasphf.load_h5dump(h5v1)
+# the contiguous ERI is mapped, not read
+print 'v1 rows', dump.version == 1, same_rows(dump), \
+        isinstance(dump['ERI'], numpy.memmap)
+print 'v1', same(dump)
+
+# version 2, small chunks so that eri_rows spans several of them
+vasphf.ERI_CHUNK, vasphf.H5DUMP_MIN_CHUNKED = 100, 16
+h5v2 = os.path.join(tdir, 'v2.h5')
+stdout, sys.stdout = sys.stdout, cStringIO.StringIO()
+vasphf.write_h5dump(h5v2, dic)
+sys.stdout = stdout
+with h5py.File(h5v2, 'r') as f:
+    schema = dict([x.split(':') for x in f.attrs['schema'].split()])
+    print 'v2 layout', f['ERI'].chunks == (100,), \
+            f['ERI'].compression == vasphf.H5DUMP_COMPRESSION, \
+            schema['ERI'] == 's8', schema['H1EMB'] == 'tril', \
+            schema['MO_COEFF'] == 'dense', \
+            f['J'].shape == (dic['NORB']*(dic['NORB']+1)//2,)
+dump = vasphf.load_h5dump(h5v2)
+# only the chunks of the rows are read
+print 'v2 rows', dump.version == 2, same_rows(dump), not dump.loaded('ERI')
+print 'v2', same(dump)
+# a non-symmetric matrix of SYM_KEYS is stored dense
+dic1 = dict(dic)
+dic1['CORRPOT'] = dic['CORRPOT'] + numpy.tril(numpy.ones((nemb,nemb)), -1)
+stdout, sys.stdout = sys.stdout, cStringIO.StringIO()
+vasphf.write_h5dump(h5v2, dic1)
+sys.stdout = stdout
+with h5py.File(h5v2, 'r') as f:
+    print 'non-symmetric', f['CORRPOT'].attrs['packing'] == 'dense', \
+            numpy.array_equal(vasphf.load_h5dump(h5v2)['CORRPOT'],
+                              dic1['CORRPOT'])
+vasphf.ERI_CHUNK, vasphf.H5DUMP_MIN_CHUNKED = 1<<17, 1<<12
+
+# a dump of a newer format is not read, and is not a valid sidecar
+stamps = vasphf.dump_stamps(tdir)
+stdout, sys.stdout = sys.stdout, cStringIO.StringIO()
+vasphf.write_h5dump(h5v2, dic, stamps)
+sys.stdout = stdout
+print 'sidecar', vasphf.h5dump_valid(tdir, h5v2)
+with h5py.File(h5v2, 'a') as f:
+    f.attrs['format_version'] = vasphf.H5DUMP_VERSION + 1
+try:
+    vasphf.load_h5dump(h5v2)
+    print 'newer format_version read'
+except ValueError:
+    print 'newer format_version', not vasphf.h5dump_valid(tdir, h5v2)
+
+shutil.rmtree(tdir)
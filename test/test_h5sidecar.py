@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+# The HDF5 sidecar FCIDUMP.CLUST.GTO.h5 of vasphf: reused while the dumps are
+# unchanged (also after a touch or a copy of the directory), rebuilt when a
+# dump is rewritten or a missing dump appears.  vasphf.main on several
+# directories.
+#
+
+import os, sys
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import time
+import tempfile
+import shutil
+import cStringIO
+import numpy
+import vasphf
+from mock_vaspdump import mock_hubbard, write_vaspdump
+from bench_hfdump import write_dump
+
+def quiet(fn, *args, **kwargs):
+    stdout, sys.stdout = sys.stdout, cStringIO.StringIO()
+    try:
+        return fn(*args, **kwargs), sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+def sidecar(path):
+    return os.path.join(path, 'FCIDUMP.CLUST.GTO.h5')
+
+tdir = tempfile.mkdtemp()
+path = os.path.join(tdir, 'a')
+os.mkdir(path)
+dic = mock_hubbard(12, range(2))
+write_vaspdump(path, dic, 'text')
+
+dump, out = quiet(vasphf.read_vaspdump, path)
+print 'built', 'h5dump ERI' in out, vasphf.h5dump_valid(path, sidecar(path))
+dump, out = quiet(vasphf.read_vaspdump, path)
+print 'reused', out.startswith('Load'), \
+        not quiet(vasphf.convert_clustdump, path)[0], \
+        numpy.array_equal(dump['ERI'], dic['ERI'])
+
+# touch: new mtime, same content
+jdump = os.path.join(path, 'JDUMP')
+t = os.path.getmtime(jdump) + 10
+os.utime(jdump, (t, t))
+print 'touched', vasphf.h5dump_valid(path, sidecar(path))
+
+# copy of the directory without the metadata: all mtimes change
+path1 = os.path.join(tdir, 'b')
+os.mkdir(path1)
+time.sleep(.01)
+for name in os.listdir(path):
+    shutil.copy(os.path.join(path, name), path1)
+print 'copied', vasphf.h5dump_valid(path1, sidecar(path1)), \
+        not quiet(vasphf.convert_clustdump, path1)[0]
+
+# rewritten with the same size
+dat = open(jdump).read()
+p = dat.index('&END') + 8
+i = next(i for i in range(p, len(dat)) if dat[i] in '123456789')
+with open(jdump, 'w') as f:
+    f.write(dat[:i] + str(int(dat[i]) % 9 + 1) + dat[i+1:])
+print 'rewritten', os.path.getsize(jdump) == len(dat), \
+        not vasphf.h5dump_valid(path, sidecar(path))
+dump, out = quiet(vasphf.read_vaspdump, path)
+print 'rebuilt', 'h5dump ERI' in out, vasphf.h5dump_valid(path, sidecar(path))
+
+# CORRPOTDUMP was missing when the sidecar was built
+print 'no CORRPOTDUMP', not os.path.exists(os.path.join(path1, 'CORRPOTDUMP'))
+write_dump(os.path.join(path1, 'CORRPOTDUMP'),
+           numpy.zeros((dic['NORB'],dic['NORB'])), nelec=dic['NELEC'])
+print 'missing dump appears', not vasphf.h5dump_valid(path1, sidecar(path1))
+
+# main: b is rebuilt, a is up to date, c fails
+path2 = os.path.join(tdir, 'c')
+os.mkdir(path2)
+nfail, out = quiet(vasphf.main, ['-j', '2', path, path1, path2])
+print 'main', nfail == 1, '%s: up to date' % path in out, \
+        '%s: converted' % path1 in out, '%s: failed' % path2 in out, \
+        vasphf.h5dump_valid(path1, sidecar(path1))
+nfail, out = quiet(vasphf.main, ['-j', '1', '-f', path, path1])
+print 'main -f', nfail == 0, out.count('converted') == 2
+
+shutil.rmtree(tdir)
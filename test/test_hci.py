@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+#
+# impsolver.hbci against impsolver.fci on an embedding of H6/sto-3g (Lowdin
+# basis, the first 2 sites as the impurity): with select_cutoff=0 the
+# selected space is the full CI space, and max_det truncates it
+#
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import numpy
+from pyscf import gto
+from pyscf import scf
+from pyscf import ao2mo
+from pyscf import lo
+import impsolver
+import hci
+
+mol = gto.M(atom=[('H', (0, 0, i*1.4)) for i in range(6)], basis='sto-3g',
+            unit='B', verbose=0)
+mf = scf.RHF(mol)
+mf.kernel()
+c = lo.orth.lowdin(mf.get_ovlp())
+h1 = reduce(numpy.dot, (c.T, mf.get_hcore(), c))
+eri = ao2mo.restore(4, ao2mo.kernel(mol, c), 6)
+mo = numpy.linalg.solve(c, mf.mo_coeff)
+
+ref = impsolver.fci(mol, h1, eri, mo, 6, True, 2)
+res = impsolver.hbci(mol, h1, eri, mo, 6, True, 2, select_cutoff=0,
+                     conv_tol=1e-10)
+print 'select_cutoff=0 == FCI', abs(res[1]-ref[1]) < 1e-8, \
+        abs(res[3]-ref[3]).max() < 1e-6, abs(res[2]-ref[2]) < 1e-8
+
+# the HCI energy is variational, the truncated space gives a higher energy
+eri1 = ao2mo.incore.full(ao2mo.restore(8, eri, 6), mo)
+h1mo = reduce(numpy.dot, (mo.T, h1, mo))
+e, civec, stra, strb = hci.kernel(h1mo, eri1, 6, 6, select_cutoff=0,
+                                  max_det=40)
+print 'max_det', len(stra) <= 40, len(stra) == len(civec), \
+        e > ref[1] + 1e-6
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+#
+# dmet_sc.EmbSys.local_fit_approx on H8/sto-3g (Lowdin basis, four 2-site
+# fragments): fit_with_local_scf (FITTING_WITH_SCF) and fit_fixed_mf_dm
+# (FITTING_FCI_POT) against the default fit_without_local_scf
+#
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import numpy
+from pyscf import gto
+from pyscf import scf
+from pyscf import lo
+import dmet_sc
+
+mol = gto.M(atom=[('H', (0, 0, i*1.5)) for i in range(8)], basis='sto-3g',
+            unit='B', verbose=0, output='/dev/null')
+mf = scf.RHF(mol)
+mf.kernel()
+nimp = 2
+
+def embsys_for(approx):
+    embsys = dmet_sc.EmbSys(mol, mf, orth_coeff=lo.orth.lowdin(mf.get_ovlp()))
+    embsys.basidx_group = [[0,1], [2,3], [4,5], [6,7]]
+    embsys.verbose = 0
+    embsys.max_iter = 6
+    embsys.local_fit_approx = approx
+    return embsys
+
+def imp_ddm(embsys, emb):
+    dm_ref = embsys.solver.run(emb, emb._eri, emb.vfit_ci, True, False)[2]
+    dm = emb.make_rdm1(emb.mo_coeff_on_imp, emb.mo_occ)
+    return abs(dm_ref - dm)[:nimp,:nimp].max()
+
+e_tot = {}
+for approx in (dmet_sc.FITTING_WITHOUT_SCF, dmet_sc.FITTING_WITH_SCF,
+               dmet_sc.FITTING_FCI_POT):
+    e_tot[approx] = embsys_for(approx).scdmet()
+print 'scdmet', abs(e_tot[dmet_sc.FITTING_WITH_SCF] -
+                    e_tot[dmet_sc.FITTING_WITHOUT_SCF]) < 2e-2, \
+        abs(e_tot[dmet_sc.FITTING_FCI_POT] -
+            e_tot[dmet_sc.FITTING_WITHOUT_SCF]) < 2e-2
+
+# one local fitting with the embedding SCF: the impurity block of the
+# embedding HF DM matches the correlated one, the embedding is left unchanged
+embsys = embsys_for(dmet_sc.FITTING_WITH_SCF)
+embsys.init_embsys(mol)
+emb = embsys.embs[1]
+mo0 = emb.mo_coeff_on_imp.copy()
+ddm0 = imp_ddm(embsys, emb)
+v = dmet_sc.fit_with_local_scf(mol, emb, embsys)
+same_emb = abs(emb.mo_coeff_on_imp - mo0).max() == 0
+dmet_sc.embscf_(emb, v)
+print 'fit_with_local_scf', same_emb, imp_ddm(embsys, emb) < ddm0*1e-2
+
+# backwards: the potential of the correlated solver is fitted to the
+# impurity block of the embedding HF DM
+embsys = embsys_for(dmet_sc.FITTING_FCI_POT)
+embsys.init_embsys(mol)
+emb = embsys.embs[1]
+dm_mf = emb.make_rdm1(emb.mo_coeff_on_imp, emb.mo_occ)[:nimp,:nimp]
+v = dmet_sc.fit_fixed_mf_dm(mol, emb, embsys)
+dm_ci = embsys.solver.run(emb, emb._eri, v, True, False)[2][:nimp,:nimp]
+print 'fit_fixed_mf_dm', abs(dm_ci - dm_mf).max() < 1e-5
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#
+# molproitrf.MolproRunner and MolproPool with the stand-in fake_molpro.py
+#
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import time
+import shutil
+import tempfile
+import numpy
+from pyscf import gto, scf, ao2mo
+import impsolver
+import molproitrf
+
+exe = '%s %s' % (sys.executable,
+                 os.path.join(os.path.abspath(os.path.dirname(__file__)),
+                              'fake_molpro.py'))
+
+mol = gto.M(atom=[('H', (0, 0, 1.4*i)) for i in range(4)], basis='6-31g',
+            unit='b', verbose=0)
+mf = scf.RHF(mol)
+mf.scf()
+mo = mf.mo_coeff
+nmo = mo.shape[1]
+h1e = mf.get_hcore()
+eri = ao2mo.restore(8, mol.intor('cint2e_sph'), nmo)
+s = mol.intor_symmetric('cint1e_ovlp_sph')
+# orthogonal basis for the fcidump
+c = numpy.linalg.cholesky(numpy.linalg.inv(s))
+h1e = reduce(numpy.dot, (c.T, h1e, c))
+eri = ao2mo.incore.full(eri, c)
+mo = numpy.linalg.solve(c, mo)
+inp = molproitrf.simple_inp('ccsd', nmo, 4, True)
+ehf = impsolver.simple_hf(h1e, eri, mo, 4)[0]
+# the scratch and the failed jobs of all runners go here
+base = tempfile.mkdtemp()
+
+# results
+os.environ['FAKE_MOLPRO_SLEEP'] = '1'
+runner = molproitrf.MolproRunner(2, exe=exe, tmpdir=base)
+t0 = time.time()
+runner.run(h1e, eri, mo, 4, inp)
+t1job = time.time() - t0
+t0 = time.time()
+jids = [runner.submit(h1e+numpy.eye(nmo)*.1*i, eri, mo, 4, inp)
+        for i in range(4)]
+res = runner.gather(jids)
+t1 = time.time()
+for i, (escf, eci, rdm1) in enumerate(res):
+    print 'job %d' % i, escf - ehf - .1*i*4, abs(rdm1.trace() - 4) < 1e-8
+print '1 job %.1f s, 4 jobs on 2 slots %.1f s' % (t1job, t1-t0), \
+        t1-t0 < t1job * 3
+print 'scratch reused', sorted(os.listdir(runner.basedir)) == ['slot0', 'slot1']
+runner.close()
+
+# errors
+for fail in ('fehler', 'exit', 'output'):
+    os.environ['FAKE_MOLPRO_FAIL'] = fail
+    runner = molproitrf.MolproRunner(1, exe=exe, tmpdir=base)
+    try:
+        runner.run(h1e, eri, mo, 4, inp)
+        print fail, 'not detected'
+    except molproitrf.MolproError as err:
+        print fail, err.reason == fail, os.path.isdir(err.tdir)
+    runner.close()
+os.environ['FAKE_MOLPRO_FAIL'] = ''
+
+os.environ['FAKE_MOLPRO_SLEEP'] = '30'
+runner = molproitrf.MolproRunner(1, timeout=1, exe=exe, tmpdir=base)
+t0 = time.time()
+try:
+    runner.run(h1e, eri, mo, 4, inp)
+except molproitrf.MolproError as err:
+    print 'timeout', err.reason == 'timeout', time.time()-t0 < 5
+runner.close()
+
+# MolproPool against the serial solver, on two "fragments"
+class Emb(object):
+    def __init__(self, h1e):
+        self.h1e = h1e
+        self._eri = eri
+        self.mo_coeff_on_imp = mo
+        self.nelectron = 4
+        self.mol = mol
+    def get_hcore(self):
+        return self.h1e.copy()
+embs = [Emb(h1e), Emb(h1e+numpy.diag(numpy.arange(nmo)*.05))]
+serial_runner = molproitrf.MolproRunner(1, exe=exe, tmpdir=base)
+solver = molproitrf.CCSD()
+solver.solver = molproitrf.simple_call('ccsd', runner=serial_runner)
+os.environ['FAKE_MOLPRO_SLEEP'] = '1'
+t0 = time.time()
+ref = [solver.run(emb, emb._eri, with_1pdm=True) for emb in embs]
+t_serial = time.time() - t0
+pool = molproitrf.MolproPool(solver, 2, exe=exe, tmpdir=base)
+t0 = time.time()
+tids = []
+for m, emb in enumerate(embs):
+    pool.load(m, emb)
+    tids.append(pool.submit(m, with_1pdm=True))
+res = pool.gather(tids)
+print 'pool == serial', all([abs(r[0]-x[0]) < 1e-9 and
+                             abs(r[2]-x[2]).max() < 1e-9
+                             for r, x in zip(res, ref)]), \
+        time.time()-t0 < t_serial*.8
+os.environ['FAKE_MOLPRO_SLEEP'] = '0'
+# the electrons on the first two orbitals at the potential .05
+nimp = 2
+def nelec_imp(v, emb):
+    dm = solver.run(emb, emb._eri, numpy.eye(nimp)*v, True, False)[2]
+    return dm[:nimp].trace()
+nelec_frag = [nelec_imp(.05, emb) for emb in embs]
+tids = [pool.submit_chemical_potential(m, numpy.zeros((nimp,nimp)), nimp,
+                                       nelec_frag[m])
+        for m in range(len(embs))]
+print 'chemical potential', numpy.allclose(pool.gather(tids), .05)
+pool.close()
+serial_runner.close()
+shutil.rmtree(base)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#
+# solvercache.ResultCache: hits for the integrals which agree to tol, misses
+# beyond tol, LRU eviction past max_size, repack of the HDF5 file, and the
+# statistics through ImpSolver.run
+#
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import time
+import tempfile
+import cStringIO
+import numpy
+from pyscf import ao2mo
+from pyscf import gto
+from pyscf.lib import logger
+import impsolver
+import solvercache
+
+n = 4
+rand = numpy.random.RandomState(7)
+h1e = rand.random_sample((n,n))
+h1e = h1e + h1e.T - numpy.eye(n) * 3
+eri = rand.random_sample((n,n,n,n)) * .1
+eri = eri + eri.transpose(1,0,2,3)
+eri = eri + eri.transpose(0,1,3,2)
+eri = eri + eri.transpose(2,3,0,1)
+eri = ao2mo.restore(8, eri, n)
+
+class Emb(object):
+    def __init__(self, h1e):
+        self.h = h1e
+        self._eri = eri
+        self.nelectron = n
+        self.mo_coeff_on_imp = numpy.eye(n)
+        self.mol = gto.M(verbose=0)
+    def get_hcore(self):
+        return self.h.copy()
+
+path = tempfile.mktemp(suffix='.h5')
+solver = impsolver.FCI()
+solver.cache = solvercache.ResultCache(path, tol=1e-10)
+ref = solver.run(Emb(h1e), eri, with_1pdm=True, with_e2frag=2)
+# a rerun whose integrals agree to much better than tol
+r = solver.run(Emb(h1e+1e-14), eri.copy(), with_1pdm=True, with_e2frag=2)
+s = solver.cache.stats()
+print 'within tol', s['hits'] == 1, s['misses'] == 1, \
+        abs(r[0]-ref[0]) < 1e-14, abs(r[2]-ref[2]).max() < 1e-14
+# beyond tol
+solver.run(Emb(h1e+1e-8), eri, with_1pdm=True, with_e2frag=2)
+solver.run(Emb(h1e), eri+1e-8, with_1pdm=True, with_e2frag=2)
+s = solver.cache.stats()
+print 'beyond tol', s['hits'] == 1, s['misses'] == 3, s['entries'] == 3
+# dm1 was not stored for a call without with_1pdm
+solver.run(Emb(h1e*1.1), eri, with_1pdm=False, with_e2frag=0)
+solver.run(Emb(h1e*1.1), eri, with_1pdm=True, with_e2frag=0)
+s = solver.cache.stats()
+print 'with_1pdm', s['misses'] == 5
+
+out = cStringIO.StringIO()
+solver.cache.dump_stats(logger.Logger(out, logger.INFO))
+print 'dump_stats', '1 hits, 5 misses' in out.getvalue()
+solver.cache.clear()
+
+# LRU: max_size holds two entries.  Entry 0 is used after entry 1, so entry 1
+# goes first
+dm1 = numpy.zeros((n,n))
+nbytes = dm1.nbytes + 24
+cache = solvercache.ResultCache(path, max_size=nbytes*2)
+keys = ['key%d' % i for i in range(3)]
+cache.store(keys[0], 0., 0., None, dm1)
+time.sleep(.01)
+cache.store(keys[1], 1., 1., None, dm1)
+time.sleep(.01)
+cache.load(keys[0])
+time.sleep(.01)
+cache.store(keys[2], 2., 2., None, dm1)
+print 'LRU', cache.load(keys[0]) is not None, cache.load(keys[1]) is None, \
+        cache.load(keys[2])[0] == 2., cache.stats()['evictions'] == 1
+# an entry larger than max_size is kept until the next one comes
+cache.store('big', 3., 3., None, numpy.zeros((n*4,n*4)))
+print 'oversized entry', cache.stats()['entries'] == 1, \
+        cache.load('big') is not None
+
+# repack: the space of the evicted entries is given back
+cache = solvercache.ResultCache(path, max_size=nbytes*2)
+solvercache.REPACK_FACTOR, solvercache.REPACK_MIN = 1, 0
+dm1 = numpy.zeros((64,64))
+cache.max_size = (dm1.nbytes + 24) * 2
+for i in range(20):
+    cache.store('key%d' % i, i, i, None, dm1)
+size = os.path.getsize(path)
+print 'repack', size < cache.max_size * 2 + 2**16, \
+        cache.stats()['entries'] == 2, cache.load('key19')[0] == 19, \
+        not os.path.exists(path+'.repack')
+solvercache.REPACK_FACTOR, solvercache.REPACK_MIN = 2, 2**20
+cache.clear()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+#
+# solverpool.SolverPool against ImpSolver.run: the same results, the
+# ImpSolver cache used by the pool, and an error (instead of a hang) when a
+# worker dies
+#
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import tempfile
+import numpy
+from pyscf import gto
+from pyscf import ao2mo
+import impsolver
+import solvercache
+import solverpool
+
+class Emb(object):
+    def __init__(self, n, seed):
+        rand = numpy.random.RandomState(seed)
+        h = rand.random_sample((n,n))
+        self.h = h + h.T - numpy.eye(n) * 3
+        eri = rand.random_sample((n,n,n,n)) * .1
+        eri = eri + eri.transpose(1,0,2,3)
+        eri = eri + eri.transpose(0,1,3,2)
+        eri = eri + eri.transpose(2,3,0,1)
+        self._eri = ao2mo.restore(8, eri, n)
+        self.nelectron = n
+        self.mo_coeff_on_imp = numpy.eye(n)
+        self.mol = gto.M(verbose=0)
+    def get_hcore(self):
+        return self.h.copy()
+
+embs = [Emb(4, 1), Emb(6, 2)]
+solver = impsolver.FCI()
+ref = [solver.run(emb, emb._eri, with_1pdm=True, with_e2frag=2)
+       for emb in embs]
+
+solver.cache = solvercache.ResultCache(tempfile.mktemp(suffix='.h5'))
+pool = solverpool.SolverPool(solver, nproc=2)
+for it in range(2):
+    tids = []
+    for m, emb in enumerate(embs):
+        pool.load(m, emb)
+        tids.append(pool.submit(m, with_1pdm=True, with_e2frag=2))
+    res = pool.gather(tids)
+    print 'pool == serial', all([abs(r[0]-x[0]) < 1e-10 and
+                                 abs(r[1]-x[1]) < 1e-10 and
+                                 abs(r[2]-x[2]).max() < 1e-10
+                                 for r, x in zip(res, ref)])
+s = solver.cache.stats()
+print 'cache', s['hits'] == 2, s['misses'] == 2
+# the cache entries written by the pool are read by ImpSolver.run
+r = solver.run(embs[1], embs[1]._eri, with_1pdm=True, with_e2frag=2)
+print 'cache from pool', solver.cache.stats()['hits'] == 3, \
+        abs(r[0]-ref[1][0]) < 1e-10, solver.escf is not None
+pool.close()
+solver.cache.clear()
+
+def dying_solver(mol, h1e, eri, mo, nelec, with_1pdm, with_e2frag):
+    os._exit(3)
+
+pool = solverpool.SolverPool(dying_solver, nproc=1)
+pool.load(0, embs[0])
+try:
+    pool.gather([pool.submit(0)])
+    print 'dead worker not detected'
+except RuntimeError as err:
+    print 'dead worker', 'exitcode 3' in str(err)
+pool.close()
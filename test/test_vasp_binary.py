@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#
+# Round trip of the binary CorrPot and dumps (vasphf.write_bindump), against
+# the text exchange, and the VASP pass 2 of vaspdmet_sc in binary mode with
+# the stand-in fake_vasp.py
+#
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import time
+import shutil
+import tempfile
+import numpy
+import vasphf
+import vaspimp
+import vasprunner
+import vaspdmet_sc
+from bench_hfdump import write_dump
+from mock_vaspdump import write_clustdump
+
+def gen_dumps(path, nemb, norb, seed=1):
+    '''The same random dumps as text and binary files'''
+    rand = numpy.random.RandomState(seed)
+    def sym(n):
+        a = rand.random_sample((n,n))
+        return a + a.T
+    npair = nemb*(nemb+1)//2
+    fock, vj, vk, corrpot = [sym(norb) for i in range(4)]
+    write_dump(os.path.join(path, 'FOCKDUMP'), fock, True)
+    write_dump(os.path.join(path, 'JDUMP'), vj)
+    write_dump(os.path.join(path, 'KDUMP'), vk)
+    write_dump(os.path.join(path, 'CORRPOTDUMP'), corrpot)
+    vasphf.write_bindump(os.path.join(path, 'FOCKDUMP.bin'),
+                         [('NORB', norb), ('NELEC', norb), ('MS2', 0),
+                          ('UHF', 0), ('FOCK', fock)])
+    vasphf.write_bindump(os.path.join(path, 'JDUMP.bin'), [('J', vj)])
+    vasphf.write_bindump(os.path.join(path, 'KDUMP.bin'), [('K', vk)])
+    vasphf.write_bindump(os.path.join(path, 'CORRPOTDUMP.bin'),
+                         [('CORRPOT', corrpot)])
+
+    orbind = range(nemb//2)
+    h1emb = sym(nemb)
+    mo = numpy.linalg.qr(rand.random_sample((norb,norb)))[0]
+    embasis = rand.random_sample((norb,nemb))
+    cp = sym(nemb)
+    eri = rand.random_sample(npair*(npair+1)//2)
+    write_clustdump(os.path.join(path, 'FCIDUMP.CLUST.GTO'), nemb, orbind,
+                    h1emb, mo, embasis, cp, eri)
+    vasphf.write_bindump(os.path.join(path, 'FCIDUMP.CLUST.GTO.bin'),
+                         [('NORB', nemb), ('NELECEMB', float(nemb)),
+                          ('NIMP', len(orbind)),
+                          ('ORBIND', numpy.array(orbind)+1),
+                          ('H1EMB', h1emb), ('MO_COEFF', mo),
+                          ('EMBASIS', embasis), ('CORRPOT', cp), ('ERI', eri)])
+
+def same_dic(a, b):
+    if sorted(a.keys()) != sorted(b.keys()):
+        return False
+    return all([numpy.array_equal(numpy.asarray(a[k]), numpy.asarray(b[k]))
+                for k in a])
+
+tdir = tempfile.mkdtemp()
+
+# records
+fname = os.path.join(tdir, 'x.bin')
+recs = [('A', numpy.arange(12.).reshape(3,4)), ('IDX', numpy.arange(5)),
+        ('N', 7), ('E', -1.25), ('EMPTY', numpy.zeros((0,3)))]
+vasphf.write_bindump(fname, recs)
+dic = vasphf.read_bindump(fname)
+print 'records', same_dic(dic, dict(recs)), type(dic['N']) is int, \
+        dic['IDX'].dtype == numpy.int64
+print 'little-endian', open(fname, 'rb').read(8) == vasphf.BIN_MAGIC, \
+        open(fname, 'rb').read()[28:32] == '\x02\x00\x00\x00'
+dat = open(fname, 'rb').read()
+open(fname, 'wb').write(dat[:-10])
+try:
+    vasphf.read_bindump(fname)
+    print 'truncated not detected'
+except ValueError:
+    print 'truncated', True
+open(fname, 'wb').write('FCIDUMP' + dat)
+try:
+    vasphf.read_bindump(fname)
+    print 'magic not checked'
+except ValueError:
+    print 'magic', True
+
+# CorrPot
+v = numpy.random.random((4,4)) - .5
+vasphf.write_corrpot(tdir, v, binary=True)
+vasphf.write_corrpot(tdir, v, binary=False)
+print 'CorrPot binary exact', numpy.array_equal(vasphf.read_corrpot(tdir, True), v)
+print 'CorrPot text', abs(vasphf.read_corrpot(tdir, False) - v).max() < 1e-15
+
+# dumps: the binary and text dumps give the same dictionary
+nemb, norb = 30, 300
+txtdir = os.path.join(tdir, 'text')
+bindir = os.path.join(tdir, 'binary')
+os.mkdir(txtdir)
+gen_dumps(tdir, nemb, norb)
+os.mkdir(bindir)
+for name in vasphf.TEXT_DUMP_FILES:
+    shutil.copy(os.path.join(tdir, name), txtdir)
+    shutil.copy(os.path.join(tdir, name+vasphf.BIN_SUFFIX), bindir)
+sys.stdout, stdout = open(os.devnull, 'w'), sys.stdout
+t0 = time.time()
+ref = vasphf.parse_vaspdump(txtdir, nproc=1)
+t1 = time.time()
+dic = vasphf.parse_vaspdump(bindir)
+t2 = time.time()
+sys.stdout = stdout
+print 'format', vasphf.dump_format(txtdir), vasphf.dump_format(bindir)
+print 'same dumps', same_dic(ref, dic)
+print 'text %.3f s, binary %.3f s' % (t1-t0, t2-t1)
+
+# the VASP pass 2 in binary mode gives the dump of the text mode
+path = os.path.join(tdir, 'run')
+os.mkdir(path)
+for name in vasphf.TEXT_DUMP_FILES:
+    shutil.copy(os.path.join(tdir, name), path)
+os.remove(os.path.join(tdir, 'CORRPOTDUMP'))
+os.remove(os.path.join(tdir, 'CORRPOTDUMP.bin'))
+exe = '%s %s %s' % (sys.executable,
+                    os.path.join(os.path.abspath(os.path.dirname(__file__)),
+                                 'fake_vasp.py'), tdir)
+vasprunner.READY_SETTLE = .2
+os.environ['FAKE_VASP_SLEEP'] = '0'
+sys.stdout = open(os.devnull, 'w')
+embsys = vaspdmet_sc.EmbSysPeriod(path)
+embsys.vasp_cmd_pass2 = exe
+embsys.verbose = 0
+embsys.embs = [vaspimp.OneImp(embsys.entire_scf)]
+nimp = len(embsys.embs[0].bas_on_frag)
+v = numpy.zeros((norb,norb))
+v[:nimp,:nimp] = numpy.random.random((nimp,nimp))
+res = {}
+for mode in ('text', 'binary'):
+    embsys.vasp_exchange = mode
+    res[mode] = dict(embsys.run_hf_with_ext_pot_(v)._vaspdump)
+sys.stdout = stdout
+# CorrPot in text loses the last digit, MO_ENERGY differs by rounding
+e_text = res['text'].pop('MO_ENERGY')
+e_bin = res['binary'].pop('MO_ENERGY')
+print 'pass 2 binary == text', same_dic(res['text'], res['binary']), \
+        abs(e_text - e_bin).max() < 1e-12
+print 'CORRPOTDUMP.bin', numpy.array_equal(
+        vasphf.read_bindump(os.path.join(path, 'CORRPOTDUMP.bin'))['CORRPOT']
+        [:nimp,:nimp], v[:nimp,:nimp])
+shutil.rmtree(tdir)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#
+# The dumps of mock_vaspdump.py: read back by vasphf in the three formats,
+# and consistent with vaspimp.OneImp and vaspdmet_nonsc.EmbSysPeriod
+#
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import shutil
+import tempfile
+import numpy
+from pyscf import gto
+import vasphf
+import vaspimp
+import vaspdmet_nonsc
+import impsolver
+import mock_vaspdump
+
+def check(name, dic, corrpot=None):
+    energy = []
+    for format in mock_vaspdump.FORMATS:
+        path = tempfile.mkdtemp()
+        sys.stdout, stdout = open(os.devnull, 'w'), sys.stdout
+        mock_vaspdump.write_vaspdump(path, dic, format, corrpot)
+        mol = gto.Mole()
+        mol.build(False, False)
+        mf = vasphf.RHF(mol, path)
+        emb = vaspimp.OneImp(mf)
+        emb.verbose = 0
+        emb.imp_scf()
+        embsys = vaspdmet_nonsc.EmbSysPeriod(path)
+        embsys.solver = impsolver.FCI()
+        embsys.verbose = embsys.emb_verbose = 0
+        energy.append(embsys.one_shot())
+        sys.stdout = stdout
+        err = max([abs(numpy.asarray(mf._vaspdump[k], dtype=float) -
+                       numpy.asarray(dic[k], dtype=float)).max() for k in dic])
+# the embedding HF reproduces the RHF density matrix on the embedding basis
+        c = numpy.dot(dic['EMBASIS'].T, dic['MO_COEFF'][:,:dic['NELEC']//2])
+        dm = emb.make_rdm1(emb.mo_coeff_on_imp, emb.mo_occ)
+        print name, format, err < 1e-12, \
+                abs(dm - numpy.dot(c, c.T)*2).max() < 1e-8
+        shutil.rmtree(path)
+    print name, 'one-shot', abs(numpy.array(energy) - energy[0]).max() < 1e-9
+
+numpy.random.seed(1)
+check('hubbard', mock_vaspdump.mock_hubbard(24, [0,1]))
+check('hchain', mock_vaspdump.mock_mol(mock_vaspdump.hchain(8), [0,1]))
+
+# with correlation potential
+v = numpy.zeros((24,24))
+v[:2,:2] = numpy.random.random((2,2)) * .1
+v = v + v.T
+dic = mock_vaspdump.mock_hubbard(24, [0,1], corrpot=v)
+path = tempfile.mkdtemp()
+mock_vaspdump.write_vaspdump(path, dic, 'text', v)
+sys.stdout, stdout = open(os.devnull, 'w'), sys.stdout
+res = vasphf.parse_vaspdump(path, nproc=1)
+sys.stdout = stdout
+print 'corrpot', abs(res['CORRPOT'] - dic['CORRPOT']).max() < 1e-12, \
+        abs(res['MO_ENERGY'] - dic['MO_ENERGY']).max() < 1e-12, \
+        abs(res['H1EMB'] - res['CORRPOT'] -
+            reduce(numpy.dot, (res['EMBASIS'].T, res['HCORE'],
+                               res['EMBASIS']))).max() < 1e-12
+shutil.rmtree(path)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+#
+# vasp.RestartStore, the restart tags of vasp.Vasp, and the restart of the
+# VASP pass 2 of vaspdmet_sc with the stand-in fake_vasp.py
+#
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import time
+import shutil
+import tempfile
+import numpy
+import vasp
+import vaspimp
+import vasprunner
+import vaspdmet_sc
+from bench_clustdump import write_clustdump
+from bench_hfdump import gen_dumps
+
+tdir = tempfile.mkdtemp()
+cwd = os.getcwd()
+os.chdir(tdir)
+
+store = vasp.RestartStore('store', keep=2)
+with open('POSCAR', 'w') as f:
+    f.write('fake POSCAR\n')
+sig = store.signature('.', ENCUT=400, NBANDS=8)
+print 'signature', sig == store.signature('.', ENCUT=400., NBANDS=8), \
+        sig != store.signature('.', ENCUT=500, NBANDS=8)
+print 'empty', store.restore('.', sig) == [], store.save('.', sig) is None
+for i in range(3):
+    with open('WAVECAR', 'w') as f:
+        f.write('wavecar %d\n' % i)
+    with open('CHGCAR', 'w') as f:
+        f.write('chgcar %d\n' % i)
+    store.save('.', sig)
+with open('WAVECAR', 'w') as f:
+    f.write('modified\n')
+print 'versions', store.versions() == [2, 3]
+print 'restore', sorted(store.restore('.', sig)) == ['CHGCAR', 'WAVECAR'], \
+        open('WAVECAR').read() == 'wavecar 2\n'
+print 'other setup', store.restore('.', store.signature('.', ENCUT=500)) == []
+
+calc = vasp.Vasp(store)
+print 'cold tags', calc.restart_tags() == {}
+print 'restored', calc.restore_restart(ENCUT=400, NBANDS=8), \
+        calc.restart_tags() == {'ISTART': 1, 'ICHARG': 0}
+calc.write_incar('SYSTEM = test', encut=400.)
+incar = open('INCAR').read()
+print 'write_incar', 'ISTART = 1' in incar, 'ICHARG = 0' in incar
+calc.write_incar('SYSTEM = test', icharg=2)
+print 'explicit tag kept', 'ICHARG = 2' in open('INCAR').read()
+print '_replace', vasp._replace('ENCUT=400\nALGO=S', {'ISTART': 1}, True) \
+        == 'ENCUT=400\nALGO=S\nISTART=1'
+os.chdir(cwd)
+shutil.rmtree(tdir)
+
+# the pass 2 restarts from the WAVECAR of the last macro iteration
+nemb, norb = 6, 12
+refdir = tempfile.mkdtemp()
+path = tempfile.mkdtemp()
+write_clustdump(os.path.join(refdir, 'FCIDUMP.CLUST.GTO'), nemb, norb)
+gen_dumps(refdir, norb)
+os.remove(os.path.join(refdir, 'CORRPOTDUMP'))
+for name in os.listdir(refdir):
+    shutil.copy(os.path.join(refdir, name), path)
+exe = '%s %s %s' % (sys.executable,
+                    os.path.join(os.path.abspath(os.path.dirname(__file__)),
+                                 'fake_vasp.py'), refdir)
+vasprunner.READY_SETTLE = .2
+os.environ['FAKE_VASP_SLEEP'] = '1'
+sys.stdout, stdout = open(os.devnull, 'w'), sys.stdout
+embsys = vaspdmet_sc.EmbSysPeriod(path)
+embsys.vasp_cmd_pass2 = exe
+embsys.vasp_restart = vasp.RestartStore(os.path.join(path, 'restart'))
+embsys.verbose = 0
+embsys.embs = [vaspimp.OneImp(embsys.entire_scf)]
+v = numpy.zeros((norb,norb))
+times = []
+for it in range(3):
+    t0 = time.time()
+    embsys.run_hf_with_ext_pot_(v)
+    times.append(time.time() - t0)
+    niter = open(os.path.join(path, 'vasp.stdout')).read().count('HF iter')
+    if it == 0:
+        # a crashed run leaves a broken WAVECAR, the store has the good one
+        with open(os.path.join(path, 'WAVECAR'), 'w') as f:
+            pass
+    times[-1] = (times[-1], niter)
+sys.stdout = stdout
+print 'HF iterations per macro iteration', [x[1] for x in times], \
+        [x[1] for x in times] == [10, 3, 3]
+print 'pass 2 time %s' % ', '.join(['%.2f s' % x[0] for x in times])
+print 'versions kept', embsys.vasp_restart.versions() == [2, 3]
+shutil.rmtree(refdir)
+shutil.rmtree(path)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+#
+# vasprunner.VaspJob and the VASP pass 2 of vaspdmet_sc with the stand-in
+# fake_vasp.py
+#
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import time
+import shutil
+import tempfile
+import numpy
+import vasphf
+import vaspimp
+import vasprunner
+import vaspdmet_sc
+from bench_clustdump import write_clustdump
+from bench_hfdump import gen_dumps
+
+nemb, norb = 6, 300
+refdir = tempfile.mkdtemp()
+path = tempfile.mkdtemp()
+write_clustdump(os.path.join(refdir, 'FCIDUMP.CLUST.GTO'), nemb, norb)
+gen_dumps(refdir, norb)
+os.remove(os.path.join(refdir, 'CORRPOTDUMP'))
+for name in os.listdir(refdir):
+    shutil.copy(os.path.join(refdir, name), path)
+
+exe = '%s %s %s' % (sys.executable,
+                    os.path.join(os.path.abspath(os.path.dirname(__file__)),
+                                 'fake_vasp.py'), refdir)
+vasprunner.READY_SETTLE = .5
+sys.stdout, stdout = open(os.devnull, 'w'), sys.stdout
+embsys = vaspdmet_sc.EmbSysPeriod(path)
+sys.stdout = stdout
+embsys.vasp_cmd_pass2 = exe
+embsys.verbose = 0
+embsys.embs = [vaspimp.OneImp(embsys.entire_scf)]
+nimp = len(embsys.embs[0].bas_on_frag)
+
+v = numpy.zeros((norb,norb))
+v[:nimp,:nimp] = numpy.random.random((nimp,nimp)) * .1
+v = v + v.T
+
+# blocking: wait for VASP, then read all dumps
+os.environ['FAKE_VASP_SLEEP'] = '2'
+t0 = time.time()
+job = embsys.start_vasp_pass2(v)
+job.wait()
+sys.stdout, stdout = open(os.devnull, 'w'), sys.stdout
+vasphf.convert_clustdump(path, force=True)
+ref = vasphf.read_vaspdump(path)
+sys.stdout = stdout
+t_block = time.time() - t0
+
+# the HF dumps are read during the CLUSTDUMP stage
+os.remove(os.path.join(path, 'WAVECAR'))
+t0 = time.time()
+sys.stdout, stdout = open(os.devnull, 'w'), sys.stdout
+mf = embsys.run_hf_with_ext_pot_(v)
+sys.stdout = stdout
+t_async = time.time() - t0
+same = sorted(ref.keys()) == sorted(mf._vaspdump.keys())
+for k in ref:
+    same = same and numpy.array_equal(numpy.asarray(ref[k]),
+                                      numpy.asarray(mf._vaspdump[k]))
+print 'same dumps', same
+corrpot = vasphf._read_matrix_dump((os.path.join(path, 'CORRPOTDUMP'),
+                                     norb, False))
+print 'CORRPOTDUMP', abs(corrpot - v).max() < 1e-14
+out = open(os.path.join(path, 'vasp.stdout')).read()
+print 'stdout captured', out.count('CLUSTDUMP iteration') == 5, \
+        'fake VASP' in open(os.path.join(path, 'vasp.stderr')).read()
+print 'blocking %.2f s, overlapped %.2f s' % (t_block, t_async)
+
+# CORRPOTDUMP written after the HF dumps: the one of the last pass is not
+# taken into MO_ENERGY
+os.environ['FAKE_VASP_SLEEP'] = '1'
+os.environ['FAKE_VASP_FAIL'] = 'latecorrpot'
+v1 = v * 2
+sys.stdout, stdout = open(os.devnull, 'w'), sys.stdout
+mf = embsys.run_hf_with_ext_pot_(v1)
+sys.stdout = stdout
+dic = vasphf.read_hfdump(*[os.path.join(path, x) for x in
+                           ('JDUMP', 'KDUMP', 'FOCKDUMP', 'CORRPOTDUMP')])
+print 'late CORRPOTDUMP', \
+        numpy.array_equal(mf._vaspdump['MO_ENERGY'], dic['MO_ENERGY']), \
+        abs(mf._vaspdump['MO_ENERGY'] - ref['MO_ENERGY']).max() > 1e-8
+
+# a dump which cannot be read early is read again after VASP finishes,
+# VASP is not killed
+os.environ['FAKE_VASP_SLEEP'] = '2'
+os.environ['FAKE_VASP_FAIL'] = 'halfdump'
+sys.stdout, stdout = open(os.devnull, 'w'), sys.stdout
+job = embsys.start_vasp_pass2(v)
+mf = embsys.finish_vasp_pass2(job)
+sys.stdout = stdout
+print 'half-written dump', job.proc.returncode == 0, \
+        numpy.array_equal(mf._vaspdump['J'], ref['J'])
+
+# a dump which is still bad when VASP finishes
+os.environ['FAKE_VASP_FAIL'] = 'baddump'
+sys.stdout, stdout = open(os.devnull, 'w'), sys.stdout
+job = embsys.start_vasp_pass2(v)
+try:
+    embsys.finish_vasp_pass2(job)
+    sys.stdout = stdout
+    print 'bad dump not detected'
+except ValueError:
+    sys.stdout = stdout
+    print 'bad dump', job.proc.returncode == 0
+os.environ['FAKE_VASP_FAIL'] = ''
+shutil.copy(os.path.join(refdir, 'JDUMP'), path)
+
+# a failed job is killed
+os.environ['FAKE_VASP_SLEEP'] = '1'
+os.environ['FAKE_VASP_FAIL'] = 'hang'
+embsys.vasp_timeout = 1
+sys.stdout, stdout = open(os.devnull, 'w'), sys.stdout
+job = embsys.start_vasp_pass2(v)
+try:
+    embsys.finish_vasp_pass2(job)
+    sys.stdout = stdout
+    print 'failed job not detected'
+except vasprunner.VaspError as err:
+    sys.stdout = stdout
+    print 'failed job, VASP killed', err.reason == 'timeout', \
+            job.proc.returncode == -9
+embsys.vasp_timeout = None
+os.environ['FAKE_VASP_FAIL'] = ''
+# output streamed while VASP runs
+os.environ['FAKE_VASP_SLEEP'] = '2'
+job = vasprunner.VaspJob(exe, path).start()
+time.sleep(1)
+print 'streamed', job.poll() == vasprunner.RUNNING, \
+        'HF iteration 1' in open(os.path.join(path, 'vasp.stdout')).read()
+job.wait()
+
+# errors
+os.environ['FAKE_VASP_SLEEP'] = '0'
+for fail in ('exit', 'nodump'):
+    os.environ['FAKE_VASP_FAIL'] = fail
+    os.remove(os.path.join(path, 'FCIDUMP.CLUST.GTO'))
+    try:
+        vasprunner.VaspJob(exe, path).start().wait()
+        print fail, 'not detected'
+    except vasprunner.VaspError as err:
+        print fail, err.reason == {'exit': 'exit', 'nodump': 'dump'}[fail], \
+                'fake VASP' in err.output
+    shutil.copy(os.path.join(refdir, 'FCIDUMP.CLUST.GTO'), path)
+
+# the dumps of the previous pass are not taken for the new ones
+os.environ['FAKE_VASP_FAIL'] = 'nodump'
+try:
+    vasprunner.VaspJob(exe, path).start().wait()
+    print 'old dump taken'
+except vasprunner.VaspError as err:
+    print 'old dump', err.reason == 'dump'
+
+os.environ['FAKE_VASP_FAIL'] = 'hang'
+t0 = time.time()
+try:
+    vasprunner.VaspJob(exe, path, timeout=1).start().wait()
+except vasprunner.VaspError as err:
+    print 'timeout', err.reason == 'timeout', time.time()-t0 < 5
+os.environ['FAKE_VASP_FAIL'] = ''
+
+shutil.rmtree(refdir)
+shutil.rmtree(path)
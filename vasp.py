@@ -9,6 +9,8 @@ https://wiki.fysik.dtu.dk/ase
 import os
 import sys
 import re
+import shutil
+import hashlib
 import numpy
 from pyscf import gto
 from pyscf import lib
@@ -217,6 +219,214 @@ keys = [
     # 'WEIMIN, EBREAK, DEPER    special control tags
 ]
 
+# The OUTCAR lines the read_* methods need: name -> (substring, test).  The
+# line is recorded when it contains substring and test(line) is true.
+OUTCAR_MARKERS = {
+    'version'       : (' vasp.', None),
+    'iteration'     : ('- Iteration', None),
+    'sigma'         : ('Fermi-smearing in eV        SIGMA', None),
+    'nelect'        : ('total number of electrons', None),
+    'stress'        : (' in kB  ', None),
+    'titel'         : ('TITEL', None),
+    'ldautype'      : ('LDAUTYPE', None),
+    'ldaul'         : ('LDAUL', None),
+    'ldauu'         : ('LDAUU', None),
+    'ldauj'         : ('LDAUJ', None),
+    'free_energy'   : ('  free  energy   TOTEN',
+                       lambda l: l.lower().startswith('  free  energy   toten')),
+    'energy_zero'   : ('  energy  without entropy',
+                       lambda l: l.startswith('  energy  without entropy')),
+    'forces'        : ('TOTAL-FORCE', None),
+    'fermi'         : ('E-fermi', None),
+    'dipole'        : ('dipolmoment', None),
+    'magnetization' : ('magnetization (x)', None),
+    'magmom'        : ('number of electron  ', None),
+    'nbands'        : ('NBANDS', lambda l: not l.startswith('|')),
+    'ediff'         : ('EDIFF  ', None),
+    'energy_change' : ('total energy-change', None),
+    'ibz_kpoints'   : ('Following cartesian coordinates', None),
+    'kpoint'        : (' k-point ', re.compile(' k-point *\d+ *:').search),
+    'spin_component': (' spin component ', None),
+    'relaxed'       : ('reached required accuracy', None),
+    'ispin'         : ('ISPIN', None),
+    'beef'          : ('BEEF xc energy contributions', None),
+}
+# bytes of OUTCAR scanned at once
+OUTCAR_BLOCK = 1<<24
+# eV/A^3
+GPA = 1/160.21766208
+
+class OutcarIndex(object):
+    '''Byte offsets of the OUTCAR lines listed in OUTCAR_MARKERS.  The file
+    is scanned once; update() scans only what VASP has appended since, and
+    starts again when the file has been replaced or truncated.'''
+    def __init__(self, filename='OUTCAR', markers=OUTCAR_MARKERS):
+        self.filename = filename
+        self.markers = markers
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self.entries = dict([(k, []) for k in self.markers])
+        self._ino = None
+        self._head = None
+
+    def _replaced(self, st):
+        if self._ino is None:
+            return False
+        if st.st_ino != self._ino or st.st_size < self.offset:
+            return True
+        with open(self.filename, 'rb') as f:
+            return f.read(len(self._head)) != self._head
+
+    def update(self):
+        st = os.stat(self.filename)
+        if self._replaced(st):
+            self.reset()
+        if st.st_size == self.offset:
+            return self
+        with open(self.filename, 'rb') as f:
+            if self._ino is None:
+                self._ino = st.st_ino
+                self._head = f.read(4096)
+            f.seek(self.offset)
+            while True:
+                buf = f.read(OUTCAR_BLOCK)
+                end = buf.rfind('\n') + 1
+                if end == 0:
+                    break
+                self._scan(buf[:end], self.offset)
+                self.offset += end
+                f.seek(self.offset)
+        return self
+
+    def _scan(self, buf, offset):
+        for name, (sub, test) in self.markers.items():
+            found = self.entries[name]
+            p = buf.find(sub)
+            while p >= 0:
+                p0 = buf.rfind('\n', 0, p) + 1
+                p1 = buf.find('\n', p) + 1
+                line = buf[p0:p1]
+                if test is None or test(line):
+                    found.append((offset+p0, line))
+                p = buf.find(sub, p1)
+
+    def lines(self, name):
+        return [line for offset, line in self.entries[name]]
+
+    def first(self, name):
+        if self.entries[name]:
+            return self.entries[name][0][1]
+
+    def last(self, name):
+        if self.entries[name]:
+            return self.entries[name][-1][1]
+
+    def merged(self, *names):
+        '''(name, line) of the lines of all names, in the order of the file'''
+        lst = [(offset, name, line) for name in names
+               for offset, line in self.entries[name]]
+        return [(name, line) for offset, name, line in sorted(lst)]
+
+    def read_lines(self, offset, n=None):
+        '''n lines from offset, the line at offset included.  Without n, the
+        lines up to the next blank line'''
+        lines = []
+        with open(self.filename, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if n is None and not line.strip():
+                    break
+                lines.append(line)
+                if n is not None and len(lines) == n:
+                    break
+        return lines
+
+
+# Files kept between the DMET macro iterations to restart VASP HF
+RESTART_FILES = ('WAVECAR', 'CHGCAR')
+# The restart files belong to the setup given by these inputs and INCAR tags
+RESTART_INPUTS = ('POSCAR', 'KPOINTS', 'POTCAR')
+RESTART_PARAMS = ('ENCUT', 'NBANDS', 'ISPIN')
+
+class RestartStore(object):
+    '''Versions of WAVECAR and CHGCAR.  save() copies them from a VASP run
+    directory to path/<version>, restore() copies the latest version of the
+    same setup back.  The keep latest versions are kept.'''
+    def __init__(self, path='vasp_restart', keep=2, files=RESTART_FILES):
+        self.path = path
+        self.keep = keep
+        self.files = files
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def versions(self):
+        return sorted([int(x) for x in os.listdir(self.path) if x.isdigit()])
+
+    def signature(self, rundir='.', **params):
+        h = hashlib.sha1()
+        for name in RESTART_INPUTS:
+            fname = os.path.join(rundir, name)
+            if os.path.isfile(fname):
+                with open(fname, 'rb') as f:
+                    h.update(name)
+                    h.update(f.read())
+        for key in RESTART_PARAMS:
+            if key in params:
+                h.update('%s=%g' % (key, float(params[key])))
+        return h.hexdigest()
+
+    def _signature_of(self, version):
+        with open(os.path.join(self.path, str(version), 'signature')) as f:
+            return f.read().strip()
+
+    def latest(self, signature=None):
+        '''The newest version of signature'''
+        for version in reversed(self.versions()):
+            if signature is None or self._signature_of(version) == signature:
+                return version
+
+    def save(self, rundir='.', signature=None):
+        '''Copy the restart files of rundir to a new version'''
+        if signature is None:
+            signature = self.signature(rundir)
+        names = [name for name in self.files
+                 if os.path.isfile(os.path.join(rundir, name))
+                 and os.path.getsize(os.path.join(rundir, name)) > 0]
+        if not names:
+            return None
+        version = (self.versions() or [0])[-1] + 1
+        tmp = os.path.join(self.path, 'tmp%d' % os.getpid())
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp)
+        os.mkdir(tmp)
+        for name in names:
+            shutil.copyfile(os.path.join(rundir, name), os.path.join(tmp, name))
+        with open(os.path.join(tmp, 'signature'), 'w') as f:
+            f.write('%s\n' % signature)
+        os.rename(tmp, os.path.join(self.path, str(version)))
+        for old in self.versions()[:-self.keep]:
+            shutil.rmtree(os.path.join(self.path, str(old)))
+        return version
+
+    def restore(self, rundir='.', signature=None):
+        '''Copy the files of the latest version of signature to rundir.
+        Return the names of the restored files.'''
+        version = self.latest(signature)
+        if version is None:
+            return []
+        vdir = os.path.join(self.path, str(version))
+        names = [name for name in self.files
+                 if os.path.isfile(os.path.join(vdir, name))]
+# copy, not link: VASP rewrites WAVECAR in place
+        for name in names:
+            dst = os.path.join(rundir, name)
+            shutil.copyfile(os.path.join(vdir, name), dst+'.restore')
+            os.rename(dst+'.restore', dst)
+        return names
+
+
 class Vasp:
     '''
 Insert NWChem basis format for Vasp.GaussBasis , e.g.
@@ -232,11 +442,45 @@ C    SP
       0.6834831              0.39951283             0.60768372
       0.2222899              0.70011547             0.39195739""" }
 '''
-    def __init__(self):
+    def __init__(self, restart=None):
         self.GaussBasis = {}
         self.INCAR = {}
         self.stdout = 'vasp.out'
         self.stderr = 'vasp.err'
+        self._outcar = None
+        # RestartStore for WAVECAR and CHGCAR
+        self.restart = restart
+        self._restored = []
+
+    def _restart_signature(self, kwargs):
+        return self.restart.signature('.', **kwargs)
+
+    def restore_restart(self, **kwargs):
+        '''Put the latest WAVECAR/CHGCAR of this setup (INCAR tags kwargs)
+        in the working directory.  Return whether a restart is available.'''
+        self._restored = []
+        if self.restart is not None:
+            self._restored = self.restart.restore(
+                    '.', self._restart_signature(kwargs))
+        return 'WAVECAR' in self._restored
+
+    def save_restart(self, **kwargs):
+        if self.restart is not None:
+            return self.restart.save('.', self._restart_signature(kwargs))
+
+    def restart_tags(self):
+        '''ISTART and ICHARG for the files put by restore_restart'''
+        if 'WAVECAR' in self._restored:
+            return {'ISTART': 1, 'ICHARG': 0}
+        elif 'CHGCAR' in self._restored:
+            return {'ISTART': 0, 'ICHARG': 1}
+        else:
+            return {}
+
+    def outcar_index(self, filename='OUTCAR'):
+        if self._outcar is None or self._outcar.filename != filename:
+            self._outcar = OutcarIndex(filename)
+        return self._outcar.update()
 
     def write_GaussBasis(self):
         if self.GaussBasis:
@@ -296,26 +540,19 @@ C    SP
                 pass
 
     def read_version(self):
-        version = None
-        for line in open('OUTCAR'):
-            if line.find(' vasp.') != -1: # find the first occurence
-                version = line[len(' vasp.'):].split()[0]
-                break
-        return version
+        line = self.outcar_index().first('version')
+        if line is not None:
+            return line[len(' vasp.'):].split()[0]
 
     def read_number_of_iterations(self):
-        niter = None
-        for line in open('OUTCAR'):
-            if line.find('- Iteration') != -1: # find the last iteration number
-                niter = int(line.split(')')[0].split('(')[-1].strip())
-        return niter
+        line = self.outcar_index().last('iteration')
+        if line is not None:
+            return int(line.split(')')[0].split('(')[-1].strip())
 
     def read_electronic_temperature(self):
-        sigma = None
-        for line in open('OUTCAR'):
-            if line.find('Fermi-smearing in eV        SIGMA') != -1:
-                sigma = float(line.split('=')[1].strip())
-        return sigma
+        line = self.outcar_index().last('sigma')
+        if line is not None:
+            return float(line.split('=')[1].strip())
 
     def read_default_number_of_electrons(self, filename='POTCAR'):
         nelect = []
@@ -328,20 +565,15 @@ C    SP
         return nelect
 
     def read_number_of_electrons(self):
-        nelect = None
-        for line in open('OUTCAR'):
-            if line.find('total number of electrons') != -1:
-                nelect = float(line.split('=')[1].split()[0].strip())
-        return nelect
+        line = self.outcar_index().last('nelect')
+        if line is not None:
+            return float(line.split('=')[1].split()[0].strip())
 
     def read_stress(self):
-        stress = None
-        for line in open('OUTCAR'):
-            if line.find(' in kB  ') != -1:
-                stress = -np.array([float(a) for a in line.split()[2:]]) \
-                         [[0, 1, 2, 4, 5, 3]] \
-                         * 1e-1 * ase.units.GPa
-        return stress
+        line = self.outcar_index().last('stress')
+        if line is not None:
+            return -numpy.array([float(a) for a in line.split()[2:]]) \
+                    [[0, 1, 2, 4, 5, 3]] * 1e-1 * GPA
 
     def read_ldau(self):
         ldau_luj = None
@@ -350,18 +582,20 @@ C    SP
         ldautype = None
         atomtypes = []
         # read ldau parameters from outcar
-        for line in open('OUTCAR'):
-            if line.find('TITEL') != -1:    # What atoms are present
+        index = self.outcar_index()
+        for name, line in index.merged('titel', 'ldautype', 'ldaul', 'ldauu',
+                                       'ldauj'):
+            if name == 'titel':     # What atoms are present
                 atomtypes.append(line.split()[3].split('_')[0].split('.')[0])
-            if line.find('LDAUTYPE') != -1: # Is this a DFT+U calculation
+            elif name == 'ldautype': # Is this a DFT+U calculation
                 ldautype = int(line.split('=')[-1])
                 ldau = True
                 ldau_luj = {}
-            if line.find('LDAUL') != -1:
+            elif name == 'ldaul':
                 L = line.split('=')[-1].split()
-            if line.find('LDAUU') != -1:
+            elif name == 'ldauu':
                 U = line.split('=')[-1].split()
-            if line.find('LDAUJ') != -1:
+            else:
                 J = line.split('=')[-1].split()
         # create dictionary
         if ldau:
@@ -389,6 +623,7 @@ ISYM=-1
         os.system('/bin/mv WAVECAR.GTO WAVECAR')
 
     def run_hf(self, **kwargs):
+        kwargs = dict(self.restart_tags().items() + kwargs.items())
         template = \
 '''PRECFOCK=N
 ICHARG=0
@@ -405,7 +640,7 @@ ALGO=S
 ISYM=-1
 '''
         with open('INCAR', 'w') as fout:
-            fout.write('%s\n' % _replace(template, kwargs))
+            fout.write('%s\n' % _replace(template, kwargs, True))
         self.run(settings.VASPMPI)
 #rotate to real
         template = \
@@ -425,6 +660,9 @@ ISYM=-1
             fout.write('%s\n' % _replace(template, kwargs))
         self.run(settings.VASPMPI)
         os.system('/bin/mv OUTCAR OUTCAR.HF')
+# the next run_hf restarts from the orbitals in the working directory
+        self.save_restart(**kwargs)
+        self._restored = ['WAVECAR']
 
     def run_jkdump(self, **kwargs):
         template = \
@@ -464,6 +702,8 @@ ISYM=-1
         self.run(settings.VASPEXE)
 
     def write_incar(self, incar_template, **kwargs):
+        for key, val in self.restart_tags().items():
+            kwargs.setdefault(key.lower(), val)
         incar = open('INCAR', 'w')
         incar.write('%s\n' % incar_template)
         for key, val in kwargs.items():
@@ -562,26 +802,20 @@ Gamma
                 file_tmp.close()
         potfile.close()
 
-    # Methods for reading information from OUTCAR files:
+    # Methods for reading information from OUTCAR files.  They are served by
+    # the OutcarIndex of OUTCAR, which is scanned only once.
     def read_energy(self, all=None):
-        [energy_free, energy_zero]=[0, 0]
+        index = self.outcar_index()
+        # Free energy
+        energy_free = [float(line.split()[-2])
+                       for line in index.lines('free_energy')]
+        # Extrapolated zero point energy
+        energy_zero = [float(line.split()[-1])
+                       for line in index.lines('energy_zero')]
         if all:
-            energy_free = []
-            energy_zero = []
-        for line in open('OUTCAR', 'r'):
-            # Free energy
-            if line.lower().startswith('  free  energy   toten'):
-                if all:
-                    energy_free.append(float(line.split()[-2]))
-                else:
-                    energy_free = float(line.split()[-2])
-            # Extrapolated zero point energy
-            if line.startswith('  energy  without entropy'):
-                if all:
-                    energy_zero.append(float(line.split()[-1]))
-                else:
-                    energy_zero = float(line.split()[-1])
-        return [energy_free, energy_zero]
+            return [energy_free, energy_zero]
+        else:
+            return [(energy_free or [0])[-1], (energy_zero or [0])[-1]]
 
     def read_forces(self, atoms, all=False):
         """Method that reads forces from OUTCAR file.
@@ -589,65 +823,51 @@ Gamma
         If 'all' is switched on, the forces for all ionic steps
         in the OUTCAR file be returned, in other case only the
         forces for the last ionic configuration is returned."""
-
-        file = open('OUTCAR','r')
-        lines = file.readlines()
-        file.close()
-        n=0
-        if all:
-            all_forces = []
-        for line in lines:
-            if line.rfind('TOTAL-FORCE') > -1:
-                forces=[]
-                for i in range(len(atoms)):
-                    forces.append(np.array([float(f) for f in lines[n+2+i].split()[3:6]]))
-                if all:
-                    all_forces.append(np.array(forces)[self.resort])
-            n+=1
+        index = self.outcar_index()
+        entries = index.entries['forces']
+        if not all:
+            entries = entries[-1:]
+        all_forces = []
+        for offset, line in entries:
+            lines = index.read_lines(offset, len(atoms)+2)[2:]
+            forces = numpy.array([[float(f) for f in l.split()[3:6]]
+                                  for l in lines])
+            all_forces.append(forces[self.resort])
         if all:
-            return np.array(all_forces)
+            return numpy.array(all_forces)
         else:
-            return np.array(forces)[self.resort]
+            return all_forces[0]
 
     def read_fermi(self):
         """Method that reads Fermi energy from OUTCAR file"""
-        E_f=None
-        for line in open('OUTCAR', 'r'):
-            if line.rfind('E-fermi') > -1:
-                E_f=float(line.split()[2])
-        return E_f
+        line = self.outcar_index().last('fermi')
+        if line is not None:
+            return float(line.split()[2])
 
     def read_dipole(self):
-        dipolemoment=np.zeros([1,3])
-        for line in open('OUTCAR', 'r'):
-            if line.rfind('dipolmoment') > -1:
-                dipolemoment=np.array([float(f) for f in line.split()[1:4]])
-        return dipolemoment
+        line = self.outcar_index().last('dipole')
+        if line is None:
+            return numpy.zeros([1,3])
+        else:
+            return numpy.array([float(f) for f in line.split()[1:4]])
 
     def read_magnetic_moments(self, atoms):
-        magnetic_moments = np.zeros(len(atoms))
-        n = 0
-        lines = open('OUTCAR', 'r').readlines()
-        for line in lines:
-            if line.rfind('magnetization (x)') > -1:
-                for m in range(len(atoms)):
-                    magnetic_moments[m] = float(lines[n + m + 4].split()[4])
-            n += 1
-        return np.array(magnetic_moments)[self.resort]
+        index = self.outcar_index()
+        magnetic_moments = numpy.zeros(len(atoms))
+        if index.entries['magnetization']:
+            offset = index.entries['magnetization'][-1][0]
+            lines = index.read_lines(offset, len(atoms)+4)[4:]
+            for m, line in enumerate(lines):
+                magnetic_moments[m] = float(line.split()[4])
+        return magnetic_moments[self.resort]
 
     def read_magnetic_moment(self):
-        n=0
-        for line in open('OUTCAR','r'):
-            if line.rfind('number of electron  ') > -1:
-                magnetic_moment=float(line.split()[-1])
-            n+=1
-        return magnetic_moment
+        return float(self.outcar_index().last('magmom').split()[-1])
 
     def read_nbands(self):
-        for line in open('OUTCAR', 'r'):
-            line = self.strip_warnings(line)
-            if line.rfind('NBANDS') > -1:
-                return int(line.split()[-1])
+        line = self.outcar_index().first('nbands')
+        if line is not None:
+            return int(line.split()[-1])
 
     def strip_warnings(self, line):
         """Returns empty string instead of line from warnings in OUTCAR."""
@@ -660,36 +880,29 @@ Gamma
         """Method that checks whether a calculation has converged."""
         converged = None
         # First check electronic convergence
-        for line in open('OUTCAR', 'r'):
-            if 0:  # vasp always prints that!
-                if line.rfind('aborting loop') > -1:  # scf failed
-                    raise RuntimeError(line.strip())
-                    break
-            if line.rfind('EDIFF  ') > -1:
+        index = self.outcar_index()
+        for name, line in index.merged('ediff', 'energy_change'):
+            if name == 'ediff':
                 ediff = float(line.split()[2])
-            if line.rfind('total energy-change')>-1:
-                # I saw this in an atomic oxygen calculation. it
-                # breaks this code, so I am checking for it here.
-                if 'MIXING' in line:
-                    continue
-                split = line.split(':')
-                a = float(split[1].split('(')[0])
-                b = split[1].split('(')[1][0:-2]
-                # sometimes this line looks like (second number wrong format!):
-                # energy-change (2. order) :-0.2141803E-08  ( 0.2737684-111)
-                # we are checking still the first number so
-                # let's "fix" the format for the second one
-                if 'e' not in b.lower():
-                    # replace last occurence of - (assumed exponent) with -e
-                    bsplit = b.split('-')
-                    bsplit[-1] = 'e' + bsplit[-1]
-                    b = '-'.join(bsplit).replace('-e','e-')
-                b = float(b)
-                if [abs(a), abs(b)] < [ediff, ediff]:
-                    converged = True
-                else:
-                    converged = False
-                    continue
+                continue
+            # I saw this in an atomic oxygen calculation. it
+            # breaks this code, so I am checking for it here.
+            if 'MIXING' in line:
+                continue
+            split = line.split(':')
+            a = float(split[1].split('(')[0])
+            b = split[1].split('(')[1][0:-2]
+            # sometimes this line looks like (second number wrong format!):
+            # energy-change (2. order) :-0.2141803E-08  ( 0.2737684-111)
+            # we are checking still the first number so
+            # let's "fix" the format for the second one
+            if 'e' not in b.lower():
+                # replace last occurence of - (assumed exponent) with -e
+                bsplit = b.split('-')
+                bsplit[-1] = 'e' + bsplit[-1]
+                b = '-'.join(bsplit).replace('-e','e-')
+            b = float(b)
+            converged = [abs(a), abs(b)] < [ediff, ediff]
         # Then if ibrion in [1,2,3] check whether ionic relaxation
         # condition been fulfilled
         if (self.int_params['ibrion'] in [1,2,3]
@@ -701,23 +914,15 @@ Gamma
         return converged
 
     def read_ibz_kpoints(self):
-        lines = open('OUTCAR', 'r').readlines()
+        index = self.outcar_index()
         ibz_kpts = []
-        n = 0
-        i = 0
-        for line in lines:
-            if line.rfind('Following cartesian coordinates')>-1:
-                m = n+2
-                while i==0:
-                    ibz_kpts.append([float(lines[m].split()[p]) for p in range(3)])
-                    m += 1
-                    if lines[m]==' \n':
-                        i = 1
-            if i == 1:
-                continue
-            n += 1
-        ibz_kpts = np.array(ibz_kpts)
-        return np.array(ibz_kpts)
+        if index.entries['ibz_kpoints']:
+            offset = index.entries['ibz_kpoints'][0][0]
+            lines = index.read_lines(offset, 3)
+            offset += len(lines[0]) + len(lines[1])
+            for line in index.read_lines(offset):
+                ibz_kpts.append([float(x) for x in line.split()[:3]])
+        return numpy.array(ibz_kpts)
 
     def read_k_point_weights(self):
         file = open('IBZKPT')
@@ -744,36 +949,29 @@ Gamma
         return np.array(eigs)
 
     def read_occupation_numbers(self, kpt=0, spin=0):
-        lines = open('OUTCAR').readlines()
+        index = self.outcar_index()
         nspins = self.get_number_of_spins()
+        pattern = re.compile(' k-point *'+str(kpt+1)+' *:')
+        kpts = [offset for offset, line in index.entries['kpoint']
+                if pattern.search(line)]
         start = 0
         if nspins == 1:
-            for n, line in enumerate(lines): # find it in the last iteration
-                m = re.search(' k-point *'+str(kpt+1)+' *:', line)
-                if m is not None:
-                    start = n
+            if kpts: # find it in the last iteration
+                start = kpts[-1]
         else:
-            for n, line in enumerate(lines):
-                if line.find(' spin component '+str(spin+1)) != -1: # find it in the last iteration
-                    start = n
-            for n2, line2 in enumerate(lines[start:]):
-                m = re.search(' k-point *'+str(kpt+1)+' *:', line2)
-                if m is not None:
-                    start = start + n2
-                    break
-        for n2, line2 in enumerate(lines[start+2:]):
-            if not line2.strip():
-                break
-        occ = []
-        for line in lines[start+2:start+2+n2]:
-            occ.append(float(line.split()[2]))
-        return np.array(occ)
+            for offset, line in index.entries['spin_component']:
+                if line.find(' spin component '+str(spin+1)) != -1:
+                    start = offset
+            kpts = [offset for offset in kpts if offset >= start]
+            if kpts:
+                start = kpts[0]
+        lines = index.read_lines(start, 2)
+        offset = start + sum([len(l) for l in lines])
+        occ = [float(line.split()[2]) for line in index.read_lines(offset)]
+        return numpy.array(occ)
 
     def read_relaxed(self):
-        for line in open('OUTCAR', 'r'):
-            if line.rfind('reached required accuracy') > -1:
-                return True
-        return False
+        return len(self.outcar_index().entries['relaxed']) > 0
 
 # The below functions are used to restart a calculation and are under early constructions
 
@@ -861,15 +1059,11 @@ Gamma
 
     def read_outcar(self):
         # Spin polarized calculation?
-        file = open('OUTCAR', 'r')
-        lines = file.readlines()
-        file.close()
-        for line in lines:
-            if line.rfind('ISPIN') > -1:
-                if int(line.split()[2])==2:
-                    self.spinpol = True
-                else:
-                    self.spinpol = None
+        for line in self.outcar_index().lines('ispin'):
+            if int(line.split()[2])==2:
+                self.spinpol = True
+            else:
+                self.spinpol = None
         self.energy_free, self.energy_zero = self.read_energy()
         self.forces = self.read_forces(self.atoms)
         self.dipole = self.read_dipole()
@@ -934,13 +1128,10 @@ Gamma
             written in OUTCAR file.
         """
         assert bee_type == 'beefvdw'
-        p = os.popen('grep -32 "BEEF xc energy contributions" OUTCAR | tail -32','r')
-        s = p.readlines()
-        p.close()
-        xc = np.array([])
-        for i, l in enumerate(s):
-            l_ = float(l.split(":")[-1])
-            xc = np.append(xc, l_)
+        index = self.outcar_index()
+        offset = index.entries['beef'][-1][0]
+        s = index.read_lines(offset, 33)[1:]
+        xc = numpy.array([float(l.split(":")[-1]) for l in s])
         assert len(xc) == 32
         return xc
 
@@ -959,13 +1150,21 @@ def _format_basis(bstr):
 def _count_nb(gaussbasis, poscar):
     pass
 
-def _replace(template, dic):
+def _replace(template, dic, add=False):
+    '''With add, the keys of dic which are not in template are appended'''
     dat = template.split()
     res = []
+    found = set()
     for line in dat:
         key = line.split('=')[0].strip()
         if key in dic:
             res.append('%s=%s' % (key, str(dic[key])))
+            found.add(key)
         else:
             res.append(line)
+    if add:
+        for key in sorted(dic):
+            if key not in found and key.lower() in \
+               float_keys + exp_keys + string_keys + int_keys + bool_keys:
+                res.append('%s=%s' % (key, str(dic[key])))
     return '\n'.join(res)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
-import subprocess
+import os
+import time
 import numpy
 import scipy
 import scipy.optimize
@@ -14,6 +15,7 @@ import impsolver
 import vaspimp
 import vasp
 import vasphf
+import vasprunner
 import dmet_sc
 from dmet_sc import *
 
@@ -22,6 +24,16 @@ from dmet_sc import *
 class EmbSysPeriod(dmet_sc.EmbSys):
     def __init__(self, path, init_v=None):
         self.vasp_inpfile_pass2 = ''
+        # default: bash vasp_inpfile_pass2, run in path
+        self.vasp_cmd_pass2 = None
+        self.vasp_timeout = None
+        # 'text' or 'binary' (vasphf.write_bindump) CorrPot and dumps.  The
+        # binary exchange needs a VASP build which supports it
+        self.vasp_exchange = 'text'
+        # vasp.RestartStore, to start the pass 2 from the WAVECAR and CHGCAR
+        # of the last macro iteration
+        self.vasp_restart = None
+        self.path = path
 
         mol = gto.Mole()
         mol.verbose = 5
@@ -105,18 +117,84 @@ class EmbSysPeriod(dmet_sc.EmbSys):
 
 
     def run_hf_with_ext_pot_(self, vext_on_ao, follow_state=False):
-        with open('CorrPot', 'w') as fcorrpot:
-            basidx = self.embs[0].bas_on_frag
-            vdump = vext_on_ao[basidx][:,basidx]
-            for v in vdump.flatten():
-                fcorrpot.write('%.16g\n' % v)
-        retcode = subprocess.call('bash %s' % self.vasp_inpfile_pass2, shell=True)
-        if not retcode:
-            mf = vasphf.RHF(self.mol, self.clustdump, self.jdump, self.kdump,
-                            self.fockdump)
-            return mf
+        job = self.start_vasp_pass2(vext_on_ao)
+        return self.finish_vasp_pass2(job)
+
+    def start_vasp_pass2(self, vext_on_ao):
+        '''Write CorrPot and start VASP in the background'''
+        basidx = self.embs[0].bas_on_frag
+        vdump = vext_on_ao[basidx][:,basidx]
+        vasphf.write_corrpot(self.path, vdump, self.vasp_exchange == 'binary')
+        if self.vasp_restart is not None:
+            restored = self.vasp_restart.restore(self.path,
+                                                 self._restart_signature())
+            log.debug(self, 'restart VASP from %s', restored)
+        cmd = self.vasp_cmd_pass2
+        if cmd is None:
+            cmd = 'bash %s' % os.path.abspath(self.vasp_inpfile_pass2)
+        log.debug(self, 'start VASP pass 2: %s', cmd)
+        dumps = [x+self._dump_suffix() for x in vasprunner.REQUIRED_DUMPS]
+        return vasprunner.VaspJob(cmd, self.path, self.vasp_timeout,
+                                  dumps).start()
+
+    def _dump_suffix(self):
+        if self.vasp_exchange == 'binary':
+            return vasphf.BIN_SUFFIX
         else:
-            raise OSError('Failed to execute %s' % self.vasp_inpfile_pass2)
+            return ''
+
+    def _restart_signature(self):
+        return self.vasp_restart.signature(self.path, ENCUT=self.pwcut,
+                                           NBANDS=self.nbands)
+
+    def finish_vasp_pass2(self, job):
+        '''Wait for job.  JDUMP, KDUMP, FOCKDUMP and CORRPOTDUMP are read as
+        soon as VASP has written them, while it goes on with
+        FCIDUMP.CLUST.GTO.  If the early read fails, the dumps are read again
+        after VASP finishes.  VASP is killed if the job fails'''
+        suffix = self._dump_suffix()
+        hf_dumps = [x+suffix for x in vasprunner.HF_DUMPS]
+# CORRPOTDUMP goes into MO_ENERGY, the one of the last pass must not be taken
+        hf_dumps.append(vasprunner.CORRPOT_DUMP+suffix)
+        if self.vasp_exchange == 'binary':
+            read_hfdump = vasphf.read_hfdump_bin
+        else:
+            read_hfdump = vasphf.read_hfdump
+        hfdic = None
+        early_read = True
+        try:
+            while job.poll() == vasprunner.RUNNING:
+                if early_read and job.ready(hf_dumps):
+                    early_read = False
+                    t0 = time.time()
+                    stamps = job.stamps(hf_dumps)
+                    try:
+                        hfdic = read_hfdump(*[os.path.join(self.path, x)
+                                              for x in hf_dumps])
+                        log.debug(self, 'HF dumps read in %.3g s while VASP '
+                                  'runs', time.time()-t0)
+# e.g. a dump which is still being written.  It is not the failure of VASP
+                    except (IOError, ValueError) as err:
+                        log.warn(self, 'HF dumps cannot be read while VASP '
+                                 'runs (%s), they are read after VASP '
+                                 'finishes', err)
+                        hfdic = None
+                else:
+                    time.sleep(vasprunner.POLL_INTERVAL)
+        except Exception:
+            job.kill()
+            raise
+        log.debug(self, 'VASP pass 2 finished in %.3g s',
+                  time.time()-job.t0)
+        job.wait()
+        if self.vasp_restart is not None:
+            self.vasp_restart.save(self.path, self._restart_signature())
+        if hfdic is not None and job.stamps(hf_dumps) != stamps:
+            log.warn(self, 'HF dumps were rewritten after being read')
+            hfdic = None
+        vasphf.convert_clustdump(self.path, force=True, hfdic=hfdic)
+        return vasphf.RHF(self.mol, self.path)
+
 #    def run_hf_with_ext_pot_(self, vext_on_ao, follow_state=False):
 #        with open('CorrPot', 'w') as fcorrpot:
 #            for v in vext_on_ao.flatten():
@@ -132,11 +210,14 @@ class EmbSysPeriod(dmet_sc.EmbSys):
 #        #print numpy.linalg.norm(mf.mo_coeff), numpy.linalg.svd(mf.mo_coeff)[1]
 #        return mf
 
-def run_vasp_scf(nbands, pwcut, cutri):
-    vasp_scf = vasp.Vasp()
+def run_vasp_scf(nbands, pwcut, cutri, restart=None):
+    '''restart is a vasp.RestartStore.  When it has the WAVECAR of this
+    setup, VASP HF starts from it instead of the Gaussian guess'''
+    vasp_scf = vasp.Vasp(restart)
     vasp_scf.write_kpoints()
-    vasp_scf.run_wavecar(ENCUT=pwcut, NBANDS=nbands)
-    vasp_scf.run_hf(ENCUT=pwcut, NBANDS=nbands, ICHARGE=2, EDIFF=1e-6)
+    if not vasp_scf.restore_restart(ENCUT=pwcut, NBANDS=nbands):
+        vasp_scf.run_wavecar(ENCUT=pwcut, NBANDS=nbands)
+        vasp_scf.run_hf(ENCUT=pwcut, NBANDS=nbands, ICHARGE=2, EDIFF=1e-6)
     vasp_scf.run_hf(ENCUT=pwcut, NBANDS=nbands, EDIFF=1e-9)
     vasp_scf.run_jkdump(ENCUT=pwcut, ENCUTGW=cutri, NBANDS=nbands)
     vasp_scf.run_clustdump(ENCUT=pwcut, ENCUTGW=cutri, NBANDS=nbands)
@@ -144,6 +225,6 @@ def run_vasp_scf(nbands, pwcut, cutri):
 
 if __name__ == '__main__':
     run_vasp_scf(48, 400, 400)
-    embsys = EmbSysPeriod('FCIDUMP.CLUST.GTO', 'JDUMP', 'KDUMP', 'FOCKDUMP')
+    embsys = EmbSysPeriod('.')
     embsys.scdmet()
 
@@ -7,6 +7,10 @@
 
 import os, sys
 import re
+import struct
+import hashlib
+import collections
+import multiprocessing
 
 import numpy
 import scipy.linalg
@@ -16,6 +20,10 @@ from pyscf import scf
 from pyscf import lib
 from pyscf.lib import logger
 
+# bytes of a dump file parsed in one numpy call
+DUMP_CHUNK = 1<<24
+_BLANK_LINE = re.compile(r'\n[ \t\r]*(?=\n|$)')
+
 
 class RHF(scf.hf.RHF):
     ''' RHF from vasp FCIDUMP'''
@@ -78,38 +86,319 @@ class RHF(scf.hf.RHF):
             log.info('pop of  %d %10.5f', i, s)
 
 
-def read_vaspdump(path, h5dump=None):
+# The dumps (text, or binary with BIN_SUFFIX) are converted once to the HDF5
+# sidecar FCIDUMP.CLUST.GTO.h5.  The sidecar records the size, mtime and sha1
+# of every source file.  It is reused when no source has changed: same size,
+# and same mtime or (after a copy/touch) the same content.  Otherwise it is
+# rebuilt, in a temporary file which is renamed over the old one.
+TEXT_DUMP_FILES = ('FCIDUMP.CLUST.GTO', 'JDUMP', 'KDUMP', 'FOCKDUMP',
+                   'CORRPOTDUMP')
+BIN_SUFFIX = '.bin'
+DUMP_FILES = TEXT_DUMP_FILES + tuple([x+BIN_SUFFIX for x in TEXT_DUMP_FILES])
+
+def _sha1(fname):
+    h = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        dat = f.read(DUMP_CHUNK)
+        while dat:
+            h.update(dat)
+            dat = f.read(DUMP_CHUNK)
+    return h.hexdigest()
+
+def dump_stamps(path):
+    '''{name: 'size mtime sha1'} of the source dumps, 'missing' for the
+    files which do not exist'''
+    stamps = {}
+    for name in DUMP_FILES:
+        fname = os.path.join(path, name)
+        if os.path.isfile(fname):
+            st = os.stat(fname)
+            stamps[name] = '%d %r %s' % (st.st_size, st.st_mtime, _sha1(fname))
+        else:
+            stamps[name] = 'missing'
+    return stamps
+
+def _stamp_valid(fname, stamp):
+    if stamp == 'missing':
+        return not os.path.isfile(fname)
+    elif not os.path.isfile(fname):
+        return False
+    size, mtime, sha1 = stamp.split()
+    st = os.stat(fname)
+    if st.st_size != int(size):
+        return False
+    elif repr(st.st_mtime) == mtime:
+        return True
+    else:
+        return _sha1(fname) == sha1
+
+def h5dump_valid(path, h5dump):
+    '''Whether the sidecar h5dump is up to date with the dumps in path'''
+    if not h5py.is_hdf5(h5dump):
+        return False
+    with h5py.File(h5dump, 'r') as f:
+        if int(f.attrs.get('format_version', 1)) > H5DUMP_VERSION:
+            return False
+        stamps = dict([(k[7:], v) for k, v in f.attrs.items()
+                       if k.startswith('source:')])
+    if sorted(stamps.keys()) != sorted(DUMP_FILES):
+        return False
+    for name in DUMP_FILES:
+        if not _stamp_valid(os.path.join(path, name), stamps[name]):
+            return False
+    return True
+
+# Layout of the HDF5 dump.  Version 1 (no format_version attribute) stores
+# every array as a contiguous dataset.  Version 2 stores the arrays chunked
+# and compressed (shuffle + gzip, lossless), and the exactly symmetric
+# matrices SYM_KEYS as their lower triangle (packing attribute 'tril').  The
+# packing of every dataset is listed in the schema attribute of the file.
+H5DUMP_VERSION = 2
+H5DUMP_COMPRESSION = 'gzip'
+H5DUMP_LEVEL = 1
+# elements per chunk of the 8-fold ERI
+ERI_CHUNK = 1<<17
+# smaller arrays are stored contiguously
+H5DUMP_MIN_CHUNKED = 1<<12
+SYM_KEYS = ('H1EMB', 'CORRPOT', 'HCORE', 'J', 'K')
+
+# The big arrays of an HDF5 dump are not read when the dump is loaded.  They
+# are mapped (copy-on-write) from the file when the dataset is stored
+# contiguously, otherwise read from the file on the first access.  Either
+# way each of them is materialized at most once.
+LAZY_KEYS = ('ERI', 'MO_COEFF', 'EMBASIS')
+
+def _dataset_offset(v):
+    if v.chunks is not None or v.compression is not None or \
+       v.dtype.byteorder not in ('=', '<', '|') or v.dtype.hasobject:
+        return None
+    return v.id.get_offset()
+
+def h5dump_version(h5dump):
+    with h5py.File(h5dump, 'r') as f:
+        return int(f.attrs.get('format_version', 1))
+
+class LazyDump(collections.Mapping):
+    '''The dictionary of an HDF5 dump.  LAZY_KEYS are loaded on demand'''
+    def __init__(self, h5dump):
+        self.path = h5dump
+        self._data = {}
+        self._lazy = {}
+        with h5py.File(h5dump, 'r') as f:
+            self.version = int(f.attrs.get('format_version', 1))
+            if self.version > H5DUMP_VERSION:
+                raise ValueError('%s: format version %d is newer than %d' %
+                                 (h5dump, self.version, H5DUMP_VERSION))
+            for k,v in f.items():
+                packing = v.attrs.get('packing', 'dense')
+                if k in LAZY_KEYS and v.shape:
+                    self._lazy[k] = (_dataset_offset(v), v.shape, v.dtype)
+                elif packing == 'tril':
+                    self._data[k] = lib.unpack_tril(v[()])
+                elif v.shape: # I'm ndarray
+                    self._data[k] = numpy.array(v)
+                else:
+                    self._data[k] = v[()]
+
+    def __getitem__(self, key):
+        if key not in self._data and key in self._lazy:
+            self._data[key] = self.materialize(key)
+        return self._data[key]
+
+    def __setitem__(self, key, val):
+        self._lazy.pop(key, None)
+        self._data[key] = val
+
+    def __iter__(self):
+        return iter(set(self._data.keys()).union(self._lazy.keys()))
+
+    def __len__(self):
+        return len(set(self._data.keys()).union(self._lazy.keys()))
+
+    def loaded(self, key):
+        return key in self._data
+
+    def materialize(self, key):
+        offset, shape, dtype = self._lazy[key]
+        if offset is not None and numpy.prod(shape) > 0:
+            return numpy.memmap(self.path, dtype=dtype, mode='c',
+                                offset=offset, shape=shape)
+        else:
+            with h5py.File(self.path, 'r') as f:
+                return f[key][()]
+
+    def eri_rows(self, p0, p1):
+        '''(ij|kl) for the pairs p0 <= ij < p1 and kl < p1.  Only the rows
+        p0:p1 of the 8-fold ERI are read; for the compressed layout, only
+        the chunks which hold them.'''
+        i0 = p0*(p0+1)//2
+        i1 = p1*(p1+1)//2
+        if self.loaded('ERI') or self._lazy['ERI'][0] is not None:
+            buf = numpy.asarray(self['ERI'][i0:i1])
+        else:
+            with h5py.File(self.path, 'r') as f:
+                buf = f['ERI'][i0:i1]
+        ij = numpy.repeat(numpy.arange(p0, p1), numpy.arange(p0+1, p1+1))
+        kl = numpy.arange(i1-i0) + i0 - ij*(ij+1)//2
+        out = numpy.empty((p1-p0,p1))
+        out[ij-p0,kl] = buf
+        mask = kl >= p0
+        out[kl[mask]-p0,ij[mask]] = buf[mask]
+        return out
+
+def load_h5dump(h5dump):
+    return LazyDump(h5dump)
+
+def _write_array(f, k, v):
+    v = numpy.asarray(v)
+    packing = 'dense'
+    if k in SYM_KEYS and v.ndim == 2 and v.shape[0] == v.shape[1] and \
+       numpy.array_equal(v, v.T):
+        v = lib.pack_tril(numpy.asarray(v, dtype=float, order='C'))
+        packing = 'tril'
+    elif k == 'ERI':
+        packing = 's8'
+    if v.ndim == 0 or v.size < H5DUMP_MIN_CHUNKED:
+        f[k] = v
+    else:
+        if k == 'ERI' and v.ndim == 1:
+            chunks = (min(v.size, ERI_CHUNK),)
+        else:
+            chunks = True
+        f.create_dataset(k, data=v, chunks=chunks, shuffle=True,
+                         compression=H5DUMP_COMPRESSION,
+                         compression_opts=H5DUMP_LEVEL)
+    f[k].attrs['packing'] = packing
+    return packing
+
+def write_h5dump(h5dump, dic, stamps=None):
+    tmpname = '%s.tmp%d' % (h5dump, os.getpid())
+    f = h5py.File(tmpname, 'w')
+    schema = []
+    for k,v in sorted(dic.items()):
+        sys.stdout.write('h5dump %s\n' % k)
+        schema.append('%s:%s' % (k, _write_array(f, k, v)))
+    f.attrs['format_version'] = H5DUMP_VERSION
+    f.attrs['schema'] = ' '.join(schema)
+    if stamps is not None:
+        for k, v in stamps.items():
+            f.attrs['source:'+k] = v
+    f.close()
+    os.rename(tmpname, h5dump)
+
+def dump_format(path):
+    '''binary if VASP has written FCIDUMP.CLUST.GTO.bin (and no newer text
+    FCIDUMP.CLUST.GTO), otherwise text'''
+    binfile = os.path.join(path, 'FCIDUMP.CLUST.GTO'+BIN_SUFFIX)
+    txtfile = os.path.join(path, 'FCIDUMP.CLUST.GTO')
+    if os.path.isfile(binfile) and \
+       (not os.path.isfile(txtfile) or
+        os.path.getmtime(binfile) >= os.path.getmtime(txtfile)):
+        return 'binary'
+    else:
+        return 'text'
+
+def parse_vaspdump(path, nproc=None, hfdic=None):
+    '''hfdic is the result of read_hfdump if it has been read already'''
 #NOTE read_hfdump returns the integrals in MO representation
-    clustdump = os.path.join(path, 'FCIDUMP.CLUST.GTO')
-    jdump     = os.path.join(path, 'JDUMP')
-    kdump     = os.path.join(path, 'KDUMP')
-    fockdump  = os.path.join(path, 'FOCKDUMP')
-    if h5py.is_hdf5(clustdump):
-        f = h5py.File(clustdump, 'r')
-        dic = {}
-        for k,v in f.items():
-            if v.shape: # I'm ndarray
-                dic[k] = numpy.array(v)
-            else:
-                dic[k] = v.value
-        f.close()
+    if dump_format(path) == 'binary':
+        suffix = BIN_SUFFIX
+        read_hf, read_clust = read_hfdump_bin, read_clustdump_bin
     else:
-        hfdic = read_hfdump(jdump, kdump, fockdump)
-        dic = read_clustdump(clustdump, hfdic)
-        mo_coeff = dic['MO_COEFF']
-        hfdic['HCORE'] = reduce(numpy.dot, (mo_coeff, hfdic['HCORE'], mo_coeff.T))
-        hfdic['J'] = reduce(numpy.dot, (mo_coeff, hfdic['J'], mo_coeff.T))
-        hfdic['K'] = reduce(numpy.dot, (mo_coeff, hfdic['K'], mo_coeff.T))
-        dic.update(hfdic)
-        if h5dump is None:
-            h5dump = clustdump+'.h5'
-        f = h5py.File(h5dump, 'w')
-        for k,v in dic.items():
-            sys.stdout.write('h5dump %s\n' % k)
-            f[k] = v
-        f.close()
+        suffix = ''
+        read_hf, read_clust = read_hfdump, read_clustdump
+    clustdump = os.path.join(path, 'FCIDUMP.CLUST.GTO'+suffix)
+    if hfdic is None:
+        jdump     = os.path.join(path, 'JDUMP'+suffix)
+        kdump     = os.path.join(path, 'KDUMP'+suffix)
+        fockdump  = os.path.join(path, 'FOCKDUMP'+suffix)
+        hfdic = read_hf(jdump, kdump, fockdump, nproc=nproc)
+    hfdic = hfdic.copy()
+    dic = read_clust(clustdump, hfdic)
+    mo_coeff = dic['MO_COEFF']
+    hfdic['HCORE'] = reduce(numpy.dot, (mo_coeff, hfdic['HCORE'], mo_coeff.T))
+    hfdic['J'] = reduce(numpy.dot, (mo_coeff, hfdic['J'], mo_coeff.T))
+    hfdic['K'] = reduce(numpy.dot, (mo_coeff, hfdic['K'], mo_coeff.T))
+    dic.update(hfdic)
     return dic
 
+def read_vaspdump(path, h5dump=None):
+    clustdump = os.path.join(path, 'FCIDUMP.CLUST.GTO')
+    if h5py.is_hdf5(clustdump):
+        return load_h5dump(clustdump)
+
+    if h5dump is None:
+        h5dump = clustdump+'.h5'
+    if h5dump_valid(path, h5dump):
+        sys.stdout.write('Load %s\n' % h5dump)
+        return load_h5dump(h5dump)
+    # stamp the sources before parsing, so that a dump rewritten meanwhile
+    # makes the sidecar stale
+    stamps = dump_stamps(path)
+    write_h5dump(h5dump, parse_vaspdump(path), stamps)
+    # the parsed arrays are dropped; ERI etc. are then mapped from the sidecar
+    return load_h5dump(h5dump)
+
+def iter_records(finp, chunk=DUMP_CHUNK):
+    '''Yield (val, idx) of the "val i j k l" records which follow the header
+    of a dump, DUMP_CHUNK bytes at a time.  idx is the (n,4) int array of
+    the labels.  Like the line reader, the records end at the first blank
+    line'''
+    tail = ''
+    while True:
+        buf = finp.read(chunk)
+        if buf:
+            buf = tail + buf
+            p = buf.rfind('\n')
+            if p < 0:
+                tail = buf
+                continue
+            dat, tail = buf[:p], buf[p+1:]
+        elif tail:
+            dat, tail = tail, ''
+        else:
+            return
+        p = dat.find('\n')
+        if p < 0:
+            p = len(dat)
+        if not dat[:p].strip():
+            blank = 0
+        else:
+            blank = _BLANK_LINE.search(dat)
+            if blank is not None:
+                blank = blank.start()
+        if blank is not None:
+            dat = dat[:blank]
+        rec = numpy.fromstring(dat, sep=' ')
+        if rec.size % 5 != 0:
+            raise ValueError('malformed record in %s' % finp.name)
+        rec = rec.reshape(-1,5)
+        yield rec[:,0].copy(), rec[:,1:].astype(int)
+        if blank is not None:
+            return
+
+# a[i,j] = v record by record, i.e. the last record of a duplicated (i,j)
+# wins.  Negative labels are wrapped like the Python indexing does
+def _assign_flat(a, idx, val):
+    idx = numpy.where(idx < 0, idx + a.size, idx)
+    u, pos = numpy.unique(idx[::-1], return_index=True)
+    a.reshape(-1)[u] = val[::-1][pos]
+
+def _assign(a, i, j, val):
+    _assign_flat(a, numpy.ravel_multi_index((i, j), a.shape, mode='wrap'),
+                 val)
+
+# a[i,j] = a[j,i] = v record by record
+def _assign_sym(a, i, j, val):
+    ij = numpy.ravel_multi_index((i, j), a.shape, mode='wrap')
+    ji = numpy.ravel_multi_index((j, i), a.shape, mode='wrap')
+    _assign_flat(a, numpy.vstack((ij,ji)).T.ravel(), numpy.repeat(val, 2))
+
+# packed index of the 1-based labels i, j
+def _pair_index(i, j):
+    i, j = numpy.maximum(i, j), numpy.minimum(i, j)
+    return (i-1)*i//2 + j-1
+
 def read_clustdump(clustdump, hfdic):
 # ERIs on embedding basis
 # 1-electron Hamiltonian on embedding basis (include correlation potential,
@@ -155,35 +444,30 @@ def read_clustdump(clustdump, hfdic):
     mo_coeff = numpy.zeros((norb,norb))
     embasis = numpy.zeros((norb,nemb))
     eri = numpy.zeros((npair*(npair+1)/2))
-    dat = finp.readline().split()
     touched0 = touched1 = touched2 = 0
-    while dat:
-        i, j, k, l = map(int, dat[1:])
-        if l == 0:
-            h1emb[i-1,j-1] = h1emb[j-1,i-1] = float(dat[0])
+    for val, idx in iter_records(finp):
+        i, j, k, l = idx.T
+        mask = l == 0
+        if mask.any():
+            _assign_sym(h1emb, i[mask]-1, j[mask]-1, val[mask])
             touched0 = 1
-        elif l == -1:
-            mo_coeff[i-1,j-1] = float(dat[0])
+        mask = l == -1
+        if mask.any():
+            _assign(mo_coeff, i[mask]-1, j[mask]-1, val[mask])
             touched1 = 1
-        elif l == -2:
-            embasis[i-1,j-1] = float(dat[0])
+        mask = l == -2
+        if mask.any():
+            _assign(embasis, i[mask]-1, j[mask]-1, val[mask])
             touched2 = 1
-        elif l == -3:
-            corrpot[i-1,j-1] = corrpot[j-1,i-1] = float(dat[0])
-        else:
-            if i >= j:
-                ij = (i-1)*i/2 + j-1
-            else:
-                ij = (j-1)*j/2 + i-1
-            if k >= l:
-                kl = (k-1)*k/2 + l-1
-            else:
-                kl = (l-1)*l/2 + k-1
-            if ij >= kl:
-                eri[ij*(ij+1)/2+kl] = float(dat[0])
-            else:
-                eri[kl*(kl+1)/2+ij] = float(dat[0])
-        dat = finp.readline().split()
+        mask = l == -3
+        if mask.any():
+            _assign_sym(corrpot, i[mask]-1, j[mask]-1, val[mask])
+        mask = (l > 0) | (l < -3)
+        if mask.any():
+            ij = _pair_index(i[mask], j[mask])
+            kl = _pair_index(k[mask], l[mask])
+            _assign_flat(eri, _pair_index(ij+1, kl+1), val[mask])
+    finp.close()
     if not (touched0 and touched1 and touched2):
         raise RuntimeError("h1emb, embasis or mo_coeff are not generated")
     dic['ERI'] = eri
@@ -193,7 +477,24 @@ def read_clustdump(clustdump, hfdic):
     dic['CORRPOT'] = corrpot
     return dic
 
-def read_hfdump(jdump, kdump, fockdump):
+def _read_matrix_dump(args):
+# mat[i-1,j-1] = val for the records of JDUMP, KDUMP, FOCKDUMP or
+# CORRPOTDUMP.  With skip_diag, the "val i 0 0 0" records are skipped
+    fname, norb, skip_diag = args
+    mat = numpy.zeros((norb,norb))
+    with open(fname, 'r') as finp:
+        dat = finp.readline()
+        while dat and 'END' not in dat:
+            dat = finp.readline()
+        for val, idx in iter_records(finp):
+            i, j = idx[:,0], idx[:,1]
+            if skip_diag:
+                mask = j != 0
+                i, j, val = i[mask], j[mask], val[mask]
+            _assign(mat, i-1, j-1, val)
+    return mat
+
+def read_hfdump(jdump, kdump, fockdump, corrpotdump=None, nproc=None):
 # FOCKDUMP, JDUMP, KDUMP in MO representation
 # FOCKDUMP:
 # Fock matrix (exclude correlation potential)  x x 0 0
@@ -203,8 +504,10 @@ def read_hfdump(jdump, kdump, fockdump):
 # 2(pq|ii)  x x 0 0
 # KDUMP:
 # -(pi|iq)  x x 0 0
+# CORRPOTDUMP (optional, in the directory of FOCKDUMP by default):
+# correlation potential  x x 0 0
+# The dumps are parsed concurrently by nproc processes
     dic = {}
-    sys.stdout.write('Start reading %s\n' % fockdump)
     finp = open(fockdump, 'r')
     dat = re.split('[=,]', finp.readline())
     while dat[0]:
@@ -220,54 +523,37 @@ def read_hfdump(jdump, kdump, fockdump):
         elif 'END' in dat[0].upper():
             break
         dat = re.split('[=,]', finp.readline())
+    finp.close()
     norb = dic['NORB']
-    fock = numpy.zeros((norb,norb))
-    dat = finp.readline().split()
-    while dat:
-        i, j = map(int, dat[1:3])
-        if j != 0:
-            fock[i-1,j-1] = float(dat[0])
-        dat = finp.readline().split()
 
-    corrpot = numpy.zeros((norb,norb))
-    try:
-        with open('CORRPOTDUMP', 'r') as finp:
-            sys.stdout.write('Start reading CORRPOTDUMP\n')
-            dat = finp.readline()
-            while 'END' not in dat:
-                dat = finp.readline()
-            dat = finp.readline().split()
-            while dat:
-                i, j = map(int, dat[1:3])
-                corrpot[i-1,j-1] = float(dat[0])
-                dat = finp.readline().split()
-    except:
-        sys.stdout.write('CORRPOTDUMP not found\n')
-
-    sys.stdout.write('Start reading %s\n' % jdump)
-    vj = numpy.zeros((norb,norb))
-    vk = numpy.zeros((norb,norb))
-    finp = open(jdump, 'r')
-    dat = finp.readline()
-    while 'END' not in dat:
-        dat = finp.readline()
-    dat = finp.readline().split()
-    while dat:
-        i, j = map(int, dat[1:3])
-        vj[i-1,j-1] = float(dat[0])
-        dat = finp.readline().split()
+    if corrpotdump is None:
+        corrpotdump = os.path.join(os.path.dirname(fockdump), 'CORRPOTDUMP')
+    jobs = [(fockdump, norb, True), (jdump, norb, False),
+            (kdump, norb, False)]
+    if os.path.isfile(corrpotdump):
+        jobs.append((corrpotdump, norb, False))
+    else:
+        sys.stdout.write('%s not found\n' % corrpotdump)
+    for job in jobs:
+        sys.stdout.write('Start reading %s\n' % job[0])
 
-    sys.stdout.write('Start reading %s\n' % kdump)
-    finp = open(kdump, 'r')
-    dat = finp.readline()
-    while 'END' not in dat:
-        dat = finp.readline()
-    dat = finp.readline().split()
-    while dat:
-        i, j = map(int, dat[1:3])
-        vk[i-1,j-1] = float(dat[0])
-        dat = finp.readline().split()
-    finp.close()
+    if nproc is None:
+        nproc = multiprocessing.cpu_count()
+    nproc = min(nproc, len(jobs))
+    if nproc > 1:
+        pool = multiprocessing.Pool(nproc)
+        try:
+            mats = pool.map(_read_matrix_dump, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        mats = map(_read_matrix_dump, jobs)
+    fock, vj, vk = mats[:3]
+    if len(mats) > 3:
+        corrpot = mats[3]
+    else:
+        corrpot = numpy.zeros((norb,norb))
 
     dic['MO_ENERGY'] = scipy.linalg.eigh(fock+corrpot)[0]
     dic['HCORE'] = fock-(vj+vk)
@@ -275,28 +561,193 @@ def read_hfdump(jdump, kdump, fockdump):
     dic['K'] = vk
     return dic
 
-def convert_clustdump(path, h5name):
-    clustdump = os.path.join(path, 'FCIDUMP.CLUST.GTO')
-    jdump     = os.path.join(path, 'JDUMP')
-    kdump     = os.path.join(path, 'KDUMP')
-    fockdump  = os.path.join(path, 'FOCKDUMP')
-    hfdic = read_hfdump(jdump, kdump, fockdump)
-    dic = read_clustdump(clustdump, hfdic)
-    mo_coeff = dic['MO_COEFF']
-    hfdic['HCORE'] = reduce(numpy.dot, (mo_coeff, hfdic['HCORE'], mo_coeff.T))
-    hfdic['J'] = reduce(numpy.dot, (mo_coeff, hfdic['J'], mo_coeff.T))
-    hfdic['K'] = reduce(numpy.dot, (mo_coeff, hfdic['K'], mo_coeff.T))
-    dic.update(hfdic)
-    if h5dump is None:
-        h5dump = clustdump+'.h5'
-    f = h5py.File(h5dump, 'w')
-    for k,v in dic.items():
-        sys.stdout.write('h5dump %s\n' % k)
-        f[k] = v
-    f.close()
+# Binary exchange with VASP, in place of the text CorrPot and dumps.  A file
+# is BIN_MAGIC followed by records of
+#   name    char[16], blank padded
+#   type    char[4], 'f8' (float64) or 'i8' (int64), blank padded
+#   ndim    int32
+#   shape   int64[ndim]
+#   data    the prod(shape) elements, C order (row major)
+# everything little-endian.  Fortran writes them with access='stream'.
+BIN_MAGIC = 'DMETBIN1'
+_BIN_TYPES = {'f8': numpy.dtype('<f8'), 'i8': numpy.dtype('<i8')}
+
+def write_bindump(fname, records):
+    '''records is a list of (name, value) or a dict'''
+    if isinstance(records, dict):
+        records = sorted(records.items())
+    tmpname = '%s.tmp%d' % (fname, os.getpid())
+    with open(tmpname, 'wb') as f:
+        f.write(BIN_MAGIC)
+        for name, val in records:
+            val = numpy.asarray(val)
+            if val.dtype.kind in 'biu':
+                typ = 'i8'
+            else:
+                typ = 'f8'
+            val = numpy.asarray(val, dtype=_BIN_TYPES[typ], order='C')
+            f.write(struct.pack('<16s4si', name.ljust(16), typ.ljust(4),
+                                val.ndim))
+            f.write(struct.pack('<%dq' % val.ndim, *val.shape))
+            f.write(val.tobytes())
+    os.rename(tmpname, fname)
+
+def read_bindump(fname):
+    '''{name: value}, the 0-d records as python numbers'''
+    dic = {}
+    with open(fname, 'rb') as f:
+        if f.read(len(BIN_MAGIC)) != BIN_MAGIC:
+            raise ValueError('%s is not a binary dump' % fname)
+        while True:
+            head = f.read(24)
+            if not head:
+                break
+            if len(head) != 24:
+                raise ValueError('%s is truncated' % fname)
+            name, typ, ndim = struct.unpack('<16s4si', head)
+            shape = f.read(8*ndim)
+            if len(shape) != 8*ndim:
+                raise ValueError('%s: record %s is truncated' %
+                                 (fname, name.strip()))
+            shape = struct.unpack('<%dq' % ndim, shape)
+            dtype = _BIN_TYPES[typ.strip()]
+            count = int(numpy.prod(shape))
+            val = numpy.fromfile(f, dtype=dtype, count=count)
+            if val.size != count:
+                raise ValueError('%s: record %s is truncated' %
+                                 (fname, name.strip()))
+            if not dtype.isnative:
+                val = val.astype(dtype.newbyteorder('='))
+            if ndim == 0:
+                dic[name.strip()] = val[0].item()
+            else:
+                dic[name.strip()] = val.reshape(shape)
+    return dic
+
+def write_corrpot(path, vdump, binary=False):
+    '''CorrPot for VASP: one value per line, or CorrPot.bin'''
+    if binary:
+        write_bindump(os.path.join(path, 'CorrPot'+BIN_SUFFIX),
+                      [('CORRPOT', vdump)])
+    else:
+        with open(os.path.join(path, 'CorrPot'), 'w') as fcorrpot:
+            fcorrpot.write(''.join(['%.16g\n' % v for v in vdump.ravel()]))
+
+def read_corrpot(path, binary=False):
+    if binary:
+        return read_bindump(os.path.join(path, 'CorrPot'+BIN_SUFFIX))['CORRPOT']
+    else:
+        v = numpy.array([float(x) for x in
+                         open(os.path.join(path, 'CorrPot')).read().split()])
+        n = int(round(numpy.sqrt(v.size)))
+        return v.reshape(n,n)
+
+def read_hfdump_bin(jdump, kdump, fockdump, corrpotdump=None, nproc=None):
+    '''read_hfdump of the binary dumps.  FOCKDUMP.bin has NORB, NELEC, MS2,
+    UHF and FOCK, the others J, K and CORRPOT.  nproc is not used'''
+    fdic = read_bindump(fockdump)
+    dic = {'NORB': fdic['NORB'], 'NELEC': fdic['NELEC'], 'MS2': fdic['MS2'],
+           'UHF': bool(fdic['UHF'])}
+    norb = dic['NORB']
+    if corrpotdump is None:
+        corrpotdump = os.path.join(os.path.dirname(fockdump),
+                                   'CORRPOTDUMP'+BIN_SUFFIX)
+    if os.path.isfile(corrpotdump):
+        corrpot = read_bindump(corrpotdump)['CORRPOT']
+    else:
+        sys.stdout.write('%s not found\n' % corrpotdump)
+        corrpot = numpy.zeros((norb,norb))
+    fock = fdic['FOCK']
+    vj = read_bindump(jdump)['J']
+    vk = read_bindump(kdump)['K']
+    dic['MO_ENERGY'] = scipy.linalg.eigh(fock+corrpot)[0]
+    dic['HCORE'] = fock-(vj+vk)
+    dic['J'] = vj
+    dic['K'] = vk
+    return dic
+
+def read_clustdump_bin(clustdump, hfdic):
+    '''read_clustdump of FCIDUMP.CLUST.GTO.bin.  It has the header items of
+    the text dump (ORBIND 1-based) and H1EMB, MO_COEFF, EMBASIS (on MO),
+    CORRPOT and the 8-fold packed ERI'''
+    sys.stdout.write('Start reading %s\n' % clustdump)
+    dic = read_bindump(clustdump)
+    for k in ('H1EMB', 'MO_COEFF', 'EMBASIS', 'ERI'):
+        if k not in dic:
+            raise RuntimeError('%s not in %s' % (k, clustdump))
+    if 'CORRPOT' not in dic:
+        dic['CORRPOT'] = numpy.zeros_like(dic['H1EMB'])
+    dic['ORBIND'] = [i-1 for i in dic['ORBIND'].ravel().tolist()]
+    dic['NEMB'] = dic['NORB']
+    dic['EMBASIS'] = numpy.dot(dic['MO_COEFF'], dic['EMBASIS'])
+    return dic
+
+def convert_clustdump(path, h5name=None, force=False, nproc=None,
+                      hfdic=None):
+    '''Write the HDF5 sidecar of the dumps in path.  Return False if the
+    sidecar was valid and kept'''
+    if h5name is None:
+        h5name = os.path.join(path, 'FCIDUMP.CLUST.GTO.h5')
+    if not force and h5dump_valid(path, h5name):
+        return False
+    stamps = dump_stamps(path)
+    write_h5dump(h5name, parse_vaspdump(path, nproc, hfdic), stamps)
+    return True
+
+def _convert_one(args):
+    path, force = args
+    try:
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        try:
+# the pool workers cannot start the processes of read_hfdump
+            return path, convert_clustdump(path, force=force, nproc=1), None
+        finally:
+            sys.stdout = stdout
+    except Exception as err:
+        return path, None, '%s: %s' % (err.__class__.__name__, err)
+
+def main(argv=None):
+    '''python vasphf.py [-j nproc] [-f] dir [dir ...]
+    Convert the VASP dumps of each directory to FCIDUMP.CLUST.GTO.h5'''
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert VASP dumps '
+                                     '(FCIDUMP.CLUST.GTO, JDUMP, KDUMP, '
+                                     'FOCKDUMP, CORRPOTDUMP) to HDF5')
+    parser.add_argument('paths', nargs='+', help='dump directories')
+    parser.add_argument('-j', '--nproc', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='directories converted at the same time')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='rebuild the valid sidecars too')
+    args = parser.parse_args(argv)
+
+    jobs = [(path, args.force) for path in args.paths]
+    nproc = max(1, min(args.nproc, len(jobs)))
+    if nproc > 1:
+        pool = multiprocessing.Pool(nproc)
+        try:
+            results = pool.map(_convert_one, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = map(_convert_one, jobs)
+    nfail = 0
+    for path, converted, err in results:
+        if err is not None:
+            sys.stdout.write('%s: failed, %s\n' % (path, err))
+            nfail += 1
+        elif converted:
+            sys.stdout.write('%s: converted\n' % path)
+        else:
+            sys.stdout.write('%s: up to date\n' % path)
+    return nfail
 
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(main())
+
     mol = gto.Mole()
     mol.verbose = 5
     mol.build()
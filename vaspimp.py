@@ -30,8 +30,7 @@ class OneImp(dmet_hf.RHF):
         self.imp_site = None
         self.bath_orb = None
         self.env_orb = None
-        nemb = self.entire_scf._vaspdump['EMBASIS'].shape[1]
-        self._eri = ao2mo.restore(8, self.eri_on_impbas(mol), nemb)
+        self._eri = self.eri_on_impbas(mol)
         mo_orth = effscf.mo_coeff[:,effscf.mo_occ>1e-15]
         self.impbas_coeff = self.entire_scf._vaspdump['EMBASIS']
         assert(numpy.linalg.norm(self.impbas_coeff) > 1e-10) # ensure embasis has been read
@@ -70,9 +69,16 @@ class OneImp(dmet_hf.RHF):
     def get_ovlp(self, mol=None):
         return numpy.eye(self.entire_scf._vaspdump['NEMB'])
 
+# The dump holds the 8-fold ERI.  Hand out the array of the dump (mapped from
+# the HDF5 file) instead of a copy; it is shared by all calls
     def eri_on_impbas(self, mol):
-        return ao2mo.restore(8, self.entire_scf._vaspdump['ERI'],
-                             self.entire_scf._vaspdump['NEMB'])
+        eri = self.entire_scf._vaspdump['ERI']
+        nemb = self.entire_scf._vaspdump['NEMB']
+        npair = nemb*(nemb+1)//2
+        if eri.size == npair*(npair+1)//2:
+            return eri.reshape(-1)
+        else:
+            return ao2mo.restore(8, eri, nemb)
 
     def kernel(self, *args, **kwargs):
         return self.imp_scf(*args, **kwargs)
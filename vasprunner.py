@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+#
+# Run the second VASP pass (HF with the correlation potential CorrPot, then
+# the JK and cluster dumps) in the background.  The job is polled: stdout and
+# stderr are copied to vasp.stdout and vasp.stderr as they come, a job running
+# longer than timeout seconds is killed, and each dump is reported when it is
+# complete.  The HF dumps can then be read while VASP is still writing
+# FCIDUMP.CLUST.GTO.
+#
+# job = vasprunner.VaspJob('bash pass2.sh', path, timeout=3600).start()
+# while job.poll() == vasprunner.RUNNING:
+#     if job.ready(vasprunner.HF_DUMPS):
+#         ...
+#     time.sleep(vasprunner.POLL_INTERVAL)
+# job.wait()
+#
+
+import os, sys
+import time
+import signal
+import threading
+import subprocess
+import collections
+
+# seconds between the checks of the running job
+POLL_INTERVAL = .2
+# a dump is complete when it has not changed for READY_SETTLE seconds, or
+# when VASP has finished
+READY_SETTLE = 2.
+# lines of stdout/stderr kept for the error message
+OUTPUT_TAIL = 50
+
+# job status
+RUNNING = 'running'
+DONE    = 'done'
+FAILED  = 'failed'
+
+HF_DUMPS = ('JDUMP', 'KDUMP', 'FOCKDUMP')
+REQUIRED_DUMPS = HF_DUMPS + ('FCIDUMP.CLUST.GTO',)
+# written with the HF dumps, optional for vasphf
+CORRPOT_DUMP = 'CORRPOTDUMP'
+
+
+class VaspError(RuntimeError):
+    '''reason is 'exit' (non-zero exit status), 'timeout' or 'dump' (a
+    required dump was not written)'''
+    def __init__(self, reason, returncode, output, path):
+        self.reason = reason
+        self.returncode = returncode
+        self.output = output
+        self.path = path
+        RuntimeError.__init__(self, 'VASP failed (%s, returncode %s) in %s\n%s'
+                              % (reason, returncode, path, output))
+
+def _stat(fname):
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime)
+
+def _copy_stream(pipe, fout, tail):
+    for line in iter(pipe.readline, ''):
+        fout.write(line)
+        fout.flush()
+        tail.append(line)
+    pipe.close()
+
+
+class VaspJob(object):
+    def __init__(self, cmd, path='.', timeout=None, dumps=REQUIRED_DUMPS):
+        self.cmd = cmd
+        self.path = path
+        self.timeout = timeout
+        self.dumps = dumps
+        self.proc = None
+        self.status = None
+        self.error = None
+        self.t0 = None
+        self.tail = collections.deque(maxlen=OUTPUT_TAIL)
+        self._old = {}
+        self._seen = {}
+        self._threads = []
+
+    def start(self):
+# the dumps of the previous pass are recognized by their stat.  All files are
+# recorded, so that ready() can be asked for any dump
+        self._old = dict([(name, _stat(os.path.join(self.path, name)))
+                          for name in os.listdir(self.path)])
+        self._seen = {}
+        self._files = [open(os.path.join(self.path, 'vasp.stdout'), 'w'),
+                       open(os.path.join(self.path, 'vasp.stderr'), 'w')]
+# VASP is the leader of its own process group, so that a timeout kills mpirun
+# and all its children
+        self.proc = subprocess.Popen(self.cmd, shell=True, cwd=self.path,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE,
+                                     preexec_fn=os.setsid)
+        self.t0 = time.time()
+        self._threads = []
+        for pipe, fout in zip((self.proc.stdout, self.proc.stderr),
+                              self._files):
+            t = threading.Thread(target=_copy_stream,
+                                 args=(pipe, fout, self.tail))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+        self.status = RUNNING
+        return self
+
+    def _update(self, name):
+        st = _stat(os.path.join(self.path, name))
+        if st is None or st == self._old.get(name):
+            self._seen.pop(name, None)
+            return False
+        if name not in self._seen or self._seen[name][0] != st:
+            self._seen[name] = (st, time.time())
+        return True
+
+    def ready(self, names):
+        '''Whether the dumps names have been written by this job and are
+        complete'''
+# update all of them, so that they settle at the same time rather than one
+# after the other
+        written = [self._update(name) for name in names]
+        if not all(written):
+            return False
+        if self.status == RUNNING:
+            now = time.time()
+            return all([now - self._seen[name][1] >= READY_SETTLE
+                        for name in names])
+        return True
+
+    def stamps(self, names):
+        '''(inode, size, mtime) of the dumps, to find out whether a dump read
+        early has been rewritten later'''
+        return [_stat(os.path.join(self.path, name)) for name in names]
+
+    def _finish(self, reason=None):
+        for t in self._threads:
+            t.join()
+        for f in self._files:
+            f.close()
+        if reason is None and self.proc.returncode != 0:
+            reason = 'exit'
+        if reason is None and not self.ready(self.dumps):
+            reason = 'dump'
+        if reason is None:
+            self.status = DONE
+        else:
+            self.status = FAILED
+            self.error = VaspError(reason, self.proc.returncode,
+                                   ''.join(self.tail), self.path)
+            sys.stderr.write('VASP output in %s\n' % self.path)
+
+    def poll(self):
+        '''Status of the job, RUNNING, DONE or FAILED'''
+        if self.status == RUNNING:
+            if self.proc.poll() is not None:
+                self.status = None
+                self._finish()
+            elif self.timeout is not None \
+                 and time.time() - self.t0 > self.timeout:
+                self.kill()
+                self.status = None
+                self._finish('timeout')
+        return self.status
+
+    def kill(self):
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.proc.wait()
+
+    def wait(self):
+        '''Wait for the job.  Raise VaspError if it failed'''
+        while self.poll() == RUNNING:
+            time.sleep(POLL_INTERVAL)
+        if self.error is not None:
+            raise self.error
+        return self